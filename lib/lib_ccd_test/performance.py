@@ -0,0 +1,186 @@
+"""
+Performance measurements of test runs.
+
+dd_test.py --record stores a performance baseline (performance.json) next to
+the recorded results:
+
+    wall_time : wall time of the decomposition [s]
+    nr_spectra : number of fitted spectra
+    spectra_per_second : nr_spectra / wall_time
+    mean_iterations : mean number of iterations per spectrum
+    max_rss : peak resident set size of the decomposition process [kB]
+    calibration : run time of a fixed numerical workload on the recording
+                  machine [s]
+    normalized_time : wall_time / calibration
+
+Test runs are compared using the normalized time, so baselines recorded on a
+different machine remain usable. A performance regression is flagged if the
+normalized time exceeds the baseline by more than the tolerance.
+"""
+import os
+import time
+import json
+import shutil
+import subprocess
+
+import numpy as np
+
+
+# the test configurations still use the names of the old binaries
+legacy_binaries = {
+    'dd_single.py': 'ccd_single',
+    'dd_time.py': 'ccd_time',
+}
+
+baseline_filename = 'performance.json'
+
+# default relative tolerance of the normalized run time
+default_tolerance = 0.25
+
+
+def split_command(cmd):
+    """Split leading environment variable assignments (e.g. DD_COND=1) from
+    the command. Replace the binary by its current name if the old name can
+    not be found.
+
+    Returns
+    -------
+    env : dict with the environment variables
+    cmd : command list starting with the binary
+    """
+    env = {}
+    while cmd and '=' in cmd[0] and not cmd[0].startswith('-'):
+        key, value = cmd.pop(0).split('=', 1)
+        env[key] = value
+
+    binary = cmd[0]
+    if(shutil.which(binary) is None and binary in legacy_binaries and
+       shutil.which(legacy_binaries[binary]) is not None):
+        cmd[0] = legacy_binaries[binary]
+    return env, cmd
+
+
+def run_command(cmd, env, log_file, cwd=None):
+    """Run the command with the additional environment variables, write
+    stdout and stderr to the log file and return the return code, the wall
+    time and the peak RSS [kB] of the process
+    """
+    full_env = os.environ.copy()
+    full_env.update(env)
+    start_time = time.time()
+    with open(log_file, 'w') as fid:
+        p = subprocess.Popen(cmd, stdout=fid, stderr=subprocess.STDOUT,
+                             env=full_env, cwd=cwd)
+        _, status, rusage = os.wait4(p.pid, 0)
+    wall_time = time.time() - start_time
+    if os.WIFEXITED(status):
+        returncode = os.WEXITSTATUS(status)
+    else:
+        returncode = -os.WTERMSIG(status)
+    # the process was already reaped by wait4
+    p.returncode = returncode
+    return returncode, wall_time, rusage.ru_maxrss
+
+
+def _workload():
+    """Fixed numerical workload similar to the Gauss-Newton updates of the
+    decomposition (complex forward responses and dense linear systems)
+    """
+    random = np.random.RandomState(0)
+    omega_tau = np.logspace(-5, 5, 120)[:, np.newaxis] * np.logspace(
+        -5, 5, 160)[np.newaxis, :]
+    for i in range(0, 100):
+        kernel = 1 - 1 / (1 + (1j * omega_tau) ** 0.5)
+        J = np.vstack((kernel.real, kernel.imag))
+        A = J.T.dot(J) + np.eye(J.shape[1])
+        np.linalg.solve(A, random.normal(size=J.shape[1]))
+
+
+def calibrate(repeats=5):
+    """Return the run time of the calibration workload on this machine (best
+    of repeats runs). The calibration is repeated for each test run, directly
+    after the run, as the speed of (virtual) machines can vary over time.
+    """
+    # warm-up (memory allocation, initialization of the BLAS library)
+    _workload()
+    times = []
+    for i in range(0, repeats):
+        start_time = time.time()
+        _workload()
+        times.append(time.time() - start_time)
+    return min(times)
+
+
+def get_performance(wall_time, max_rss, data_file, output_dir):
+    """Return the performance dict of a test run
+
+    Parameters
+    ----------
+    wall_time : wall time of the decomposition [s]
+    max_rss : peak RSS of the decomposition [kB]
+    data_file : data file of the test (used to count the spectra)
+    output_dir : output directory of the decomposition (used to read the
+                 number of iterations)
+    """
+    nr_spectra = np.atleast_2d(np.loadtxt(data_file)).shape[0]
+    nr_its_file = output_dir + os.sep + 'nr_iterations.dat'
+    if(os.path.isfile(nr_its_file)):
+        mean_iterations = float(np.mean(np.loadtxt(nr_its_file)))
+    else:
+        mean_iterations = None
+
+    calibration = calibrate()
+    performance = {
+        'wall_time': wall_time,
+        'nr_spectra': nr_spectra,
+        'spectra_per_second': nr_spectra / wall_time,
+        'mean_iterations': mean_iterations,
+        'max_rss': max_rss,
+        'calibration': calibration,
+        'normalized_time': wall_time / calibration,
+    }
+    return performance
+
+
+def save_baseline(test_dir, performance):
+    with open(test_dir + os.sep + baseline_filename, 'w') as fid:
+        json.dump(performance, fid, indent=4)
+
+
+def load_baseline(test_dir):
+    """Return the performance baseline of a recorded test directory, or None if
+    no baseline was recorded
+    """
+    filename = test_dir + os.sep + baseline_filename
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, 'r') as fid:
+        return json.load(fid)
+
+
+def compare(performance, baseline, tolerance=default_tolerance):
+    """Compare the performance of a test run to the baseline
+
+    Returns
+    -------
+    result : dict with the keys
+             ratio : normalized time of the run / normalized time of the
+                     baseline
+             regression : True if ratio exceeds 1 + tolerance
+             message : description of the comparison
+    """
+    ratio = performance['normalized_time'] / baseline['normalized_time']
+    regression = bool(ratio > 1 + tolerance)
+    message = ''.join((
+        'normalized run time {0:.2f} (baseline: {1:.2f}), '.format(
+            performance['normalized_time'], baseline['normalized_time']),
+        'ratio {0:.2f}, tolerance {1:.0f} %'.format(ratio, tolerance * 100),
+    ))
+    if regression:
+        message = 'PERFORMANCE REGRESSION: ' + message
+    result = {
+        'ratio': ratio,
+        'regression': regression,
+        'message': message,
+    }
+    return result
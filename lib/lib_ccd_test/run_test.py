@@ -1,8 +1,10 @@
 import os
-import sys
 import re
+import shlex
 import shutil
-import subprocess
+import importlib.util
+
+import lib_ccd_test.performance as performance
 
 # this is the hard-coded subdirectory where tests are stored
 all_tests_directory = 'test_results'
@@ -69,13 +71,31 @@ def get_cmd(testcfg_file):
     return cmd
 
 
-def run_test(test_dir):
+def load_test_func(directory):
+    """
+    Import the test_func.py module of a test directory without modifying
+    sys.path. The module is loaded under a name unique to the directory, so
+    multiple test directories can be tested in one process.
+    """
+    filename = os.path.abspath(directory + os.sep + 'test_func.py')
+    name = 'test_func_{0}'.format(abs(hash(filename)))
+    spec = importlib.util.spec_from_file_location(name, filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_test(test_dir, tolerance=performance.default_tolerance):
     """
     Execute the actual test
 
     # call cdd with stored parameters
     # execute test snippet
     # -> the test snippet should yield errors usable by nosetests...
+
+    If a performance baseline was recorded in test_dir, return the comparison
+    of the run time to the baseline (see lib_ccd_test.performance.compare),
+    otherwise return None.
     """
     print('Run test')
     if(os.path.isdir('active_run')):
@@ -93,12 +113,20 @@ def run_test(test_dir):
     with open('active_run.sh', 'w') as fid:
         fid.write(cmd)
 
-    # subprocess.call(test_cmd, shell=True, stdin=PIPE)
-    p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE)
-    p.wait()
+    # keep the output for debug purposes
+    env, cmd_list = performance.split_command(shlex.split(cmd))
+    returncode, wall_time, max_rss = performance.run_command(
+        cmd_list, env, 'active_run.log')
 
-    sys.path.append(os.getcwd())
     # run the test
-    import test_func
+    test_func = load_test_func(os.getcwd())
     test_func.test_regressions(old_result=test_dir, new_result='active_run')
+
+    baseline = performance.load_baseline(test_dir)
+    if baseline is None:
+        return None
+    perf = performance.get_performance(
+        wall_time, max_rss, 'data.dat', 'active_run')
+    result = performance.compare(perf, baseline, tolerance)
+    print(result['message'])
+    return result
@@ -0,0 +1,194 @@
+"""
+Run all recorded regression tests below a directory in parallel and collect
+the results in one report.
+
+A test case is a directory containing data.dat, frequencies.dat, test.cfg and
+test_func.py (see dd_test.py --init). For each test case the decomposition is
+run as configured in test.cfg, and the regression checks of test_func.py are
+applied against the last recorded result in test_results/. In addition, the
+following performance numbers are recorded:
+
+    wall_time : wall time of the decomposition [s]
+    max_rss : peak resident set size of the decomposition [kB]
+    nr_iterations : number of iterations of each spectrum
+
+If a performance baseline was recorded (dd_test.py --record), the normalized
+run time is compared to the baseline (see lib_ccd_test.performance). Test
+cases that pass the regression checks but exceed the baseline by more than
+the tolerance get the status 'slow'.
+
+The report is a JSON file with one record per test case.
+"""
+import io
+import os
+import json
+import shlex
+import shutil
+import socket
+import datetime
+import platform
+import traceback
+import contextlib
+from functools import partial
+from multiprocessing import Pool
+
+import numpy as np
+
+import lib_ccd_test.run_test as ccd_test
+import lib_ccd_test.performance as performance
+
+
+def discover_tests(directory):
+    """Return the sorted list of all test case directories below directory
+    """
+    test_cases = []
+    for root, dirs, files in os.walk(directory):
+        # do not descend into recorded or active results
+        dirs[:] = sorted(
+            x for x in dirs if x not in (ccd_test.all_tests_directory,
+                                         'active_run'))
+        if all(x in files for x in ('data.dat', 'frequencies.dat',
+                                    'test.cfg', 'test_func.py')):
+            test_cases.append(os.path.abspath(root))
+    return sorted(test_cases)
+
+
+def run_test_case(test_case, tolerance=performance.default_tolerance):
+    """Run one test case and return its record for the report
+    """
+    record = {
+        'name': test_case,
+        'status': 'error',
+        'message': '',
+        'returncode': None,
+        'wall_time': None,
+        'max_rss': None,
+        'nr_iterations': None,
+        'performance': None,
+        'baseline': None,
+    }
+    active_run = os.path.join(test_case, 'active_run')
+    log_file = os.path.join(test_case, 'active_run.log')
+    try:
+        if(os.path.isdir(active_run)):
+            shutil.rmtree(active_run)
+
+        cmd = []
+        for line in ccd_test.get_cmd(os.path.join(test_case, 'test.cfg')):
+            cmd += shlex.split(line)
+        env, cmd = performance.split_command(cmd)
+        cmd += ['-f', os.path.join(test_case, 'frequencies.dat'),
+                '--data_file', os.path.join(test_case, 'data.dat'),
+                '-o', active_run,
+                '--output_format', 'ascii']
+
+        returncode, wall_time, max_rss = performance.run_command(
+            cmd, env, log_file)
+        record['returncode'] = returncode
+        record['wall_time'] = wall_time
+        record['max_rss'] = max_rss
+        if returncode != 0:
+            record['message'] = 'decomposition failed, see {0}'.format(
+                log_file)
+            return record
+
+        nr_its_file = os.path.join(active_run, 'nr_iterations.dat')
+        if(os.path.isfile(nr_its_file)):
+            record['nr_iterations'] = np.atleast_1d(
+                np.loadtxt(nr_its_file)).astype(int).tolist()
+
+        test_dir = ccd_test.get_test_dir_name(
+            os.path.join(test_case, ccd_test.all_tests_directory), last=True)
+        test_func = ccd_test.load_test_func(test_case)
+        output = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(output):
+                test_func.test_regressions(
+                    old_result=test_dir, new_result=active_run)
+            record['status'] = 'ok'
+        except AssertionError:
+            record['status'] = 'fail'
+            record['message'] = output.getvalue()[-2000:]
+
+        record['performance'] = performance.get_performance(
+            wall_time, max_rss, os.path.join(test_case, 'data.dat'),
+            active_run)
+        baseline = performance.load_baseline(test_dir)
+        if baseline is not None:
+            record['baseline'] = performance.compare(
+                record['performance'], baseline, tolerance)
+            if(record['status'] == 'ok' and
+               record['baseline']['regression']):
+                record['status'] = 'slow'
+                record['message'] = record['baseline']['message']
+    except Exception:
+        record['message'] = traceback.format_exc()
+    return record
+
+
+def run_tests(test_cases, nr_cores=1,
+              tolerance=performance.default_tolerance):
+    """Run the test cases using nr_cores worker processes and return the list
+    of records
+    """
+    run_func = partial(run_test_case, tolerance=tolerance)
+    if(nr_cores == 1):
+        records = list(map(run_func, test_cases))
+    else:
+        p = Pool(nr_cores)
+        records = p.map(run_func, test_cases)
+        p.close()
+        p.join()
+    return records
+
+
+def summarize(records):
+    """Return the number of test cases for each status and the total wall
+    time
+    """
+    summary = {'nr_tests': len(records), 'wall_time': 0.0}
+    for status in ('ok', 'slow', 'fail', 'error'):
+        summary[status] = len([x for x in records if x['status'] == status])
+    summary['wall_time'] = sum(
+        x['wall_time'] for x in records if x['wall_time'] is not None)
+    return summary
+
+
+def save_report(filename, records):
+    """Write the records, a summary and information on the host to a JSON
+    file
+    """
+    report = {
+        'date': datetime.datetime.now().isoformat(),
+        'host': socket.gethostname(),
+        'platform': platform.platform(),
+        'summary': summarize(records),
+        'tests': records,
+    }
+    with open(filename, 'w') as fid:
+        json.dump(report, fid, indent=4)
+
+
+def format_summary(records):
+    """Return a short text table of the records
+    """
+    lines = ['{0:<6} {1:>9} {2:>10} {3:>7}  {4}'.format(
+        'status', 'time [s]', 'RSS [MB]', 'its', 'test')]
+    for record in records:
+        if record['wall_time'] is None:
+            wall_time = max_rss = 'n/a'
+        else:
+            wall_time = '{0:.2f}'.format(record['wall_time'])
+            max_rss = '{0:.1f}'.format(record['max_rss'] / 1024.0)
+        if record['nr_iterations'] is None:
+            its = 'n/a'
+        else:
+            its = '{0}'.format(sum(record['nr_iterations']))
+        lines.append('{0:<6} {1:>9} {2:>10} {3:>7}  {4}'.format(
+            record['status'], wall_time, max_rss, its, record['name']))
+    summary = summarize(records)
+    lines.append(
+        '{0} tests: {1} ok, {2} slow, {3} failed, {4} errors'.format(
+            summary['nr_tests'], summary['ok'], summary['slow'],
+            summary['fail'], summary['error']))
+    return '\n'.join(lines)
@@ -1,7 +1,11 @@
 # jupyter notebook app for ccd_single
+import io
 import os
 import logging
 import tempfile
+import threading
+import collections
+import concurrent.futures
 import shutil
 import datetime
 
@@ -14,11 +18,20 @@ import numpy as np
 import NDimInv.plot_helper
 plt, mpl = NDimInv.plot_helper.setup()
 import lib_dd.decomposition.ccd_single as ccd_single
+import lib_dd.decomposition.ccd_single_stateless as decomp_single_sl
 import lib_dd.config.cfg_single as cfg_single
 import lib_dd.plot
 
 
 class ccd_single_app(object):
+    # number of fit results kept in the cache
+    max_cache_size = 10
+    # cached results are used as starting models for new fits if lambda
+    # differs by less than this factor, and c differs by less than
+    # warm_start_max_c_change
+    warm_start_max_lambda_factor = 10.0
+    warm_start_max_c_change = 0.2
+
     def __init__(self, frequency_file, data_file, no_logging=False):
         self._setup_logger(disabled=no_logging)
         self._check_versions()
@@ -31,6 +44,13 @@ class ccd_single_app(object):
         # store containers for parameter groups here
         self.containers = {}
         self.vbox = None
+        # fits are run in the background, one at a time
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.future = None
+        self.cancel_event = threading.Event()
+        self.ccd_obj = None
+        # fit results of previous runs, keyed by the fit-relevant settings
+        self.fit_cache = collections.OrderedDict()
         self.print_data_summary()
 
         # we generate links to the online documentation. To simplify things,
@@ -576,8 +596,42 @@ class ccd_single_app(object):
             ),
         )
 
+        w_progress = widgets.IntProgress(
+            value=0,
+            min=0,
+            max=1,
+            description='Progress:',
+            style=self.style,
+            layout=widgets.Layout(width='50%'),
+        )
+        w_status = widgets.Label(value='')
+        w_cancel = widgets.Button(
+            description='Cancel',
+            disabled=True,
+            tooltip='Stop the fit after the current spectrum',
+        )
+        w_cancel.on_click(self.cancel_ccd)
+        hb_progress = widgets.HBox(
+            children=[
+                w_progress,
+                w_cancel,
+                w_status,
+            ],
+            layout=widgets.Layout(
+                width='100%',
+                align_items='center'
+            ),
+        )
+
+        # plots are added here as soon as they are available
+        w_results = widgets.VBox(())
+
         self.widgets.update({
             'run': w_run,
+            'cancel': w_cancel,
+            'progress': w_progress,
+            'status': w_status,
+            'results': w_results,
         })
 
         header = widgets.HTML(
@@ -587,6 +641,8 @@ class ccd_single_app(object):
         self.items.insert(0, header)
         self.items += [
             hb_run,
+            hb_progress,
+            w_results,
         ]
 
         self.vbox = widgets.VBox(self.items)
@@ -595,17 +651,9 @@ class ccd_single_app(object):
         display(self.vbox)
         display(HTML('<hr />'))
 
-    def run_ccd(self, button):
-        """Based on the GUI input, generate a configuration for the CCD and run
-        it
+    def _get_config(self):
+        """Generate a ccd_single configuration from the GUI input
         """
-        if self.widgets['nb_show_output'].value is True:
-            self.enable_logger()
-        else:
-            # show at least this note
-            print('Running CCD')
-            self.disable_logger()
-        logging.info('running CCD')
         # set environment variables
         os.environ['DD_COND'] = self.widgets['type_formulation'].value
         os.environ['DD_C'] = '{0:.2f}'.format(
@@ -621,6 +669,7 @@ class ccd_single_app(object):
         config['max_iterations'] = self.widgets['max_its'].value
         config['nr_terms_decade'] = self.widgets['nr_terms'].value
         config['data_format'] = self.widgets['data_format'].value
+        config['data_weighting'] = self.widgets['data_weighting'].value
 
         config['data_fmin'] = self.widgets['fmin'].value
         config['data_fmax'] = self.widgets['fmax'].value
@@ -650,83 +699,279 @@ class ccd_single_app(object):
 
         if self.widgets['use_norm'].value is True:
             config['norm'] = self.widgets['norm_value'].value
+        return config
+
+    def _get_cache_key(self, config):
+        """Return the settings that influence the fit results as a tuple. Plot
+        and output options are not part of the key.
+
+        The first two entries (lambda and c) are allowed to differ for warm
+        starts.
+        """
+        key = (
+            config['fixed_lambda'],
+            float(os.environ.get('DD_C', 1.0)),
+            os.environ.get('DD_COND', '0'),
+            config['data_format'],
+            config['nr_terms_decade'],
+            config['tausel'],
+            config['ignore_frequencies'],
+            config['data_fmin'],
+            config['data_fmax'],
+            config['norm'],
+            config['max_iterations'],
+            config['data_weighting'],
+        )
+        return key
+
+    def _add_to_cache(self, key, ccd_obj):
+        self.fit_cache[key] = ccd_obj
+        while len(self.fit_cache) > self.max_cache_size:
+            self.fit_cache.popitem(last=False)
+
+    def _get_warm_start_obj(self, key):
+        """Return the cached ccd object whose settings only differ in lambda
+        and/or c from the provided key, and are closest to it. Return None if
+        no such object is cached.
+        """
+        lam, c = key[0:2]
+        best = None
+        best_distance = None
+        for cached_key, ccd_obj in self.fit_cache.items():
+            if cached_key[2:] != key[2:]:
+                continue
+            cached_lam, cached_c = cached_key[0:2]
+            if cached_lam == lam:
+                lam_distance = 0
+            elif cached_lam > 0 and lam > 0:
+                lam_distance = np.abs(np.log10(float(lam) / cached_lam))
+                if lam_distance > np.log10(self.warm_start_max_lambda_factor):
+                    continue
+            else:
+                continue
+
+            c_distance = np.abs(cached_c - c)
+            if c_distance > self.warm_start_max_c_change:
+                continue
+
+            distance = lam_distance + c_distance
+            if best_distance is None or distance < best_distance:
+                best = ccd_obj
+                best_distance = distance
+        return best
+
+    def _get_plot_options(self):
+        """Return the state of the plot/output widgets. The values are stored
+        at the start of a fit so that changes during the fit have no effect.
+        """
+        keys = (
+            'generate_plot',
+            'generate_lcurve',
+            'generate_reg_strength',
+            'generate_it_plots',
+            'generate_output',
+        )
+        return {key: self.widgets[key].value for key in keys}
 
-        # generate a ccd object
-        ccd_obj = ccd_single.ccd_single(config)
-
-        # commence with the actual fitting
-        ccd_obj.fit_data()
-
-        # extract the last iteration
-        last_it = ccd_obj.results[0].iterations[-1]
-        if self.widgets['generate_plot'].value is True:
-            logging.info('plotting ... this may take a while')
-            # don't show in notebook
-            # plt.ioff()
-            # _ = last_it.plot()
-            # _
-            for spectrum in ccd_obj.results:
-                last_it = spectrum.iterations[-1]
-                self._plot(ccd_obj, last_it)
-
-        if self.widgets['generate_lcurve'].value is True:
-            for spectrum in ccd_obj.results:
-                last_it = spectrum.iterations[-1]
-                last_it.plot_lcurve()
-
-        if self.widgets['generate_reg_strength'].value is True:
-            for spectrum in ccd_obj.results:
-                last_it = spectrum.iterations[-1]
-                last_it.plot_reg_strengths()
-
-        if self.widgets['generate_it_plots'].value is True:
-            for spectrum in ccd_obj.results:
+    def run_ccd(self, button):
+        """Based on the GUI input, generate a configuration for the CCD and
+        start the fit in the background
+        """
+        if self.future is not None and not self.future.done():
+            self._set_status('A fit is already running')
+            return
+
+        if self.widgets['nb_show_output'].value is True:
+            self.enable_logger()
+        else:
+            self.disable_logger()
+        logging.info('running CCD')
+
+        config = self._get_config()
+        key = self._get_cache_key(config)
+
+        if key in self.fit_cache:
+            # only plot options changed, reuse the fit results
+            logging.info('using cached fit results')
+            ccd_obj = self.fit_cache[key]
+            fit_datas = decomp_single_sl._get_fit_datas(ccd_obj.data)
+            cached = True
+        else:
+            # generate a ccd object and prepare the data for each spectrum
+            ccd_obj = ccd_single.ccd_single(config)
+            ccd_obj.get_data_dd_single()
+            fit_datas = decomp_single_sl._get_fit_datas(ccd_obj.data)
+            cached = False
+
+            # warm start from previous results if only lambda or c changed
+            warm_obj = self._get_warm_start_obj(key)
+            if warm_obj is not None:
+                logging.info('starting from cached fit results')
+                for fit_data, ND in zip(fit_datas, warm_obj.results):
+                    fit_data['m0'] = ND.iterations[-1].m.copy()
+        self.ccd_obj = ccd_obj
+
+        self.widgets['results'].children = ()
+        self.widgets['progress'].max = len(fit_datas)
+        self.widgets['progress'].value = 0
+        self.widgets['run'].disabled = True
+        self.widgets['cancel'].disabled = False
+        self._set_status('Running CCD')
+
+        self.cancel_event.clear()
+        self.future = self.executor.submit(
+            self._fit_in_background,
+            ccd_obj,
+            fit_datas,
+            self._get_plot_options(),
+            key,
+            cached,
+        )
+        self.future.add_done_callback(self._fit_finished)
+
+    def cancel_ccd(self, button):
+        """Stop the running fit after the current spectrum
+        """
+        if self.future is not None and not self.future.done():
+            self.cancel_event.set()
+            self._set_status('Cancelling after the current spectrum')
+
+    def _set_status(self, message):
+        self.widgets['status'].value = message
+
+    def _fit_in_background(self, ccd_obj, fit_datas, plot_opts, key,
+                           cached=False):
+        """Fit the spectra one by one. Update the progress widget and plot each
+        spectrum as soon as it is finished. This function is run by
+        self.executor.
+
+        If cached is True, ccd_obj already contains the fit results and only
+        the plots are created.
+        """
+        nr_spectra = len(fit_datas)
+        results = []
+        for nr, fit_data in enumerate(fit_datas):
+            if self.cancel_event.is_set():
+                break
+            if cached:
+                ND = ccd_obj.results[nr]
+            else:
+                ND = decomp_single_sl.fit_one_spectrum(fit_data)
+            results.append(ND)
+
+            self.widgets['progress'].value = len(results)
+            self._set_status('Fitted spectrum {0} of {1}'.format(
+                len(results), nr_spectra))
+
+            if plot_opts['generate_plot'] is True:
+                norm_factor = fit_data['inv_opts']['norm_factors']
+                self._show_figures(self._plot(
+                    ND.iterations[-1], norm_factor
+                ))
+
+        ccd_obj.results = results
+        if self.cancel_event.is_set():
+            self._set_status('Cancelled after {0} of {1} spectra'.format(
+                len(results), nr_spectra))
+            return
+        self._add_to_cache(key, ccd_obj)
+
+        for fit_data, spectrum in zip(fit_datas, ccd_obj.results):
+            last_it = spectrum.iterations[-1]
+            if plot_opts['generate_lcurve'] is True:
+                figs, _ = last_it.plot_lcurve()
+                self._show_figures(figs)
+
+            if plot_opts['generate_reg_strength'] is True:
+                fig, _ = last_it.plot_reg_strengths()
+                self._show_figures([fig, ])
+
+            if plot_opts['generate_it_plots'] is True:
+                norm_factor = fit_data['inv_opts']['norm_factors']
                 for iteration in spectrum.iterations:
-                    self._plot(ccd_obj, iteration)
+                    self._show_figures(self._plot(iteration, norm_factor))
 
-        if self.widgets['generate_output'].value is True:
-            with tempfile.TemporaryDirectory() as outdir:
-                ccd_obj.save_to_directory(outdir)
+        if plot_opts['generate_output'] is True:
+            self._save_output(ccd_obj)
 
-                outfile = 'sip_results_{0}'.format(
-                    datetime.datetime.strftime(
-                        datetime.datetime.now(),
-                        '%Y%m%d_%H%M',
-                    )
-                )
+        self._set_status('finished')
 
-                shutil.make_archive(
-                    outfile,
-                    format='zip',
-                    root_dir=outdir + os.sep,
-                    verbose=True
+    def _fit_finished(self, future):
+        """Called when the background fit is finished (or failed)
+        """
+        self.widgets['run'].disabled = False
+        self.widgets['cancel'].disabled = True
+        exception = future.exception()
+        if exception is not None:
+            logging.error('CCD failed: {0}'.format(exception))
+            self._set_status('Error: {0}'.format(exception))
+
+    def _save_output(self, ccd_obj):
+        with tempfile.TemporaryDirectory() as outdir:
+            ccd_obj.save_to_directory(outdir)
+
+            outfile = 'sip_results_{0}'.format(
+                datetime.datetime.strftime(
+                    datetime.datetime.now(),
+                    '%Y%m%d_%H%M',
                 )
+            )
 
-            display(HTML(
-                self._help_url('data_formats.html#ascii-audit-format')
-            ))
-            display(HTML(
-                '<a href="{0}.zip" download>Download results</a>'.format(
-                    outfile
-                )
-            ))
+            shutil.make_archive(
+                outfile,
+                format='zip',
+                root_dir=outdir + os.sep,
+                verbose=True
+            )
 
-        print('finished')
+        self._add_result_widget(widgets.HTML(
+            self._help_url('data_formats.html#ascii-audit-format')
+        ))
+        self._add_result_widget(widgets.HTML(
+            '<a href="{0}.zip" download>Download results</a>'.format(
+                outfile
+            )
+        ))
+
+    def _add_result_widget(self, widget):
+        children = tuple(self.widgets['results'].children)
+        self.widgets['results'].children = children + (widget, )
 
-    def _plot(self, ccd_obj, it):
+    def _show_figures(self, figs):
+        """Render figures to png images and add them to the result area. This
+        works from the background thread, in contrast to displaying the
+        figures directly.
+        """
+        for fig in figs:
+            buffer = io.BytesIO()
+            fig.savefig(buffer, format='png')
+            plt.close(fig)
+            self._add_result_widget(
+                widgets.Image(value=buffer.getvalue(), format='png')
+            )
+
+    def _plot(self, it, norm_factor=None):
+        """Plot the spectrum and the RTD of one iteration
+
+        Returns
+        -------
+        figs : list of figures
+        """
         obj = lib_dd.plot.plot_iteration()
 
-        norm_factors = ccd_obj.data.get('norm_factors', 1)
-        D = it.Data.D / norm_factors
+        if norm_factor is None:
+            norm_factor = 1
+        D = it.Data.D / norm_factor
         M = it.Model.convert_to_M(it.m)
         # renormalize here? Why do we compute the forward solution again?
-        F = it.Model.F(M) / norm_factors
+        F = it.Model.F(M) / norm_factor
         # extra_size = int(
         #     np.sum([x[1][1] for x in it.Data.extra_dims.items()])
         # )
         # nr_spectra = max(1, extra_size)
 
         mpl.rcParams['figure.dpi'] = 250
+        figs = []
         # iterate over spectra
         for nr, (d, m) in enumerate(it.Model.DM_iterator()):
             # plot spectrum
@@ -738,6 +983,7 @@ class ccd_single_app(object):
             obj._plot_cre_cim(nr, [ax1, ax2], D[d], F[d], it)
             fig.tight_layout()
             fig.subplots_adjust(top=0.7)
+            figs.append(fig)
 
             # plot spectrum rmag_rpha
             fig, axes = plt.subplots(1, 2, figsize=(10 / 2.54, 5 / 2.54))
@@ -746,8 +992,11 @@ class ccd_single_app(object):
             ax2 = axes[1].twinx()
             fig.tight_layout()
             fig.subplots_adjust(top=0.7)
+            figs.append(fig)
 
             # plot rtd
             fig, axes = plt.subplots(1, 1, figsize=(10 / 2.54, 5 / 2.54))
             obj._plot_rtd(nr, axes, M[m], it)
             fig.tight_layout()
+            figs.append(fig)
+        return figs
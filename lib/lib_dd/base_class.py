@@ -18,8 +18,7 @@ import logging
 
 import numpy as np
 
-import NDimInv.plot_helper
-plt, mpl = NDimInv.plot_helper.setup()
+import lib_dd.plot_helper
 import lib_dd.int_pars as int_pars
 
 logger = logging.getLogger('lib_dd.main')
@@ -345,7 +344,7 @@ class starting_pars_3():
             m_list.append(chargeabilities * scale)
             pars_linear = np.hstack((self.rho0, chargeabilities * scale))
             pars = obj.convert_parameters(pars_linear)
-            re_mim = obj.forward(pars)
+            re_mim = obj.forward(pars)[obj.get_data_mask()]
             mim_f = re_mim[:, 1]
             mim_list.append(mim_f)
             # compute rms_mim
@@ -404,12 +403,13 @@ class starting_pars_3():
 
         plot_starting_model = False
         if(plot_starting_model):
+            plt, mpl = lib_dd.plot_helper.setup()
             # # plot
             fig, axes = plt.subplots(4, 1, figsize=(6, 7))
             # plot spectrum
             pars_linear = np.hstack((self.rho0, chargeabilities * x_min))
             pars = obj.convert_parameters(pars_linear)
-            re_mim = obj.forward(pars)
+            re_mim = obj.forward(pars)[obj.get_data_mask()]
             re_f = re_mim[:, 0]
             mim_f = re_mim[:, 1]
 
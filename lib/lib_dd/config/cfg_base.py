@@ -277,6 +277,49 @@ class cfg_base(dict):
             },
         )
 
+        self['stop_rms_rel'] = None
+        self.cfg['stop_rms_rel'] = self.cfg_obj(
+            type='float',
+            help=''.join((
+                'Stop the inversion if the relative change of the ',
+                'imaginary RMS between two iterations falls below this ',
+                'value',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--stop_rms_rel',
+                'metavar': 'FLOAT',
+            },
+        )
+
+        self['stop_model_rel'] = None
+        self.cfg['stop_model_rel'] = self.cfg_obj(
+            type='float',
+            help=''.join((
+                'Stop the inversion if the relative change of the model ',
+                'parameters (L2 norm) falls below this value',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--stop_model_rel',
+                'metavar': 'FLOAT',
+            },
+        )
+
+        self['max_lambda_failures'] = None
+        self.cfg['max_lambda_failures'] = self.cfg_obj(
+            type='int',
+            help=''.join((
+                'Stop the inversion after this number of lambda searches ',
+                'that did not improve the RMS',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--max_lambda_failures',
+                'metavar': 'INT',
+            },
+        )
+
         self['version'] = False
         self.cfg['version'] = self.cfg_obj(
             type='bool',
@@ -399,6 +442,9 @@ class cfg_base(dict):
             'tausel',
             'max_iterations',
             'data_weighting',
+            'stop_rms_rel',
+            'stop_model_rel',
+            'max_lambda_failures',
         )
         }
         # inv_opts['tausel'] = options.tausel
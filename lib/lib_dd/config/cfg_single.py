@@ -28,6 +28,239 @@ class cfg_single(cfg_base.cfg_base):
             }
         )
 
+        self['nan_handling'] = 'weights'
+        self.cfg['nan_handling'] = self.cfg_obj(
+            type='string',
+            help=''.join((
+                'Treatment of NaN values in the data: "weights" (default) ',
+                'keeps the common frequencies, assigns zero data weights ',
+                'to missing values and excludes them from the RMS values. ',
+                'The results equal those of "crop", which removes the ',
+                'corresponding frequencies for each spectrum, unless the ',
+                'lowest or highest frequency is missing',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--nan_handling',
+                'metavar': 'STRING',
+            },
+            possible_values=['crop', 'weights'],
+        )
+
+        self['triage'] = False
+        self.cfg['triage'] = self.cfg_obj(
+            type='bool',
+            help=''.join((
+                'Screen spectra before the inversion and skip spectra ',
+                'that do not meet the --triage_* thresholds. Results of ',
+                'skipped spectra are set to NaN',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--triage',
+                'action': 'store_true',
+            },
+        )
+
+        self['triage_min_capacitive'] = 0.5
+        self.cfg['triage_min_capacitive'] = self.cfg_obj(
+            type='float',
+            help=''.join((
+                'Triage: minimum fraction of data points with negative ',
+                'resistivity phase values',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--triage_min_capacitive',
+                'metavar': 'FLOAT',
+            },
+        )
+
+        self['triage_min_snr'] = 1.0
+        self.cfg['triage_min_snr'] = self.cfg_obj(
+            type='float',
+            help=''.join((
+                'Triage: minimum signal to noise ratio of the imaginary ',
+                'parts (noise estimated from second differences)',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--triage_min_snr',
+                'metavar': 'FLOAT',
+            },
+        )
+
+        self['triage_max_rms'] = None
+        self.cfg['triage_max_rms'] = self.cfg_obj(
+            type='float',
+            help=''.join((
+                'Triage: maximum relative RMS of the imaginary parts of ',
+                'the starting model response',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--triage_max_rms',
+                'metavar': 'FLOAT',
+            },
+        )
+
+        self['multigrid_nd'] = None
+        self.cfg['multigrid_nd'] = self.cfg_obj(
+            type='int',
+            help=''.join((
+                'Coarse-to-fine mode: first fit using this number of tau ',
+                'values per decade, then use the interpolated RTD as the ',
+                'starting model for the fit with --nr_terms',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--multigrid_nd',
+                'metavar': 'INT',
+            },
+        )
+
+        self['multigrid_fine_its'] = 5
+        self.cfg['multigrid_fine_its'] = self.cfg_obj(
+            type='int',
+            help=''.join((
+                'Coarse-to-fine mode: maximum number of iterations on the ',
+                'fine tau grid',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--multigrid_fine_its',
+                'metavar': 'INT',
+            },
+        )
+
+        self['solver'] = 'ndiminv'
+        self.cfg['solver'] = self.cfg_obj(
+            type='string',
+            help=''.join((
+                'Inversion solver: "ndiminv" runs one inversion per ',
+                'spectrum, "batch" inverts --batch_size spectra at once',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--solver',
+                'metavar': 'STRING',
+            },
+            possible_values=['ndiminv', 'batch'],
+        )
+
+        self['batch_size'] = 64
+        self.cfg['batch_size'] = self.cfg_obj(
+            type='int',
+            help='Number of spectra inverted at once by the batch solver',
+            cmd_dict={
+                'short': None,
+                'long': '--batch_size',
+                'metavar': 'INT',
+            },
+        )
+
+        self['update_space'] = 'auto'
+        self.cfg['update_space'] = self.cfg_obj(
+            type='string',
+            help=''.join((
+                'Batch solver: solve the update equations in the "model" ',
+                'space or in the "data" space. "auto" selects the smaller ',
+                'system, i.e. the data space for dense tau grids',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--update_space',
+                'metavar': 'STRING',
+            },
+            possible_values=['auto', 'model', 'data'],
+        )
+
+        self['precision'] = 'float64'
+        self.cfg['precision'] = self.cfg_obj(
+            type='string',
+            help=''.join((
+                'Batch solver: compute kernels, forward responses, ',
+                'Jacobians and updates in "float64" or "float32" precision. ',
+                'float32 also reduces the precision of the output files',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--precision',
+                'metavar': 'STRING',
+            },
+            possible_values=['float64', 'float32'],
+        )
+
+        self['profile'] = False
+        self.cfg['profile'] = self.cfg_obj(
+            type='bool',
+            help=''.join((
+                'Record the time spent in each stage of the fit and write ',
+                'it to profile.json in the output directory. Can also be ',
+                'activated using the environment variable CCD_PROFILE=1',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--profile',
+                'action': 'store_true',
+            },
+        )
+
+        self['progress_interval'] = 10.0
+        self.cfg['progress_interval'] = self.cfg_obj(
+            type='float',
+            help=''.join((
+                'Minimum time in seconds between two progress reports. The ',
+                'progress is logged and written to status.json in the ',
+                'output directory',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--progress_interval',
+                'metavar': 'FLOAT',
+            },
+        )
+
+        self['fast_plots'] = False
+        self.cfg['fast_plots'] = self.cfg_obj(
+            type='bool',
+            help=''.join((
+                'Plot the final iterations (--plot) by reusing one figure ',
+                'per plot process and only updating its data',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--fast_plots',
+                'action': 'store_true',
+            },
+        )
+
+        self['plot_dpi'] = 300
+        self.cfg['plot_dpi'] = self.cfg_obj(
+            type='int',
+            help='Resolution of the --fast_plots output files',
+            cmd_dict={
+                'short': None,
+                'long': '--plot_dpi',
+                'metavar': 'INT',
+            },
+        )
+
+        self['plot_format'] = 'jpg'
+        self.cfg['plot_format'] = self.cfg_obj(
+            type='string',
+            help=''.join((
+                'File format of the --fast_plots output files. "jpg" is ',
+                'faster to write than "png"',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--plot_format',
+                'metavar': 'STRING',
+            },
+            possible_values=['jpg', 'png'],
+        )
+
     def split_options(self):
         """
 
@@ -49,5 +282,12 @@ class cfg_single(cfg_base.cfg_base):
         # now add options specific to dd_single
         prep_opts['lambda'] = self['fixed_lambda']
         prep_opts['nr_cores'] = self['nr_cores']
+        prep_opts['nan_handling'] = self['nan_handling']
+        for key in ('triage', 'triage_min_capacitive', 'triage_min_snr',
+                    'triage_max_rms', 'multigrid_nd', 'multigrid_fine_its',
+                    'solver', 'batch_size', 'update_space', 'precision',
+                    'profile', 'progress_interval', 'fast_plots', 'plot_dpi',
+                    'plot_format'):
+            prep_opts[key] = self[key]
 
         return prep_opts, inv_opts
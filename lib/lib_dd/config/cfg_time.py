@@ -128,6 +128,21 @@ class cfg_time(cfg_base.cfg_base):
             }
         )
 
+        self['profile'] = False
+        self.cfg['profile'] = self.cfg_obj(
+            type='bool',
+            help=''.join((
+                'Record the time spent in each stage of the fit and write ',
+                'it to profile.json in the output directory. Can also be ',
+                'activated using the environment variable CCD_PROFILE=1',
+            )),
+            cmd_dict={
+                'short': None,
+                'long': '--profile',
+                'action': 'store_true',
+            },
+        )
+
     def split_options(self):
         """
         Extract options for two groups:
@@ -147,6 +162,7 @@ class cfg_time(cfg_base.cfg_base):
         prep_opts['tmi_first_order'] = self['tmi_first_order']
         prep_opts['time_weighting_rho0'] = self['time_weighting_rho0']
         prep_opts['time_weighting_mi'] = self['time_weighting_mi']
+        prep_opts['profile'] = self['profile']
         return prep_opts, inv_opts
 
 
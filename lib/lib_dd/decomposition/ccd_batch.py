@@ -0,0 +1,577 @@
+"""
+Batch Gauss-Newton solver for the single spectrum decomposition.
+
+The default solver runs one NDimInv inversion per spectrum. For spectra that
+share frequencies, relaxation times and the regularization, all steps of the
+inversion can be computed for many spectra at once:
+
+    * forward responses and Jacobians are computed using one kernel matrix
+      for all spectra
+    * the regularized normal equations are assembled for all spectra and all
+      test lambdas of the lambda search, and solved using one batched call to
+      np.linalg.solve
+    * for dense tau grids with more parameters than data points, these
+      systems are solved in the (smaller) data space
+    * converged spectra are masked out of the following iterations
+
+The procedure mirrors the NDimInv setup used by ccd_single_stateless: lambda
+search (or fixed lambda), parabolic steplength selection and the stopping
+criteria of lib_dd.decomposition.convergence, all based on the RMS of the
+imaginary parts. Missing data points (see nan_handling='weights') are
+excluded from the RMS values, which corresponds to cropping these points.
+
+The results are stored in the ND objects of the spectra, which only contain
+the starting iteration and the final iteration.
+"""
+import gc
+import time
+import logging
+
+import numpy as np
+
+import NDimInv.reg_pars as LamFuncs
+import lib_dd.conductivity.model as cond_model
+from lib_dd.models import ccd_res
+import lib_dd.decomposition.ccd_single_stateless as decomp_single_sl
+import lib_dd.decomposition.triage as triage
+import lib_dd.profiling as profiling
+
+
+# test factors of the lambda search (see NDimInv.reg_pars.SearchLambda)
+lambda_factors = np.array((0.1, 0.2, 5, 10, 100, 1e4))
+
+# real and complex data types of the supported precisions
+precisions = {
+    'float64': (np.float64, np.complex128),
+    'float32': (np.float32, np.complex64),
+}
+
+# fixed stopping criteria (see NDimInv.main.InversionControl)
+rms_upd_eps = 1e-5
+allowed_rms_im_increase_first_iteration = 1e2
+
+
+def get_kernel(model_obj, precision='float64'):
+    r"""Return the complex kernel matrix L and the sign of the imaginary part
+    of the model data format for the given model object. The kernel is
+    returned with the complex data type of the precision.
+
+    Both the resistivity and the conductivity models can be written as
+
+    :math:`Z(\omega) = p_0 \left(1 - \sum_i L_i(\omega) m_i\right)`
+
+    with :math:`p_0` either :math:`\rho_0` or :math:`\sigma_\infty`.
+    """
+    omega = 2 * np.pi * model_obj.frequencies
+    omega_tau = omega[:, np.newaxis] * model_obj.tau[np.newaxis, :]
+    if isinstance(model_obj, ccd_res.decomposition_resistivity):
+        c = model_obj.settings['c']
+        kernel = 1 - 1 / (1 + (1j * omega_tau) ** c)
+        # data format: rre_rmim
+        sign = -1
+    elif isinstance(model_obj, cond_model.dd_conductivity):
+        kernel = 1 / (1 + 1j * omega_tau)
+        # data format: cre_cim
+        sign = 1
+    else:
+        raise Exception('Batch solver: model not supported: {0}'.format(
+            type(model_obj)))
+    return kernel.astype(precisions[precision][1]), sign
+
+
+def forward(kernel, sign, m):
+    """Forward responses for model parameters of shape (..., P), returned with
+    shape (..., 2 x nr of frequencies) in the order of NDimInv (all real
+    parts, then all imaginary parts)
+    """
+    with np.errstate(all='ignore'):
+        Z = 10 ** m[..., 0:1] * (1 - (10 ** m[..., 1:]).dot(kernel.T))
+    return np.concatenate((Z.real, sign * Z.imag), axis=-1)
+
+
+def jacobian(kernel, sign, m):
+    """Jacobians for model parameters of shape (K, P), returned with shape
+    (K, 2 x nr of frequencies, P)
+    """
+    with np.errstate(all='ignore'):
+        p0 = 10 ** m[:, 0]
+        mi = 10 ** m[:, 1:]
+        Z = p0[:, np.newaxis] * (1 - mi.dot(kernel.T))
+        dZ = np.empty((m.shape[0], kernel.shape[0], m.shape[1]),
+                      dtype=kernel.dtype)
+        dZ[:, :, 0] = Z
+        dZ[:, :, 1:] = -(
+            p0[:, np.newaxis, np.newaxis] * kernel[np.newaxis, :, :] *
+            mi[:, np.newaxis, :])
+        dZ *= np.log(10)
+    return np.concatenate((dZ.real, sign * dZ.imag), axis=1)
+
+
+def rms_imag(d, f, mask):
+    """RMS of the imaginary parts (second half of the last axis) using only
+    the valid data points given by mask
+
+    Parameters
+    ----------
+    d : data, shape (K, 2N)
+    f : forward responses, shape (K, ..., 2N)
+    mask : valid data points, shape (K, N)
+    """
+    nr_f = mask.shape[-1]
+    extra = (slice(None), ) + (np.newaxis, ) * (f.ndim - 2)
+    with np.errstate(all='ignore'):
+        diff = (d[..., nr_f:][extra] - f[..., nr_f:]) * mask[extra]
+        nr_valid = np.sum(mask, axis=-1).astype(diff.dtype)
+        rms = np.sqrt(np.sum(diff ** 2, axis=-1) / nr_valid[extra])
+    rms[~np.isfinite(rms)] = np.inf
+    return rms
+
+
+def _solve(A, b):
+    """Solve the batched linear systems A x = b. Systems that can not be solved
+    yield NaN values.
+    """
+    try:
+        return np.linalg.solve(A, b[..., np.newaxis])[..., 0]
+    except np.linalg.LinAlgError:
+        x = np.empty_like(b)
+        A_flat = A.reshape((-1, ) + A.shape[-2:])
+        x_flat = x.reshape((-1, b.shape[-1]))
+        for nr, (A_i, b_i) in enumerate(zip(A_flat, b.reshape(x_flat.shape))):
+            try:
+                x_flat[nr] = np.linalg.solve(A_i, b_i)
+            except np.linalg.LinAlgError:
+                x_flat[nr] = np.nan
+        return x
+
+
+def model_updates(J, w2, diff, R, m, lams):
+    r"""Compute Gauss-Newton model updates for K spectra and C lambda values
+
+    :math:`(J^T W_d^T W_d J + \lambda R) \Delta m = J^T W_d^T W_d (d - f) -
+    \lambda R m`
+
+    Parameters
+    ----------
+    J : Jacobians, shape (K, 2N, P)
+    w2 : squared data weights, shape (K, 2N)
+    diff : data residuals d - f, shape (K, 2N)
+    R : regularization matrix, shape (P, P)
+    m : current models, shape (K, P)
+    lams : lambda values, shape (K, C)
+
+    Returns
+    -------
+    updates : model updates, shape (K, C, P)
+    """
+    lams = lams.astype(J.dtype)
+    JtW = np.transpose(J, (0, 2, 1)) * w2[:, np.newaxis, :]
+    JtWJ = np.matmul(JtW, J)
+    JtWd = np.matmul(JtW, diff[:, :, np.newaxis])[:, :, 0]
+    Rm = m.dot(R.T)
+
+    A = JtWJ[:, np.newaxis] + lams[:, :, np.newaxis, np.newaxis] * R
+    b = JtWd[:, np.newaxis] - lams[:, :, np.newaxis] * Rm[:, np.newaxis]
+    return _solve(A, b)
+
+
+def get_dataspace_operator(R, eps=1e-10):
+    """Prepare the data-space update for the regularization matrix R
+
+    The null space N of R (e.g. the constant part of a smoothing
+    regularization and decoupled parameters) is added to R to obtain the
+    invertible matrix :math:`B = R + N N^T`.
+
+    Returns
+    -------
+    G : inverse of B, shape (P, P)
+    N : orthonormal basis of the null space of R, shape (P, k)
+    """
+    values, vectors = np.linalg.eigh(R)
+    null = values <= eps * np.max(np.abs(values))
+    N = vectors[:, null]
+    G = np.linalg.inv(R + N.dot(N.T))
+    return G, N
+
+
+def use_dataspace(update_space, nr_pars, nr_data, N):
+    """Decide if the data-space formulation should be used for the model
+    update. In the 'auto' mode the data space is used if the system to solve
+    is smaller than the parameter space.
+    """
+    if update_space == 'data':
+        return True
+    elif update_space == 'model':
+        return False
+    elif update_space == 'auto':
+        return nr_pars > nr_data + N.shape[1]
+    raise Exception('Unknown update space: {0}'.format(update_space))
+
+
+def model_updates_dataspace(J, w2, diff, R, G, N, m, lams):
+    r"""Compute the same model updates as model_updates, but by solving
+    systems with the size of the data space (plus the null space of R).
+
+    With :math:`J_w = W_d J`, :math:`B = R + N N^T` and :math:`U = [J_w^T,
+    N]` the system matrix reads :math:`\lambda B + U C U^T` with :math:`C =
+    diag(I, -\lambda I)`. The Woodbury identity yields
+
+    :math:`\Delta m = \frac{1}{\lambda} \left(g - G U (\lambda C^{-1} +
+    U^T G U)^{-1} U^T g \right)`
+
+    with :math:`G = B^{-1}` and :math:`g = G b`.
+
+    Parameters
+    ----------
+    G, N : see get_dataspace_operator
+    lams : lambda values (must be larger than zero), shape (K, C)
+
+    For all other parameters see model_updates.
+    """
+    K, nr_data, P = J.shape
+    nr_null = N.shape[1]
+    lams = lams.astype(J.dtype)
+    w = np.sqrt(w2)
+    U = np.empty((K, P, nr_data + nr_null), dtype=J.dtype)
+    U[:, :, 0:nr_data] = np.transpose(J, (0, 2, 1)) * w[:, np.newaxis, :]
+    U[:, :, nr_data:] = N
+    GU = np.matmul(G, U)
+    H = np.matmul(np.transpose(U, (0, 2, 1)), GU)
+
+    # b = J_w^T W_d diff - lambda R m = b1 - lambda b2
+    g1 = np.matmul(GU[:, :, 0:nr_data], (w * diff)[:, :, np.newaxis])[:, :, 0]
+    g2 = m.dot(R.T).dot(G.T)
+    g = g1[:, np.newaxis] - lams[:, :, np.newaxis] * g2[:, np.newaxis]
+    Ug = np.matmul(
+        np.transpose(U, (0, 2, 1))[:, np.newaxis], g[..., np.newaxis])
+
+    # lambda C^{-1}
+    diag = np.ones((K, lams.shape[1], nr_data + nr_null), dtype=J.dtype)
+    diag[:, :, 0:nr_data] = lams[:, :, np.newaxis]
+    diag[:, :, nr_data:] = -1
+    A = H[:, np.newaxis] + diag[..., np.newaxis] * np.eye(
+        nr_data + nr_null, dtype=J.dtype)
+    x = _solve(A, Ug[..., 0])
+    correction = np.matmul(GU[:, np.newaxis], x[..., np.newaxis])[..., 0]
+    return (g - correction) / lams[:, :, np.newaxis]
+
+
+def steplengths(kernel, sign, d, mask, m, rms, updates):
+    """Select steplengths by fitting a parabola through the RMS values for
+    steplengths 0, 0.5 and 1 (see NDimInv.main.SearchSteplengthParFit)
+
+    Parameters
+    ----------
+    m : current models, shape (K, P)
+    rms : current RMS values, shape (K, )
+    updates : model updates, shape (K, C, P)
+
+    Returns
+    -------
+    m_new : updated models, shape (K, C, P)
+    f_new : forward responses of the updated models, shape (K, C, 2N)
+    rms_new : RMS values of the updated models, shape (K, C)
+    """
+    y0 = rms[:, np.newaxis]
+    m_half = m[:, np.newaxis] + 0.5 * updates
+    m_full = m[:, np.newaxis] + updates
+    y1 = rms_imag(d, forward(kernel, sign, m_half), mask)
+    y2 = rms_imag(d, forward(kernel, sign, m_full), mask)
+
+    with np.errstate(all='ignore'):
+        a = 2 * (y2 - 2 * y1 + y0)
+        b = y2 - y0 - a
+        alpha = -b / (2 * a)
+        alpha[alpha > 1] = 1
+        alpha[~(alpha > 0)] = 0.1
+
+    m_new = m[:, np.newaxis] + alpha[..., np.newaxis] * updates
+    f_new = forward(kernel, sign, m_new)
+    rms_new = rms_imag(d, f_new, mask)
+    return m_new, f_new, rms_new
+
+
+def check_stopping(settings, nr, m_old, m_new, rms_old, rms_new,
+                   nr_failures):
+    """Vectorized version of the stopping criteria of
+    lib_dd.decomposition.convergence.NDimInv_adaptive
+
+    Returns
+    -------
+    reasons : array with the stopping reason of each spectrum (None if the
+              inversion continues)
+    """
+    reasons = np.empty(m_old.shape[0], dtype=object)
+
+    def set_reason(indices, reason):
+        reasons[indices & (reasons == None)] = reason  # noqa: E711
+
+    with np.errstate(all='ignore'):
+        set_reason(np.any(np.isnan(m_new), axis=1), 'nan_values')
+        set_reason(np.any(m_new[:, 1:] < -15, axis=1), 'small_values')
+        increase = rms_new - rms_old
+        if nr == 0:
+            set_reason(
+                increase > allowed_rms_im_increase_first_iteration,
+                'rms_increase')
+        else:
+            set_reason(increase > 0, 'rms_increase')
+        rms_diff = np.abs(increase)
+        set_reason(rms_diff < rms_upd_eps, 'rms_threshold')
+
+        stop_rms_rel = settings.get('stop_rms_rel', None)
+        if stop_rms_rel is not None:
+            set_reason(
+                (rms_old > 0) & (rms_diff / rms_old < stop_rms_rel),
+                'rms_rel')
+
+        stop_model_rel = settings.get('stop_model_rel', None)
+        if stop_model_rel is not None:
+            norm = np.linalg.norm(m_old, axis=1)
+            change = np.linalg.norm(m_new - m_old, axis=1) / norm
+            set_reason((norm > 0) & (change < stop_model_rel), 'model_rel')
+
+        max_lambda_failures = settings.get('max_lambda_failures', None)
+        if max_lambda_failures is not None:
+            set_reason(nr_failures >= max_lambda_failures, 'lambda_failures')
+    return reasons
+
+
+def invert(NDs, masks, update_space='auto', precision='float64',
+           profiler=None):
+    """Run the inversion for a list of prepared ND objects with identical
+    frequencies, relaxation times and regularization
+
+    Parameters
+    ----------
+    NDs : list of ND objects as returned by
+          ccd_single_stateless._prepare_ND_object
+    masks : list of boolean arrays (valid frequencies) or None
+    update_space : 'model', 'data' or 'auto'. Solve the update equations in
+                   the model space or in the data space (see
+                   model_updates_dataspace). 'auto' selects the smaller
+                   system.
+    precision : 'float64' or 'float32'. In the float32 mode the kernel,
+                forward responses, Jacobians and the update equations are
+                computed in single precision. The returned models are always
+                float64.
+    profiler : lib_dd.profiling.profiler object that records the iterations,
+               the lambda search and the step length search (may be None)
+
+    Returns
+    -------
+    results : dict with the arrays m, f, lams, nr_iterations, stop_reasons
+    """
+    if profiler is None:
+        profiler = profiling.profiler(enabled=False)
+    ND_ref = NDs[0]
+    settings = ND_ref.settings
+    dtype = precisions[precision][0]
+    kernel, sign = get_kernel(ND_ref.Model.obj, precision)
+    nr_f = kernel.shape[0]
+    K = len(NDs)
+
+    d = np.array([ND.Data.Df for ND in NDs], dtype=dtype)
+    w2 = np.array([ND.Data.Wd.diagonal() for ND in NDs], dtype=dtype) ** 2
+    mask = np.ones((K, nr_f), dtype=bool)
+    for nr, mask_i in enumerate(masks):
+        if mask_i is not None:
+            mask[nr] = mask_i
+
+    # regularization matrix
+    reg_obj, lam_obj = ND_ref.Model.regularizations[0][0]
+    R = np.asarray(ND_ref.Model.map_reg_matrix_to_global_Wm(
+        0, func=reg_obj.WtWm, outside_first_dim=reg_obj.outside_first_dim))
+
+    search_lambda = isinstance(lam_obj, LamFuncs.SearchLambda)
+    if search_lambda:
+        # the initial lambda depends on the number of valid data points
+        lam0 = np.array([
+            float(ND.Model.regularizations[0][0][1].lam0_obj.get(
+                ND.iterations[0])) for ND in NDs])
+    else:
+        lam0 = np.ones(K) * float(lam_obj.fixed_lambda)
+
+    G, N = get_dataspace_operator(R)
+    R = R.astype(dtype)
+    G = G.astype(dtype)
+    N = N.astype(dtype)
+    if(np.all(lam0 > 0) and
+       use_dataspace(update_space, R.shape[0], 2 * nr_f, N)):
+        logging.info('Computing the model updates in the data space')
+
+        def get_updates(J, w2, diff, m, lams):
+            return model_updates_dataspace(J, w2, diff, R, G, N, m, lams)
+    else:
+        def get_updates(J, w2, diff, m, lams):
+            return model_updates(J, w2, diff, R, m, lams)
+
+    m = np.array([ND.Model.m0 for ND in NDs], dtype=dtype)
+    f = forward(kernel, sign, m)
+    rms = rms_imag(d, f, mask)
+    lams = lam0.copy()
+    nr_its = np.zeros(K, dtype=int)
+    nr_failures = np.zeros(K, dtype=int)
+    stop_reasons = np.empty(K, dtype=object)
+    active = np.ones(K, dtype=bool)
+
+    for it_nr in range(0, settings['max_iterations']):
+        index = np.where(active)[0]
+        if index.size == 0:
+            break
+        it_start = time.time()
+        m_a = m[index]
+        d_a = d[index]
+        mask_a = mask[index]
+        J = jacobian(kernel, sign, m_a)
+        diff = d_a - f[index]
+
+        if it_nr == 0 or not search_lambda:
+            test_lams = lams[index][:, np.newaxis]
+        else:
+            test_lams = lams[index][:, np.newaxis] * lambda_factors
+        with profiler.stage('lambda_search'):
+            updates = get_updates(J, w2[index], diff, m_a, test_lams)
+        with profiler.stage('steplength'):
+            m_test, f_test, rms_test = steplengths(
+                kernel, sign, d_a, mask_a, m_a, rms[index], updates)
+
+        best = np.argmin(rms_test, axis=1)
+        select = np.arange(index.size)
+        m_new = m_test[select, best]
+        f_new = f_test[select, best]
+        rms_new = rms_test[select, best]
+        lams_new = test_lams[select, best]
+
+        if it_nr > 0 and search_lambda:
+            # the lambda search failed if no test lambda improves the rms.
+            # In this case, the update is computed using the old lambda
+            failed = ~(rms_new < rms[index])
+            if np.any(failed):
+                nr_failures[index[failed]] += 1
+                old_lams = lams[index[failed]][:, np.newaxis]
+                updates = get_updates(
+                    J[failed], w2[index[failed]], diff[failed], m_a[failed],
+                    old_lams)
+                m_f, f_f, rms_f = steplengths(
+                    kernel, sign, d_a[failed], mask_a[failed], m_a[failed],
+                    rms[index[failed]], updates)
+                m_new[failed] = m_f[:, 0]
+                f_new[failed] = f_f[:, 0]
+                rms_new[failed] = rms_f[:, 0]
+                lams_new[failed] = old_lams[:, 0]
+
+        reasons = check_stopping(
+            settings, it_nr, m_a, m_new, rms[index], rms_new,
+            nr_failures[index])
+        stop = reasons != None  # noqa: E711
+        stop_reasons[index[stop]] = reasons[stop]
+        active[index[stop]] = False
+
+        accept = index[~stop]
+        m[accept] = m_new[~stop]
+        f[accept] = f_new[~stop]
+        rms[accept] = rms_new[~stop]
+        lams[accept] = lams_new[~stop]
+        nr_its[accept] += 1
+        profiler.add('iteration', time.time() - it_start)
+
+    stop_reasons[active] = 'max_iterations'
+
+    results = {
+        'm': m.astype(np.float64),
+        'f': f,
+        'lams': lams,
+        'nr_iterations': nr_its,
+        'stop_reasons': stop_reasons,
+    }
+    return results
+
+
+def _store_results(ND, m, lam, nr_iterations, stop_reason):
+    """Store the final model as the last iteration of the ND object
+    """
+    it_final = ND.iterations[0].copy()
+    it_final.nr = nr_iterations
+    it_final.m = m
+    it_final.f = ND.Model.f(m)
+    it_final.lams = [lam, ]
+    ND.iterations.append(it_final)
+    ND.stop_reason = stop_reason
+
+
+def fit_spectra(fit_datas):
+    """Fit a list of spectra (as returned by
+    ccd_single_stateless._get_fit_datas) using the batch solver and return the
+    list of ND objects
+
+    Spectra with frequencies that differ from those of the first spectrum
+    (e.g. if NaN values were cropped) are fitted using the default solver.
+    """
+    start_time = time.time()
+    NDs = []
+    batch = []
+    for fit_data in fit_datas:
+        ND = decomp_single_sl._prepare_ND_object(fit_data)
+
+        if fit_data['prep_opts'].get('triage', False):
+            with ND.profiler.stage('triage'):
+                ND.triage = triage.screen(
+                    ND, fit_data['prep_opts'], fit_data.get('nan_mask', None))
+        else:
+            ND.triage = None
+        with ND.profiler.stage('starting_model'):
+            ND.start_inversion()
+        NDs.append(ND)
+
+        if ND.triage is not None and ND.triage['skip']:
+            logging.info('Skipping spectrum {0}: {1}'.format(
+                fit_data['nr'], ND.triage['reason']))
+            triage.set_nan_results(ND.iterations[-1])
+            ND.stop_reason = 'triage'
+        elif(batch and not np.array_equal(
+                fit_data['frequencies'], NDs[batch[0]].Model.obj.frequencies)):
+            logging.info(
+                'Spectrum {0}: frequencies differ, '.format(fit_data['nr']) +
+                'using the default solver')
+            ND.iterations = []
+            ND.run_inversion()
+        else:
+            batch.append(len(NDs) - 1)
+
+    if fit_datas and fit_datas[0]['prep_opts'].get('multigrid_nd', None):
+        logging.info('The batch solver ignores the multigrid option')
+
+    if batch:
+        logging.info('Batch fit of {0} spectra'.format(len(batch)))
+        batch_profiler = profiling.profiler(NDs[batch[0]].profiler.enabled)
+        results = invert(
+            [NDs[x] for x in batch],
+            [fit_datas[x].get('nan_mask', None) for x in batch],
+            fit_datas[0]['prep_opts'].get('update_space', 'auto'),
+            fit_datas[0]['prep_opts'].get('precision', 'float64'),
+            batch_profiler)
+        # distribute the batch times equally among the spectra
+        for key, duration in batch_profiler.totals().items():
+            for index in batch:
+                NDs[index].profiler.add(key, duration / len(batch))
+        for nr, index in enumerate(batch):
+            _store_results(
+                NDs[index],
+                results['m'][nr],
+                results['lams'][nr],
+                results['nr_iterations'][nr],
+                results['stop_reasons'][nr],
+            )
+
+    mean_time = (time.time() - start_time) / max(len(NDs), 1)
+    for fit_data, ND in zip(fit_datas, NDs):
+        if ND.triage is not None:
+            ND.triage['fit_time'] = mean_time
+        if ND.profiler.enabled:
+            with ND.profiler.stage('compute_par_stats'):
+                ND.iterations[-1].stat_pars
+        ND.profiler.release()
+
+    gc.collect()
+    return NDs
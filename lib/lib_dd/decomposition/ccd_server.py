@@ -0,0 +1,328 @@
+"""
+Long-running fit service around the ccd_single decomposition.
+
+The service keeps a warm multiprocessing pool (and all imports) alive between
+fit jobs. Jobs are submitted via HTTP POST requests to a local TCP port or a
+Unix socket. The request body is a .npz file (see numpy.savez) with the
+entries:
+
+    frequencies : frequencies [Hz]
+    data : data, one spectrum per row (format given by the config)
+    config : (optional) JSON string with ccd_single configuration options, i.e.
+             keys of lib_dd.config.cfg_single.cfg_single (e.g.
+             '{"nr_terms_decade": 10, "data_format": "rmag_rpha"}')
+
+The response is again a .npz file holding the integrated parameters (one entry
+for each parameter, first dimension: spectra), m_i, tau, frequencies,
+nr_iterations and lambdas. If the configuration sets precision to float32, all
+floating point arrays are returned in single precision.
+
+Model settings controlled by environment variables (DD_COND, DD_C,
+DD_STARTING_MODEL, ...) are taken from the environment of the service.
+
+Usage from Python:
+
+    import lib_dd.decomposition.ccd_server as ccd_server
+    results = ccd_server.fit_remote(
+        'http://localhost:8765', frequencies, data, {'nr_terms_decade': 10})
+"""
+import io
+import os
+import json
+import socket
+import logging
+import http.client
+import http.server
+import socketserver
+import urllib.request
+from multiprocessing import Pool
+
+import numpy as np
+
+import lib_dd.interface as lDDi
+import lib_dd.config.cfg_single as cfg_single
+import lib_dd.decomposition.ccd_single as ccd_single
+import lib_dd.decomposition.ccd_single_stateless as decomp_single_sl
+
+
+# these options would result in output written to disc by the workers
+_disabled_options = (
+    'plot_spectra',
+    'plot_reg_strength',
+    'plot_it_spectra',
+    'plot_lambda',
+    'use_tmp',
+    'frequency_file',
+    'data_file',
+    'output_dir',
+    'nr_cores',
+)
+
+
+def _fit_one_spectrum_record(fit_data):
+    """Fit one spectrum and only return the information required to assemble
+    the results. This avoids sending full ND objects back from the workers.
+    """
+    ND = decomp_single_sl.fit_one_spectrum(fit_data)
+    last_it = ND.iterations[-1]
+    record = {
+        'stat_pars': last_it.stat_pars,
+        'nr_iterations': last_it.nr,
+        'lambda': last_it.lams[0],
+        'tau': last_it.Model.obj.tau,
+        'frequencies': last_it.Data.obj.frequencies,
+    }
+    return record
+
+
+class ccd_server(object):
+    """Fit data using ccd_single with a persistent worker pool
+    """
+    def __init__(self, nr_cores=1):
+        self.nr_cores = nr_cores
+        if nr_cores > 1:
+            self.pool = Pool(nr_cores)
+        else:
+            self.pool = None
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def get_config(self, frequencies, data, config_dict=None):
+        """Return a cfg_single object for the given data and options
+        """
+        config = cfg_single.cfg_single()
+        if config_dict is not None:
+            for key, value in config_dict.items():
+                if key not in config:
+                    raise Exception('Unknown option: {0}'.format(key))
+                if key in _disabled_options:
+                    raise Exception(
+                        'Option not allowed for fit jobs: {0}'.format(key))
+                config[key] = value
+        config['frequency_file'] = np.asarray(frequencies, dtype=float)
+        config['data_file'] = np.atleast_2d(np.asarray(data, dtype=float))
+        config['plot_spectra'] = False
+        config['plot_reg_strength'] = False
+        config['plot_it_spectra'] = False
+        config['plot_lambda'] = None
+        return config
+
+    def fit(self, frequencies, data, config_dict=None):
+        """Fit the spectra and return the results as a dict of numpy arrays
+
+        Parameters
+        ----------
+        frequencies : array of frequencies [Hz]
+        data : NxM array with N spectra
+        config_dict : dict with cfg_single options (may be None)
+
+        Returns
+        -------
+        results : dict with numpy arrays
+        """
+        config = self.get_config(frequencies, data, config_dict)
+        ccd_obj = ccd_single.ccd_single(config)
+        ccd_data = ccd_obj.get_data_dd_single()
+        fit_datas = decomp_single_sl._get_fit_datas(ccd_data)
+
+        if self.pool is None:
+            records = list(map(_fit_one_spectrum_record, fit_datas))
+        else:
+            records = self.pool.map(_fit_one_spectrum_record, fit_datas)
+
+        return self.assemble_results(records, ccd_data)
+
+    def assemble_results(self, records, ccd_data):
+        """Aggregate the result records of all spectra into numpy arrays
+        """
+        norm_factors = ccd_data.get('norm_factors', None)
+        stat_pars = {}
+        for record in records:
+            for key, value in record['stat_pars'].items():
+                stat_pars[key] = stat_pars.get(key, []) + value
+
+        results = {}
+        for key in sorted(stat_pars.keys()):
+            results[key] = lDDi.prepare_stat_values(
+                stat_pars[key], key, norm_factors)
+
+        results['tau'] = records[0]['tau']
+        results['frequencies'] = records[0]['frequencies']
+        results['nr_iterations'] = np.array(
+            [x['nr_iterations'] for x in records])
+        results['lambdas'] = np.array(
+            [x['lambda'] for x in records], dtype=float)
+
+        if ccd_data['prep_opts'].get('precision', 'float64') == 'float32':
+            for key, value in results.items():
+                if value.dtype == np.float64:
+                    results[key] = value.astype(np.float32)
+        return results
+
+
+def _dump_npz(arrays):
+    """Return the bytes of a .npz file containing the arrays of the dict
+    """
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def _load_npz(payload):
+    """Return a dict with the arrays of a .npz file given as bytes
+    """
+    with np.load(io.BytesIO(payload), allow_pickle=False) as npz:
+        return {key: npz[key] for key in npz.files}
+
+
+def encode_job(frequencies, data, config_dict=None):
+    """Return the request payload for a fit job
+    """
+    arrays = {
+        'frequencies': np.asarray(frequencies, dtype=float),
+        'data': np.atleast_2d(np.asarray(data, dtype=float)),
+    }
+    if config_dict is not None:
+        arrays['config'] = np.array(json.dumps(config_dict))
+    return _dump_npz(arrays)
+
+
+def decode_job(payload):
+    """Return frequencies, data, config_dict of a fit job payload
+    """
+    arrays = _load_npz(payload)
+    for key in ('frequencies', 'data'):
+        if key not in arrays:
+            raise Exception('Missing entry in fit job: {0}'.format(key))
+    if 'config' in arrays:
+        config_dict = json.loads(str(arrays['config']))
+    else:
+        config_dict = None
+    return arrays['frequencies'], arrays['data'], config_dict
+
+
+def encode_results(results):
+    return _dump_npz(results)
+
+
+def decode_results(payload):
+    return _load_npz(payload)
+
+
+class _fit_request_handler(http.server.BaseHTTPRequestHandler):
+    """POST a fit job to any path, GET returns a short status message
+    """
+    def address_string(self):
+        # Unix sockets do not provide a client address
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix-socket'
+
+    def log_message(self, format, *args):
+        logging.info(format % args)
+
+    def _send(self, code, payload, content_type):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        message = 'ccd_server running with {0} worker(s)\n'.format(
+            self.server.ccd_server.nr_cores)
+        self._send(200, bytes(message, 'UTF-8'), 'text/plain')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = self.rfile.read(length)
+        try:
+            frequencies, data, config_dict = decode_job(payload)
+            results = self.server.ccd_server.fit(
+                frequencies, data, config_dict)
+            response = encode_results(results)
+        except Exception as e:
+            logging.error('Fit job failed: {0}'.format(e))
+            self._send(400, bytes('{0}\n'.format(e), 'UTF-8'), 'text/plain')
+            return
+        self._send(200, response, 'application/octet-stream')
+
+
+class _tcp_server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class _unix_server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def create_http_server(ccd_server_obj, host='localhost', port=8765,
+                       socket_file=None):
+    """Create a http server that forwards fit jobs to ccd_server_obj. If
+    socket_file is given, listen on this Unix socket instead of host:port.
+    """
+    if socket_file is not None:
+        if os.path.exists(socket_file):
+            os.unlink(socket_file)
+        server = _unix_server(socket_file, _fit_request_handler)
+    else:
+        server = _tcp_server((host, port), _fit_request_handler)
+    server.ccd_server = ccd_server_obj
+    return server
+
+
+class _unix_http_connection(http.client.HTTPConnection):
+    def __init__(self, socket_file, timeout=None):
+        super(_unix_http_connection, self).__init__('localhost',
+                                                    timeout=timeout)
+        self.socket_file = socket_file
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_file)
+
+
+def fit_remote(url, frequencies, data, config_dict=None, socket_file=None,
+               timeout=None):
+    """Submit a fit job to a running ccd_server and return the results dict
+
+    Parameters
+    ----------
+    url : url of the server, e.g. http://localhost:8765. Ignored if socket_file
+          is used
+    frequencies : array of frequencies [Hz]
+    data : NxM array with N spectra
+    config_dict : dict with cfg_single options (may be None)
+    socket_file : Unix socket of the server
+    timeout : timeout in seconds
+    """
+    payload = encode_job(frequencies, data, config_dict)
+    if socket_file is not None:
+        connection = _unix_http_connection(socket_file, timeout=timeout)
+        connection.request(
+            'POST', '/', body=payload,
+            headers={'Content-Type': 'application/octet-stream'})
+        response = connection.getresponse()
+        body = response.read()
+        connection.close()
+        if response.status != 200:
+            raise Exception('Fit job failed: {0}'.format(
+                body.decode('UTF-8').strip()))
+        return decode_results(body)
+
+    request = urllib.request.Request(
+        url, data=payload,
+        headers={'Content-Type': 'application/octet-stream'})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body = response.read()
+    except urllib.error.HTTPError as e:
+        raise Exception('Fit job failed: {0}'.format(
+            e.read().decode('UTF-8').strip()))
+    return decode_results(body)
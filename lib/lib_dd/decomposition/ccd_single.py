@@ -2,13 +2,20 @@
 
 """
 import os
+import time
 from multiprocessing import Pool
 import logging
 
 import lib_dd.decomposition.ccd_single_stateless as decomp_single_sl
+import lib_dd.decomposition.triage as triage
+import lib_dd.decomposition.progress as progress
+import lib_dd.decomposition.plot_results as plot_results
+import lib_dd.decomposition.ccd_batch as ccd_batch
 import lib_dd.interface as lDDi
 import lib_dd.config.cfg_single as cfg_single
 import lib_dd.io.io_general as iog
+import lib_dd.io.ascii_audit as ascii_audit
+import lib_dd.profiling as profiling
 
 
 class ccd_single(object):
@@ -24,31 +31,123 @@ class ccd_single(object):
         self.data = None
         self.results = None
 
+        # run-level stages (see lib_dd.profiling)
+        self.profiler = profiling.profiler(
+            profiling.is_enabled(self.config['profile']))
+
     def fit_data(self):
         """This is the central fit function, which prepares the data, fits each
-        spectrum, plots (if requested), and then saves the results.
+        spectrum, and plots the results (if requested). The plots are created
+        after all spectra were fitted (see lib_dd.decomposition.plot_results).
         """
         if self.data is None:
-            self.get_data_dd_single()
+            with self.profiler.stage('load'):
+                self.get_data_dd_single()
 
         # prepare data for multiprocessing by sorting it into individual dicts
         # note that this process duplicated a lot of data!
-        fit_datas = decomp_single_sl._get_fit_datas(self.data)
+        with self.profiler.stage('get_fit_datas'):
+            fit_datas = decomp_single_sl._get_fit_datas(self.data)
+        spectrum_fit_datas = fit_datas
+
+        if self.data['prep_opts'].get('solver', 'ndiminv') == 'batch':
+            # the batch solver works on chunks of spectra
+            batch_size = self.data['prep_opts']['batch_size']
+            fit_datas = [fit_datas[i: i + batch_size] for i in
+                         range(0, len(fit_datas), batch_size)]
+            fit_func = ccd_batch.fit_spectra
+            offsets = list(range(0, len(spectrum_fit_datas), batch_size))
+        else:
+            if self.data['prep_opts'].get('precision', 'float64') != 'float64':
+                logging.info(
+                    'The precision option is only used by the batch solver')
+            fit_func = decomp_single_sl.fit_one_spectrum
+            offsets = list(range(0, len(spectrum_fit_datas)))
+
+        reporter = progress.progress_reporter(
+            len(self.data['cr_data']),
+            self.data['outdir'],
+            self.data['prep_opts'].get('progress_interval', 10.0))
+
+        # the ascii_audit results are collected while the spectra are fitted
+        if self.data['options'].get('output_format') == 'ascii_audit':
+            self.data['result_collector'] = ascii_audit.result_collector(
+                len(spectrum_fit_datas))
+        else:
+            self.data['result_collector'] = None
 
         # fit
+        fit_start = time.time()
         if(self.data['prep_opts']['nr_cores'] == 1):
             logging.info('single processing')
             # single processing
-            results = list(map(decomp_single_sl.fit_one_spectrum, fit_datas))
+            results = []
+            for offset, fit_data in zip(offsets, fit_datas):
+                results.append(fit_func(fit_data))
+                reporter.update(results[-1])
+                self._collect_result(offset, results[-1])
+                reporter.report()
         else:
             # multi processing
             logging.info('multi processing')
             p = Pool(self.data['prep_opts']['nr_cores'])
-            results = p.map(decomp_single_sl.fit_one_spectrum, fit_datas)
+            async_results = [
+                p.apply_async(fit_func, (fit_data, ), callback=reporter.update)
+                for fit_data in fit_datas]
+            p.close()
+            # report periodically, even if no spectrum finishes. The results
+            # are collected here, and not in the callback (which runs in the
+            # result handler thread of the pool)
+            results = []
+            for offset, async_result in zip(offsets, async_results):
+                while not async_result.ready():
+                    async_result.wait(max(reporter.interval, 1.0))
+                    reporter.report()
+                results.append(async_result.get())
+                self._collect_result(offset, results[-1])
+            p.join()
+        reporter.finish()
+
+        if fit_func is ccd_batch.fit_spectra:
+            results = [ND for chunk in results for ND in chunk]
+        self.profiler.add('fit', time.time() - fit_start)
+
+        with self.profiler.stage('plotting'):
+            plot_results.plot_results(
+                spectrum_fit_datas, results,
+                self.data['prep_opts']['nr_cores'])
 
         # results now contains one or more ND objects
         self.results = results
 
+        summary = triage.summarize(results)
+        if summary is not None:
+            logging.info(
+                'Triage: skipped {0} of {1} spectra, '.format(
+                    summary['nr_skipped'], summary['nr_spectra']) +
+                'estimated time saved: {0:.2f} s ({1:.1f} %)'.format(
+                    summary['time_saved'], summary['fraction_saved'] * 100))
+
+    def _collect_result(self, offset, result):
+        """Add the fitted ND object(s) of one fit task, starting at spectrum
+        index offset, to the result collector of the output writer (if
+        any). If the collector refuses a result (e.g. due to cropped
+        frequencies), it is discarded and the writer collects all results
+        after the fit.
+        """
+        collector = self.data.get('result_collector', None)
+        if collector is None:
+            return
+        if not isinstance(result, list):
+            result = [result, ]
+        try:
+            for nr, ND in enumerate(result):
+                collector.add(offset + nr, ND)
+        except ValueError as e:
+            logging.info(
+                'Results are collected after the fit: {0}'.format(e))
+            self.data['result_collector'] = None
+
     def get_data_dd_single(self):
         """
         Load frequencies and data and return a data dict
@@ -112,6 +211,14 @@ class ccd_single(object):
 
         iog.save_fit_results(
             self.data,
-            self.results
+            self.results,
+            self.profiler,
         )
         os.chdir(pwd)
+        self.save_profile(outdir)
+
+    def save_profile(self, directory):
+        """Write profile.json to the directory if profiling is enabled
+        """
+        if self.profiler.enabled and self.results is not None:
+            profiling.save_profile(directory, self.profiler, self.results)
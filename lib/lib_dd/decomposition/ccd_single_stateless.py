@@ -5,15 +5,20 @@ in the ccd_single object
 import logging
 import os
 import gc
+import time
 import numpy as np
 
 import NDimInv
+import NDimInv.ND_Model
 import NDimInv.regs as RegFuncs
 import NDimInv.reg_pars as LamFuncs
 import lib_dd.plot as lDDp
 import sip_formats.convert as sip_converter
 import lib_dd.conductivity.model as cond_model
 from lib_dd.models import ccd_res
+import lib_dd.decomposition.triage as triage
+import lib_dd.decomposition.convergence as convergence
+import lib_dd.profiling as profiling
 
 
 def _filter_nan_values(frequencies, cr_spectrum):
@@ -27,16 +32,86 @@ def _filter_nan_values(frequencies, cr_spectrum):
     # check for NaN values
     nan_indices = np.isnan(cr_spectrum)
     nan_along_freq = np.any(nan_indices, axis=1)
+    if not np.any(nan_along_freq):
+        # nothing to remove, no need to copy the data
+        return frequencies, cr_spectrum
     to_delete = np.where(nan_along_freq)
     frequencies_cropped = np.delete(frequencies, to_delete)
     cr_spectrum_cropped = np.delete(cr_spectrum, to_delete, axis=0)
     return frequencies_cropped, cr_spectrum_cropped
 
 
+def _fill_nan_values(frequencies, cr_spectrum):
+    """
+    Replace NaN values by values interpolated (in log10 frequency space) from
+    the remaining data points. Only frequencies with complete data points
+    (both parts) are used for the interpolation.
+
+    Returns
+    -------
+    cr_spectrum_filled : copy of cr_spectrum without NaN values (or
+                         cr_spectrum itself if no NaN values are present)
+    mask : boolean array, True for frequencies with complete data points.
+           None if no NaN values are present.
+    """
+    mask = ~np.any(np.isnan(cr_spectrum), axis=1)
+    if np.all(mask) or not np.any(mask):
+        return cr_spectrum, None
+
+    log_f = np.log10(frequencies)
+    cr_spectrum_filled = cr_spectrum.copy()
+    for column in range(cr_spectrum.shape[1]):
+        cr_spectrum_filled[~mask, column] = np.interp(
+            log_f[~mask], log_f[mask], cr_spectrum[mask, column])
+    return cr_spectrum_filled, mask
+
+
+class _masked_data_weighting(object):
+    """Wrap a data weighting function of NDimInv.data_weighting: the weights
+    are computed using the valid data points only, all other weights are set
+    to zero. Missing data points thus do not enter the inversion updates.
+
+    This is a class (and not a closure) so that the ND objects remain
+    picklable for the multiprocessing pool.
+    """
+    def __init__(self, weighting_func, mask):
+        self.weighting_func = weighting_func
+        self.mask = mask
+
+    def __call__(self, base_data, settings):
+        weightings = np.zeros_like(base_data)
+        weightings[self.mask] = self.weighting_func(
+            base_data[self.mask], settings=settings)
+        return weightings
+
+
+class _given_m0_model(NDimInv.ND_Model.ND_Model):
+    """ND_Model object that uses the given starting model m0 instead of
+    estimating it from the data
+    """
+    def __init__(self, model, Data, extra_dims, m0):
+        self.m0 = m0
+        super(_given_m0_model, self).__init__(model, Data, extra_dims)
+
+    def compute_starting_parameters(self):
+        pass
+
+
 def _get_fit_datas(data):
     """
     Prepare data for fitting. Prepare a set of variables/objects for each
-    spectrum. Also filter nan values
+    spectrum. Also treat nan values, depending on
+    data['prep_opts']['nan_handling']:
+
+        * 'weights' (default): replace NaN values by interpolated values,
+          which are assigned zero data weights in the model updates. The
+          valid frequencies are stored in inv_opts['nan_mask'] and the
+          missing data points are excluded from the starting model, the
+          initial lambda and all RMS values (see
+          lib_dd.decomposition.convergence). The results are those of the
+          cropped spectrum, as long as the lowest and highest frequencies
+          are present (the tau range is determined from the frequencies).
+        * 'crop': remove the corresponding frequencies of the spectrum
 
     Parameters
     ----------
@@ -48,11 +123,18 @@ def _get_fit_datas(data):
     for i in range(0, nr_of_spectra):
         fit_data = {}
         fit_data['outdir'] = data['outdir']
-        # change file prefix for each spectrum
-        # at the moment we need a copy for this
-        frequencies_cropped, cr_data = _filter_nan_values(
-            data['frequencies'], data['cr_data'][i]
-        )
+        if data['prep_opts'].get('nan_handling', 'weights') == 'weights':
+            # keep the common frequencies and assign zero weights to missing
+            # data points
+            frequencies_cropped = data['frequencies']
+            cr_data, fit_data['nan_mask'] = _fill_nan_values(
+                data['frequencies'], data['cr_data'][i]
+            )
+        else:
+            frequencies_cropped, cr_data = _filter_nan_values(
+                data['frequencies'], data['cr_data'][i]
+            )
+            fit_data['nan_mask'] = None
 
         fit_data['prep_opts'] = data['prep_opts']
         fit_data['data'] = cr_data
@@ -65,6 +147,7 @@ def _get_fit_datas(data):
         inv_opts_i = data['inv_opts'].copy()
         inv_opts_i['frequencies'] = frequencies_cropped
         inv_opts_i['global_prefix'] = 'spec_{0:03}_'.format(i)
+        inv_opts_i['nan_mask'] = fit_data['nan_mask']
         if('norm_factors' in data):
             inv_opts_i['norm_factors'] = data['norm_factors'][i]
         else:
@@ -78,6 +161,9 @@ def _get_fit_datas(data):
 
 
 def _prepare_ND_object(fit_data):
+    profiler = profiling.profiler(
+        profiling.is_enabled(fit_data['prep_opts'].get('profile', False)))
+    construction_start = time.time()
     # use conductivity or resistivity model?
     if 'DD_COND' in os.environ and os.environ['DD_COND'] == '1':
         # there is only one parameterisation: log10(sigma_i), log10(m)
@@ -91,9 +177,13 @@ def _prepare_ND_object(fit_data):
             fit_data['inv_opts']['c'] = 1.0
         # model = lib_cc2.decomposition_resistivity(fit_data['inv_opts'])
         model = ccd_res.decomposition_resistivity(fit_data['inv_opts'])
-    ND = NDimInv.NDimInv(model, fit_data['inv_opts'])
+    ND = convergence.NDimInv_adaptive(model, fit_data['inv_opts'])
+    ND.profiler = profiler
     ND.finalize_dimensions()
     ND.Data.data_converter = sip_converter.convert
+    if fit_data.get('nan_mask', None) is not None:
+        ND.Data.data_weighting_func = _masked_data_weighting(
+            ND.Data.data_weighting_func, fit_data['nan_mask'])
 
     # read in data
     # print fit_data['data'], fit_data['prep_opts']['data_format']
@@ -102,10 +192,18 @@ def _prepare_ND_object(fit_data):
         fit_data['prep_opts']['data_format'],
         extra=[]
     )
+    profiler.add('model_construction', time.time() - construction_start)
 
     # now that we know the frequencies we can call the post_frequency
-    # handler for the model side
-    ND.update_model()
+    # handler for the model side. This also estimates the starting model,
+    # unless it is given (e.g. results of a previous fit)
+    with profiler.stage('starting_model'):
+        if fit_data.get('m0', None) is None:
+            ND.update_model()
+        else:
+            ND.Model = _given_m0_model(
+                ND.model, ND.Data, ND.extra_dims, fit_data['m0'])
+    construction_start = time.time()
 
     # add rms types
     ND.RMS.add_rms('rms_re_im',
@@ -124,7 +222,14 @@ def _prepare_ND_object(fit_data):
 
     # add a frequency regularization for the DD model
     if(fit_data['prep_opts']['lambda'] is None):
-        lam_obj = LamFuncs.SearchLambda(LamFuncs.Lam0_Easylam())
+        if fit_data.get('nan_mask', None) is None:
+            lam0_obj = LamFuncs.Lam0_Easylam()
+        else:
+            # Lam0_Easylam uses the number of data points, which only
+            # includes the valid data points for the cropped spectrum
+            lam0_obj = LamFuncs.Lam0_Fixed(
+                int(2 * np.sum(fit_data['nan_mask'])))
+        lam_obj = convergence.SearchLambdaCounted(lam0_obj)
         lam_obj.rms_key = optimize_rms_key
         lam_obj.rms_index = optimize_rms_index
     else:
@@ -139,10 +244,60 @@ def _prepare_ND_object(fit_data):
     # choose from a fixed set of step lengths
     ND.Model.steplength_selector = NDimInv.main.SearchSteplengthParFit(
         optimize_rms_key, optimize_rms_index)
+    profiler.add('model_construction', time.time() - construction_start)
+
+    # the instrumentation must be released (profiler.release()) before the
+    # object is returned from a worker process
+    profiler.instrument(lam_obj, 'get_lambda', 'lambda_search')
+    profiler.instrument(
+        ND.Model.steplength_selector, 'get_steplength', 'steplength')
     return ND
 
 
-# @profile
+def _interpolate_rtd(m_coarse, s_coarse, s_fine):
+    """Interpolate a model (log10(rho0/sigma_inf), log10(m_i)) onto a finer
+    tau grid. The chargeabilities are scaled by the ratio of the grid
+    spacings, so that the total chargeability is approximately preserved.
+
+    Parameters
+    ----------
+    m_coarse : model parameters of the coarse grid
+    s_coarse : log10(tau) values of the coarse grid
+    s_fine : log10(tau) values of the fine grid
+
+    Returns
+    -------
+    m_fine : model parameters of the fine grid
+    """
+    order = np.argsort(s_coarse)
+    log_m_fine = np.interp(s_fine, s_coarse[order], m_coarse[1:][order])
+    ds_coarse = np.abs(np.mean(np.diff(s_coarse)))
+    ds_fine = np.abs(np.mean(np.diff(s_fine)))
+    log_m_fine += np.log10(ds_fine / ds_coarse)
+    return np.hstack((m_coarse[0], log_m_fine))
+
+
+def _fit_coarse_grid(fit_data, ND_fine):
+    """Fit the spectrum using prep_opts['multigrid_nd'] tau values per decade
+    and return the result, interpolated onto the tau grid of ND_fine
+
+    Returns
+    -------
+    m0 : starting model for the fine grid
+    nr_iterations : number of iterations of the coarse fit
+    """
+    fit_data_coarse = fit_data.copy()
+    fit_data_coarse['inv_opts'] = fit_data['inv_opts'].copy()
+    fit_data_coarse['inv_opts']['Nd'] = fit_data['prep_opts']['multigrid_nd']
+    ND = _prepare_ND_object(fit_data_coarse)
+    ND.run_inversion()
+    ND.profiler.release()
+
+    m0 = _interpolate_rtd(
+        ND.iterations[-1].m, ND.Model.obj.s, ND_fine.Model.obj.s)
+    return m0, ND.iterations[-1].nr
+
+
 def fit_one_spectrum(fit_data):
     """
     Fit one spectrum
@@ -152,10 +307,46 @@ def fit_one_spectrum(fit_data):
             fit_data['nr'], fit_data['nr_of_spectra']
         )
     )
+    start_time = time.time()
     ND = _prepare_ND_object(fit_data)
+    profiler = ND.profiler
 
-    # run the inversion
-    ND.run_inversion()
+    if fit_data['prep_opts'].get('triage', False):
+        with profiler.stage('triage'):
+            ND.triage = triage.screen(
+                ND, fit_data['prep_opts'], fit_data.get('nan_mask', None))
+    else:
+        ND.triage = None
+
+    if ND.triage is not None and ND.triage['skip']:
+        logging.info('Skipping spectrum {0}: {1}'.format(
+            fit_data['nr'], ND.triage['reason']))
+        # only evaluate the starting model
+        with profiler.stage('starting_model'):
+            ND.start_inversion()
+        triage.set_nan_results(ND.iterations[-1])
+        ND.stop_reason = 'triage'
+    else:
+        if(fit_data['prep_opts'].get('multigrid_nd', None) is not None and
+           fit_data.get('m0', None) is None):
+            # coarse-to-fine: start from the interpolated coarse grid result
+            # and only compute a few iterations on the fine grid
+            with profiler.stage('coarse_grid'):
+                ND.Model.m0, coarse_its = _fit_coarse_grid(fit_data, ND)
+            ND.settings['max_iterations'] = fit_data['prep_opts'][
+                'multigrid_fine_its']
+            ND.multigrid_iterations = coarse_its
+            logging.info(
+                'Coarse grid fit finished after {0} iterations'.format(
+                    coarse_its))
+
+        # run the inversion
+        with profiler.stage('starting_model'):
+            ND.start_inversion()
+        ND.run_inversion()
+
+    if ND.triage is not None:
+        ND.triage['fit_time'] = time.time() - start_time
 
     # extract the (only) iteration
     final_iteration = ND.iterations[-1]
@@ -172,7 +363,13 @@ def fit_one_spectrum(fit_data):
         # magnitude, or to both real and imaginary parts!
         final_iteration.Data.D /= norm_fac
 
-    call_fit_functions(fit_data, ND)
+    if profiler.enabled:
+        # the integrated parameters are otherwise computed (and cached) when
+        # the results are saved
+        with profiler.stage('compute_par_stats'):
+            final_iteration.stat_pars
+
+    profiler.release()
 
     # invoke the garbage collection just to be sure
     gc.collect()
@@ -180,6 +377,10 @@ def fit_one_spectrum(fit_data):
 
 
 def call_fit_functions(fit_data, ND):
+    """Create the plots requested in fit_data['prep_opts']. This is called
+    after the fit by the plot workers (see
+    lib_dd.decomposition.plot_results)
+    """
     # only proceed if one of the plot functions will be called. This makes sure
     # that we can run without an existing output directory, and only fail if we
     # really try to plot...
@@ -203,10 +404,20 @@ def call_fit_functions(fit_data, ND):
 
     if(fit_data['prep_opts']['plot']):
         logging.info('Plotting final iteration')
-        ND.iterations[-1].plot(
-            filename='plot_iteration_{0}'.format(fit_data['nr']),
-            norm_factors=fit_data['inv_opts']['norm_factors']
-        )
+        if fit_data['prep_opts'].get('fast_plots', False):
+            plotter = lDDp.get_fast_plotter(
+                fit_data['prep_opts']['plot_dpi'],
+                fit_data['prep_opts']['plot_format'])
+            plotter.plot_to_file(
+                ND.iterations[-1],
+                'plot_iteration_{0}'.format(fit_data['nr']),
+                norm_factors=fit_data['inv_opts']['norm_factors']
+            )
+        else:
+            ND.iterations[-1].plot(
+                filename='plot_iteration_{0}'.format(fit_data['nr']),
+                norm_factors=fit_data['inv_opts']['norm_factors']
+            )
         ND.iterations[-1].Model.obj.plot_stats(
             '{0}'.format(fit_data['nr'])
         )
@@ -0,0 +1,248 @@
+"""
+Adaptive stopping criteria for the NDimInv inversion.
+
+In addition to the fixed criteria of NDimInv (RMS increase, absolute RMS
+change below 1e-5, invalid parameters, maximum number of iterations) the
+following criteria can be activated using the inversion settings:
+
+    stop_rms_rel : stop if the relative change of the stopping RMS between two
+                   iterations falls below this value
+    stop_model_rel : stop if the relative change of the model parameters
+                     (L2 norm) falls below this value
+    max_lambda_failures : stop after this number of lambda searches that did
+                          not improve the RMS
+
+The criterion that stopped the inversion is stored in the attribute
+stop_reason of the inversion object.
+
+Spectra with missing data points (inversion setting nan_mask, see the
+nan_handling option) use masked_iteration objects, whose RMS values only
+include the valid data points. The lambda search, the steplength search and
+the stopping criteria thus behave as for the cropped spectrum.
+"""
+import logging
+
+import numpy as np
+
+import NDimInv
+import NDimInv.reg_pars as LamFuncs
+import lib_dd.profiling as profiling
+
+
+# possible values of the stop_reason attribute
+stop_reasons = (
+    'max_iterations',
+    'steplength',
+    'nan_values',
+    'small_values',
+    'rms_increase',
+    'rms_threshold',
+    'rms_rel',
+    'model_rel',
+    'lambda_failures',
+    'triage',
+)
+
+
+class SearchLambdaCounted(LamFuncs.SearchLambda):
+    """Lambda search that counts the searches in which no test lambda
+    improved the RMS of the previous iteration
+    """
+    def __init__(self, lam0_obj, rms_key='rms_all_noerr', rms_index=0):
+        super(SearchLambdaCounted, self).__init__(lam0_obj, rms_key, rms_index)
+        self.nr_failures = 0
+
+    def _get_lambda(self, it, WtWm, old_lam):
+        best_lam = super(SearchLambdaCounted, self)._get_lambda(
+            it, WtWm, old_lam)
+        # the old lambda is only selected if the unchanged model yields the
+        # lowest rms
+        if best_lam == float(old_lam):
+            self.nr_failures += 1
+        return best_lam
+
+
+class masked_iteration(NDimInv.main.Iteration):
+    """Iteration whose RMS values are computed using only the frequencies
+    with valid data points (settings['nan_mask'])
+    """
+    @classmethod
+    def from_iteration(cls, it):
+        masked_it = cls(it.nr, it.Data, it.Model, it.RMS, it.settings)
+        masked_it.m = it.m
+        masked_it.lams = it.lams
+        masked_it.f = it.f
+        return masked_it
+
+    @property
+    def rms_values(self):
+        """RMS values as computed by NDimInv.main.RMS.rms_values, with the
+        missing data points removed from the first (frequency) dimension
+        """
+        mask = self.settings['nan_mask']
+        D = self.Data.D[mask]
+        F = self.Model.F(self.Model.convert_to_M(self.m))[mask]
+        diff = (D - F)
+
+        WD = self.Data.WD()[mask]
+        diff_err = diff * WD
+
+        diff_sq = diff ** 2
+        diff_err_sq = diff_err ** 2
+
+        rms_values = {}
+        for key, item in self.RMS.rms_types.items():
+            # determine which dimensions to sum up
+            full_item = np.array(item + [True, ] * (len(D.shape) - len(item)))
+            indices = np.where(full_item)[0]
+
+            for full_key, diff in zip((key + '_error', key + '_noerr'),
+                                      (diff_err_sq, diff_sq)):
+                rms_sum = np.sum(diff, axis=tuple(indices))
+                N = np.prod([diff.shape[x] for x in indices])
+                rms = np.atleast_1d(np.sqrt(rms_sum / N))
+                rms_values[full_key] = rms
+        return rms_values
+
+    def copy(self):
+        return masked_iteration.from_iteration(self)
+
+    def next_iteration(self):
+        new_iteration, stop_now = super(
+            masked_iteration, self).next_iteration()
+        if new_iteration is not None:
+            new_iteration = masked_iteration.from_iteration(new_iteration)
+        return new_iteration, stop_now
+
+
+class NDimInv_adaptive(NDimInv.NDimInv):
+    """NDimInv object with additional, configurable stopping criteria
+    """
+    def __init__(self, model, settings):
+        super(NDimInv_adaptive, self).__init__(model, settings)
+        self.stop_reason = None
+        # records the duration of each iteration (see lib_dd.profiling)
+        self.profiler = profiling.profiler(enabled=False)
+
+    def get_initial_iteration(self):
+        """Return the initial iteration (see NDimInv.main.InversionControl).
+        For spectra with missing data points, a masked_iteration is returned.
+        """
+        it = super(NDimInv_adaptive, self).get_initial_iteration()
+        if self.settings.get('nan_mask', None) is not None:
+            it = masked_iteration.from_iteration(it)
+        return it
+
+    def _stop(self, reason):
+        self.stop_reason = reason
+        return True
+
+    def _get_lambda_failures(self):
+        nr_failures = 0
+        for reg_sets in self.Model.regularizations.values():
+            for reg_set in reg_sets:
+                nr_failures += getattr(reg_set[1], 'nr_failures', 0)
+        return nr_failures
+
+    def run_inversion(self):
+        """Run the inversion as NDimInv.main.InversionControl.run_inversion,
+        but record the duration of each iteration
+        """
+        self.stop_reason = None
+        if (self.iterations == []):
+            self.start_inversion()
+        stop_now = False
+        while (stop_now is False and
+                not self.stop_before_next_iteration() and
+                self.iterations[-1].nr < self.settings['max_iterations']):
+            logging.info('Iteration: {0}'.format(self.iterations[-1].nr + 1))
+            with self.profiler.stage('iteration'):
+                new_iteration, stop_now = self.iterations[-1].next_iteration()
+                if (not stop_now):
+                    stop_now = self.check_stopping_criteria_before_update(
+                        new_iteration)
+
+            if (stop_now is False):
+                self.iterations.append(new_iteration)
+
+        if self.stop_reason is None:
+            if self.iterations[-1].nr >= self.settings['max_iterations']:
+                self.stop_reason = 'max_iterations'
+            else:
+                # no valid steplength could be found
+                self.stop_reason = 'steplength'
+
+    def check_stopping_criteria_before_update(self, new_it):
+        """
+        Return True if one of the stopping criteria applies. The fixed
+        criteria are the same as in NDimInv.main.InversionControl.
+        """
+        # return if any NaN values are found in the new parameters
+        if np.any(np.isnan(new_it.m)):
+            return self._stop('nan_values')
+
+        # return if any value is below 1e-15
+        if np.any(new_it.m[1:] < -15):
+            return self._stop('small_values')
+
+        rms_upd_eps = 1e-5  # min. requested rms change between iterations
+        allowed_rms_im_increase_first_iteration = 1e2
+
+        nr = self.iterations[-1].nr
+        old_rms = self.iterations[-1].rms_values[
+            self.stop_rms_key][self.stop_rms_index]
+        new_rms = new_it.rms_values[
+            self.stop_rms_key][self.stop_rms_index]
+
+        # if we are in the first iteration, then we allow a slight increase in
+        # the imaginary RMS, but not above a certain threshold
+        if (new_rms > old_rms):
+            if (nr == 0):
+                increase = (new_rms - old_rms)
+                if (increase > allowed_rms_im_increase_first_iteration):
+                    logging.info(
+                        'First iteration RMS-IM increase lies above: ' +
+                        '{0}'.format(
+                            allowed_rms_im_increase_first_iteration
+                        )
+                    )
+                    return self._stop('rms_increase')
+            else:
+                # in all other cases: we do not allow an increase in rms
+                logging.info('RMS Increase')
+                return self._stop('rms_increase')
+
+        # stop of the rms increase does not lie above a certain threshold
+        rms_diff = np.abs(new_rms - old_rms)
+        if (rms_diff < rms_upd_eps):
+            logging.info('RMS update below threshold: {0} - {1} < {2}'.format(
+                new_rms, old_rms, rms_upd_eps
+            ))
+            return self._stop('rms_threshold')
+
+        # adaptive criteria
+        stop_rms_rel = self.settings.get('stop_rms_rel', None)
+        if stop_rms_rel is not None and old_rms > 0:
+            if rms_diff / old_rms < stop_rms_rel:
+                logging.info('Relative RMS update below {0}'.format(
+                    stop_rms_rel))
+                return self._stop('rms_rel')
+
+        stop_model_rel = self.settings.get('stop_model_rel', None)
+        if stop_model_rel is not None:
+            m_old = self.iterations[-1].m
+            norm = np.linalg.norm(m_old)
+            if norm > 0:
+                model_change = np.linalg.norm(new_it.m - m_old) / norm
+                if model_change < stop_model_rel:
+                    logging.info('Relative model update below {0}'.format(
+                        stop_model_rel))
+                    return self._stop('model_rel')
+
+        max_lambda_failures = self.settings.get('max_lambda_failures', None)
+        if max_lambda_failures is not None:
+            if self._get_lambda_failures() >= max_lambda_failures:
+                logging.info('Maximum number of lambda search failures')
+                return self._stop('lambda_failures')
+
+        return False
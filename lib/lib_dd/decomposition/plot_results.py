@@ -0,0 +1,136 @@
+"""
+Post-fit plotting of ccd_single results.
+
+Plots are not created by the fit workers. After all spectra were fitted, each
+ND object is reduced to a compact plot record, and the plots are rendered in
+a separate process pool. The plot workers rebuild the inversion object of
+each spectrum from its fit_data dict, without estimating the starting model,
+and restore the iterations to plot from the record. This way the fit
+throughput does not depend on plotting, and the working directory is only
+changed in the plot workers (or, if only one core is used, temporarily in the
+main process).
+
+A plot record is a dict with the key 'iterations': a list with one dict for
+each iteration required by the plot options (only the final iteration, or all
+iterations if --plot_its or --plot_lambda is used):
+
+    nr : iteration number
+    m : model parameters
+    f : forward response
+    lams : regularization parameters
+    stat_pars : integrated parameters, if they were already computed (or
+                replaced, e.g. by the triage)
+"""
+import gc
+from multiprocessing import Pool
+
+import numpy as np
+
+import NDimInv
+import lib_dd.decomposition.ccd_single_stateless as decomp_single_sl
+
+
+# prep_opts keys that activate plots
+plot_keys = (
+    'plot',
+    'plot_reg_strength',
+    'plot_it_spectra',
+    'plot_lambda',
+)
+
+
+def plots_requested(prep_opts):
+    """Return True if any plot is activated in the prep_opts
+    """
+    will_activate = [
+        prep_opts[key] for key in plot_keys if prep_opts[key] is not None
+    ]
+    return bool(np.any(np.array(will_activate)))
+
+
+def get_plot_record(ND, prep_opts):
+    """Return the plot record (see module documentation) of a fitted ND
+    object
+    """
+    if(prep_opts['plot_it_spectra'] or prep_opts['plot_lambda'] is not None):
+        iterations = ND.iterations
+    else:
+        iterations = ND.iterations[-1:]
+
+    record = {
+        'iterations': [
+            {
+                'nr': it.nr,
+                'm': it.m,
+                'f': it.f,
+                'lams': it.lams,
+                'stat_pars': it.statpars,
+            } for it in iterations
+        ],
+    }
+    return record
+
+
+def restore_ND_object(fit_data, record):
+    """Rebuild the ND object of a spectrum and restore the iterations stored
+    in the plot record
+    """
+    # the starting model is not required for the plots: use the model of the
+    # first stored iteration instead of estimating it
+    fit_data = dict(fit_data)
+    fit_data['m0'] = record['iterations'][0]['m']
+    ND = decomp_single_sl._prepare_ND_object(fit_data)
+    ND.profiler.release()
+    ND.iterations = []
+    for it_record in record['iterations']:
+        it = NDimInv.main.Iteration(
+            it_record['nr'], ND.Data, ND.Model, ND.RMS, ND.settings)
+        it.m = it_record['m']
+        it.f = it_record['f']
+        it.lams = it_record['lams']
+        if it_record['stat_pars'] is not None:
+            # compute the integrated parameters anyway, as the model object
+            # stores them for plot_stats
+            it.stat_pars
+            it.statpars = it_record['stat_pars']
+        ND.iterations.append(it)
+    return ND
+
+
+def plot_one_spectrum(args):
+    """Create the requested plots of one spectrum
+
+    Parameters
+    ----------
+    args : tuple (fit_data, plot record)
+    """
+    fit_data, record = args
+    ND = restore_ND_object(fit_data, record)
+    decomp_single_sl.call_fit_functions(fit_data, ND)
+    gc.collect()
+
+
+def plot_results(fit_datas, NDlist, nr_cores=1):
+    """Create the requested plots of all fitted spectra using nr_cores
+    processes
+
+    Parameters
+    ----------
+    fit_datas : list of fit_data dicts, one for each spectrum (see
+                ccd_single_stateless._get_fit_datas)
+    NDlist : list of the corresponding fitted ND objects
+    nr_cores : number of plot processes
+    """
+    if not fit_datas or not plots_requested(fit_datas[0]['prep_opts']):
+        return
+    plot_args = [
+        (fit_data, get_plot_record(ND, fit_data['prep_opts'])) for
+        fit_data, ND in zip(fit_datas, NDlist)
+    ]
+    if(nr_cores == 1):
+        list(map(plot_one_spectrum, plot_args))
+    else:
+        p = Pool(nr_cores)
+        p.map(plot_one_spectrum, plot_args)
+        p.close()
+        p.join()
@@ -0,0 +1,128 @@
+"""
+Validate the float32 precision mode of the batch solver.
+
+The same data set is fitted twice using the batch solver, once in float64 and
+once in float32 precision. The deviations of selected integrated parameters
+are reported:
+
+    max_abs : maximum absolute deviation
+    median_abs : median absolute deviation
+    max_rel : maximum relative deviation (with respect to float64)
+    nr_nan_mismatch : number of spectra with a NaN value in only one of the
+                      runs
+
+Note that tau_50 and tau_mean are given in log10, i.e. their absolute
+deviations are given in decades.
+"""
+import time
+
+import numpy as np
+
+import lib_dd.interface as lDDi
+import lib_dd.config.cfg_single as cfg_single
+import lib_dd.decomposition.ccd_single as ccd_single
+
+
+# integrated parameters that are compared
+keys = ('m_tot_n', 'tau_50', 'tau_mean')
+
+
+def fit(frequencies, data, precision, config_dict=None):
+    """Fit the data using the batch solver with the given precision
+
+    Parameters
+    ----------
+    frequencies : frequencies [Hz] or frequency file
+    data : data (one spectrum per row) or data file
+    precision : 'float64' or 'float32'
+    config_dict : dict with additional cfg_single options (may be None)
+
+    Returns
+    -------
+    results : dict with one array (nr of spectra) for each of the keys, and
+              the fit time (key 'time')
+    """
+    config = cfg_single.cfg_single()
+    if config_dict is not None:
+        for key, value in config_dict.items():
+            config[key] = value
+    config['frequency_file'] = frequencies
+    config['data_file'] = data
+    config['solver'] = 'batch'
+    config['precision'] = precision
+    config['plot_spectra'] = False
+    config['plot_it_spectra'] = False
+    config['plot_reg_strength'] = False
+    config['plot_lambda'] = None
+
+    start_time = time.time()
+    ccd_obj = ccd_single.ccd_single(config)
+    ccd_obj.fit_data()
+    fit_time = time.time() - start_time
+
+    final_iterations = [(ND.iterations[-1], nr) for nr, ND in
+                        enumerate(ccd_obj.results)]
+    stat_pars = lDDi.aggregate_dicts(final_iterations, 'stat_pars')
+    norm_factors = ccd_obj.data.get('norm_factors', None)
+    results = {}
+    for key in keys:
+        values = lDDi.prepare_stat_values(stat_pars[key], key, norm_factors)
+        results[key] = np.atleast_2d(values.T)[0]
+    results['time'] = fit_time
+    return results
+
+
+def compare(results_ref, results):
+    """Return the deviations of the results from the reference results
+
+    Returns
+    -------
+    deviations : dict with one dict for each of the keys
+    """
+    deviations = {}
+    for key in keys:
+        ref = results_ref[key]
+        values = results[key]
+        valid = ~np.isnan(ref) & ~np.isnan(values)
+        diff = np.abs(values[valid] - ref[valid])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rel = diff / np.abs(ref[valid])
+        deviations[key] = {
+            'max_abs': np.max(diff) if diff.size > 0 else np.nan,
+            'median_abs': np.median(diff) if diff.size > 0 else np.nan,
+            'max_rel': np.nanmax(rel) if diff.size > 0 else np.nan,
+            'nr_nan_mismatch': int(
+                np.sum(np.isnan(ref) != np.isnan(values))),
+        }
+    return deviations
+
+
+def check_precision(frequencies, data, config_dict=None):
+    """Fit the data in float64 and float32 precision and return the
+    deviations (see compare) and the fit times of both runs
+    """
+    results64 = fit(frequencies, data, 'float64', config_dict)
+    results32 = fit(frequencies, data, 'float32', config_dict)
+    deviations = compare(results64, results32)
+    times = {
+        'float64': results64['time'],
+        'float32': results32['time'],
+    }
+    return deviations, times
+
+
+def format_report(deviations, times):
+    """Return the deviations as a text table
+    """
+    lines = [
+        'float64 fit time: {0:.2f} s, float32 fit time: {1:.2f} s'.format(
+            times['float64'], times['float32']),
+        '{0:<10} {1:>12} {2:>12} {3:>12} {4:>8}'.format(
+            'parameter', 'max_abs', 'median_abs', 'max_rel', 'nan_diff'),
+    ]
+    for key in keys:
+        dev = deviations[key]
+        lines.append('{0:<10} {1:>12.3e} {2:>12.3e} {3:>12.3e} {4:>8}'.format(
+            key, dev['max_abs'], dev['median_abs'], dev['max_rel'],
+            dev['nr_nan_mismatch']))
+    return '\n'.join(lines)
@@ -0,0 +1,162 @@
+"""
+Progress reporting of ccd_single runs.
+
+The parent process registers each finished spectrum (or batch of spectra) and
+periodically logs the number of finished spectra, the throughput, the
+estimated time of arrival (ETA), the mean number of iterations and the number
+of failed spectra. At the same time the status is written to status.json in
+the output directory (if it exists), so external job monitors can follow the
+run:
+
+    state : "running" or "finished"
+    nr_spectra : total number of spectra
+    nr_done : number of finished spectra
+    nr_failed : number of spectra that stopped due to NaN or too small
+                parameter values
+    nr_skipped : number of spectra skipped by the triage
+    elapsed : time since the start of the fit [s]
+    spectra_per_second : throughput
+    eta : estimated remaining time [s] (null if unknown)
+    mean_iterations : mean number of iterations of the finished spectra
+    updated : time of the last update (ISO format)
+"""
+import os
+import json
+import time
+import logging
+import datetime
+import threading
+
+import numpy as np
+
+
+status_filename = 'status.json'
+
+# stop reasons that indicate a failed fit
+failed_stop_reasons = ('nan_values', 'small_values')
+
+
+class progress_reporter(object):
+    """Aggregate finished spectra and report the progress of a run
+
+    Parameters
+    ----------
+    nr_spectra : total number of spectra
+    output_dir : directory of the status file. No status file is written if
+                 the directory is None or does not exist.
+    interval : minimum time between two reports [s]
+    """
+    def __init__(self, nr_spectra, output_dir=None, interval=10.0):
+        self.nr_spectra = nr_spectra
+        self.interval = interval
+        if output_dir is not None and os.path.isdir(output_dir):
+            self.status_file = output_dir + os.sep + status_filename
+        else:
+            self.status_file = None
+        self.start_time = time.time()
+        self.last_report = self.start_time
+        self.nr_done = 0
+        self.nr_failed = 0
+        self.nr_skipped = 0
+        self.nr_iterations = 0
+        # update() is called from the result handler thread of the pool
+        self._lock = threading.Lock()
+
+    def update(self, result):
+        """Register a finished ND object, or a list of ND objects
+        """
+        if not isinstance(result, list):
+            result = [result, ]
+        with self._lock:
+            for ND in result:
+                self.nr_done += 1
+                stop_reason = getattr(ND, 'stop_reason', None)
+                if stop_reason == 'triage':
+                    self.nr_skipped += 1
+                    continue
+                if stop_reason in failed_stop_reasons:
+                    self.nr_failed += 1
+                self.nr_iterations += ND.iterations[-1].nr
+
+    def status(self, state='running'):
+        """Return the status dict (see module documentation)
+        """
+        with self._lock:
+            elapsed = time.time() - self.start_time
+            nr_fitted = self.nr_done - self.nr_skipped
+            if elapsed > 0:
+                throughput = self.nr_done / elapsed
+            else:
+                throughput = 0.0
+            if throughput > 0:
+                eta = (self.nr_spectra - self.nr_done) / throughput
+            else:
+                eta = None
+            if nr_fitted > 0:
+                mean_iterations = self.nr_iterations / float(nr_fitted)
+            else:
+                mean_iterations = None
+            status = {
+                'state': state,
+                'nr_spectra': self.nr_spectra,
+                'nr_done': self.nr_done,
+                'nr_failed': self.nr_failed,
+                'nr_skipped': self.nr_skipped,
+                'elapsed': elapsed,
+                'spectra_per_second': throughput,
+                'eta': eta,
+                'mean_iterations': mean_iterations,
+                'updated': datetime.datetime.now().isoformat(),
+            }
+        return status
+
+    def report(self, force=False, state='running'):
+        """Log the progress and write the status file, if the last report
+        is at least interval seconds ago (or force is True)
+        """
+        now = time.time()
+        if not force and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        status = self.status(state)
+        logging.info(format_status(status))
+        if self.status_file is not None:
+            _write_status(self.status_file, status)
+
+    def finish(self):
+        self.report(force=True, state='finished')
+
+
+def format_status(status):
+    """Return a one-line description of the status dict
+    """
+    if status['eta'] is None:
+        eta = 'n/a'
+    else:
+        eta = '{0:.0f} s'.format(status['eta'])
+    if status['mean_iterations'] is None:
+        mean_iterations = np.nan
+    else:
+        mean_iterations = status['mean_iterations']
+    return ''.join((
+        'Progress: {0}/{1} spectra ({2:.1f} %), '.format(
+            status['nr_done'], status['nr_spectra'],
+            100.0 * status['nr_done'] / max(status['nr_spectra'], 1)),
+        '{0:.2f} spectra/s, ETA: {1}, '.format(
+            status['spectra_per_second'], eta),
+        'mean iterations: {0:.1f}, failed: {1}'.format(
+            mean_iterations, status['nr_failed']),
+    ))
+
+
+def _write_status(filename, status):
+    """Replace the status file atomically, so monitors never read a partially
+    written file
+    """
+    tmp_file = filename + '.tmp'
+    try:
+        with open(tmp_file, 'w') as fid:
+            json.dump(status, fid, indent=4)
+        os.replace(tmp_file, filename)
+    except OSError as e:
+        logging.info('Could not write the status file: {0}'.format(e))
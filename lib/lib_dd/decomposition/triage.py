@@ -0,0 +1,186 @@
+"""
+Cheap pre-screening of spectra before the inversion.
+
+Spectra without a usable polarization signal (e.g. noisy pixels of imaging
+data sets) would still run through the full Gauss-Newton loop including the
+lambda search. The triage computes a few indicators from the data and the
+starting model:
+
+    capacitive_fraction : fraction of data points with a capacitive response,
+                          i.e. a negative resistivity phase
+    snr : signal to noise ratio of the imaginary part. The noise is estimated
+          from the second differences of neighbouring data points.
+    rms0 : relative RMS of the imaginary part of the starting model response
+
+Spectra that do not meet the thresholds are not inverted. The statistical
+parameters of these spectra are set to NaN.
+"""
+import numpy as np
+
+import sip_formats.convert as sip_converter
+
+
+def get_indicators(ND, mask=None):
+    """Compute the triage indicators of an ND object with data and starting
+    model
+
+    Parameters
+    ----------
+    ND : NDimInv object, with data and model (including m0) set up
+    mask : boolean array, False for missing data points (may be None)
+
+    Returns
+    -------
+    indicators : dict with the keys capacitive_fraction, snr, rms0
+    """
+    data_format = ND.Data.obj.data_format
+    D = ND.Data.D
+    f0 = ND.Model.f(ND.Model.m0).reshape(D.shape, order='F')
+    if mask is not None:
+        D = D[mask]
+        f0 = f0[mask]
+
+    # resistivity real and imaginary parts
+    rre_rim = sip_converter.convert(
+        data_format, 'rre_rim', D.flatten(order='F'))
+    rim = rre_rim[int(rre_rim.size / 2):]
+    capacitive_fraction = np.sum(rim < 0) / float(rim.size)
+
+    # for white noise the variance of the second differences is six times the
+    # variance of the noise
+    signal = np.sqrt(np.mean(rim ** 2))
+    if rim.size > 2:
+        noise = np.sqrt(np.mean(np.diff(rim, n=2) ** 2) / 6.0)
+    else:
+        noise = 0
+    if noise > 0:
+        snr = signal / noise
+    else:
+        snr = np.inf
+
+    # relative misfit of the imaginary part (model data format)
+    norm = np.sqrt(np.mean(D[:, 1] ** 2))
+    if norm > 0:
+        rms0 = np.sqrt(np.mean((D[:, 1] - f0[:, 1]) ** 2)) / norm
+    else:
+        rms0 = np.inf
+
+    indicators = {
+        'capacitive_fraction': capacitive_fraction,
+        'snr': snr,
+        'rms0': rms0,
+    }
+    return indicators
+
+
+def screen(ND, prep_opts, mask=None):
+    """Decide if the spectrum of the ND object should be inverted
+
+    Parameters
+    ----------
+    ND : NDimInv object, with data and model (including m0) set up
+    prep_opts : dict with the thresholds triage_min_capacitive,
+                triage_min_snr, triage_max_rms (None disables the
+                corresponding check)
+    mask : boolean array, False for missing data points (may be None)
+
+    Returns
+    -------
+    result : dict with the indicators and the keys 'skip' (True/False) and
+             'reason' (description of the failed checks)
+    """
+    result = get_indicators(ND, mask)
+
+    reasons = []
+    for key, threshold_key, is_min in (
+            ('capacitive_fraction', 'triage_min_capacitive', True),
+            ('snr', 'triage_min_snr', True),
+            ('rms0', 'triage_max_rms', False)):
+        threshold = prep_opts.get(threshold_key, None)
+        if threshold is None:
+            continue
+        if is_min and not result[key] >= threshold:
+            reasons.append('{0} < {1}'.format(key, threshold))
+        elif not is_min and not result[key] <= threshold:
+            reasons.append('{0} > {1}'.format(key, threshold))
+
+    result['skip'] = len(reasons) > 0
+    result['reason'] = ', '.join(reasons)
+    return result
+
+
+def _nan_like(value):
+    if np.isscalar(value):
+        return np.nan
+    shape = np.shape(value)
+    if np.prod(shape) == 0:
+        # e.g. no peaks were found in the starting model: the values of
+        # the skipped spectrum are unknown, not missing
+        shape = (1, ) + shape[1:]
+    return np.nan * np.ones(shape)
+
+
+def set_nan_results(iteration):
+    """Replace the statistical parameters of the iteration by NaN values of
+    the same shape. Empty arrays (e.g. tau_peaks_all) are replaced by one NaN
+    value.
+    """
+    stat_pars = iteration.stat_pars
+    for key in stat_pars.keys():
+        stat_pars[key] = [_nan_like(x) for x in stat_pars[key]]
+
+
+def summarize(NDlist):
+    """Summarize the triage results of a list of ND objects. Return None if
+    no triage was applied.
+
+    The compute time saved is estimated using the mean fit time of the
+    inverted spectra.
+    """
+    results = [getattr(ND, 'triage', None) for ND in NDlist]
+    if any(x is None for x in results):
+        return None
+
+    skipped = np.array([x['skip'] for x in results])
+    fit_times = np.array([x['fit_time'] for x in results])
+
+    nr_fitted = np.sum(~skipped)
+    if nr_fitted > 0:
+        mean_fit_time = np.mean(fit_times[~skipped])
+    else:
+        mean_fit_time = np.nan
+    time_saved = np.sum(
+        np.maximum(mean_fit_time - fit_times[skipped], 0))
+    time_total = np.sum(fit_times) + time_saved
+
+    summary = {
+        'nr_spectra': len(results),
+        'nr_skipped': int(np.sum(skipped)),
+        'mean_fit_time': mean_fit_time,
+        'time_saved': time_saved,
+        'fraction_saved': time_saved / time_total if time_total > 0 else 0,
+    }
+    return summary
+
+
+def save_triage(filename, NDlist, header=''):
+    """Save the triage indicators of all spectra to a text file (nothing is
+    written if no triage was applied)
+    """
+    summary = summarize(NDlist)
+    if summary is None:
+        return
+
+    columns = ('skip', 'capacitive_fraction', 'snr', 'rms0', 'fit_time')
+    values = np.array(
+        [[float(ND.triage[key]) for key in columns] for ND in NDlist])
+    with open(filename, 'wb') as fid:
+        fid.write(bytes(header, 'UTF-8'))
+        fid.write(bytes(
+            '# skipped {0} of {1} spectra, estimated time saved: '.format(
+                summary['nr_skipped'], summary['nr_spectra']) +
+            '{0:.2f} s ({1:.1f} %)\n'.format(
+                summary['time_saved'], summary['fraction_saved'] * 100),
+            'UTF-8'))
+        fid.write(bytes('#' + ' '.join(columns) + '\n', 'UTF-8'))
+        np.savetxt(fid, np.atleast_2d(values))
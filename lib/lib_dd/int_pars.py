@@ -229,6 +229,44 @@ def _get_peaks(pars, s):
     return s_peaks, tau_peaks, f_peaks
 
 
+def _get_peaks_array(m_i, s, nr_peaks, sort_by_m=False):
+    """
+    Return the first nr_peaks peaks of multiple relaxation time distributions
+    at once. The peaks are determined as in _get_peaks.
+
+    Parameters
+    ----------
+    m_i : NxM array with N relaxation time distributions (linear or log10)
+    s : log10 relaxation times (size M)
+    nr_peaks : maximum number of peaks returned per distribution
+    sort_by_m : if True, return the peaks with the largest chargeabilities
+                first. Otherwise the low-frequency peaks come first.
+
+    Returns
+    -------
+    s_peaks : N x nr_peaks array with the log10 rel. times of the peaks, padded
+              with NaN values
+    f_peaks : N x nr_peaks array with the corresponding frequencies
+    """
+    m_i = np.atleast_2d(m_i)
+    rows, cols = sp.argrelmax(m_i, axis=1)
+    if sort_by_m:
+        order = np.lexsort((-m_i[rows, cols], rows))
+    else:
+        order = np.lexsort((-cols, rows))
+    rows = rows[order]
+    cols = cols[order]
+
+    # rank of each peak within its distribution
+    rank = np.arange(rows.size) - np.searchsorted(rows, rows)
+    keep = rank < nr_peaks
+
+    s_peaks = np.nan * np.ones((m_i.shape[0], nr_peaks))
+    s_peaks[rows[keep], rank[keep]] = s[cols[keep]]
+    f_peaks = 1 / (2 * np.pi * 10 ** s_peaks)
+    return s_peaks, f_peaks
+
+
 def decade_loadings(pars, tau, s):
     r"""Compute the chargeability sum for each frequency decade. Store in linear
     scale.
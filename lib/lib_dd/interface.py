@@ -93,43 +93,145 @@ def aggregate_dicts(iteration_list, dict_name):
 # ## load functions ###
 
 
-def _get_frequencies(options):
+def _get_frequency_mask(frequencies, options):
+    """Return a boolean mask of the frequencies to keep, or None if all
+    frequencies are used.
+    """
+    mask = np.ones(frequencies.size, dtype=bool)
+
     # we can filter by id (0-indexed)
     if options['ignore_frequencies'] is not None:
         f_ignore_ids = [int(x) for x in
                         options['ignore_frequencies'].split(',')]
-    else:
-        f_ignore_ids = []
-
-    if isinstance(options['frequency_file'], np.ndarray):
-        frequencies = options['frequency_file']
-    else:
-        frequencies = np.loadtxt(options['frequency_file'])
+        mask[f_ignore_ids] = False
 
     # or we can filter by values
     if options['data_fmin'] is not None:
-        f_below_ids = np.where(frequencies < options['data_fmin'])[0]
-        f_ignore_ids.extend(f_below_ids.tolist())
+        mask &= (frequencies >= options['data_fmin'])
 
     if options['data_fmax'] is not None:
-        f_above_ids = np.where(frequencies > options['data_fmax'])[0]
-        f_ignore_ids.extend(f_above_ids.tolist())
+        mask &= (frequencies <= options['data_fmax'])
 
-    # filter frequencies
-    if len(f_ignore_ids) > 0:
-        # remove duplicates
-        f_ignore_ids = list(set(f_ignore_ids))
+    if np.all(mask):
+        return None
+    return mask
+
+
+def _get_frequencies(options):
+    if isinstance(options['frequency_file'], np.ndarray):
+        frequencies = options['frequency_file']
+    else:
+        frequencies = np.loadtxt(options['frequency_file'])
 
-        # sort
-        f_ignore_ids = sorted(f_ignore_ids)
+    mask = _get_frequency_mask(frequencies, options)
 
-        frequencies = np.delete(frequencies, f_ignore_ids, axis=0)
+    # filter frequencies
+    if mask is not None:
+        f_ignore_ids = np.where(~mask)[0].tolist()
+        frequencies = frequencies[mask]
     else:
         f_ignore_ids = None
 
     return frequencies, f_ignore_ids
 
 
+# input formats that can be converted in place
+_inplace_formats = (
+    'rre_rim',
+    'rre_rmim',
+    'rmag_rpha',
+    'log10rmag_rpha',
+    'lnrmag_rpha',
+    'cre_cim',
+    'cre_cmim',
+    'cmag_cpha',
+)
+
+# number of spectra converted at once by _convert_inplace
+_inplace_block_size = 256
+
+
+def _convert_inplace(data, input_format, output_format):
+    """Convert the data (one spectrum per row) from input_format to either
+    rre_rim or cre_cim, overwriting the array.
+
+    The spectra are converted in blocks of _inplace_block_size rows using
+    sip_formats.convert.convert, so the results are identical to a
+    conversion of the whole array (including the single precision phase
+    values of the magnitude/phase formats), but only scratch memory for one
+    block is needed.
+
+    Returns
+    -------
+    True if the conversion was done, False if input or output formats are not
+    supported (data is not changed in this case)
+    """
+    if(input_format not in _inplace_formats or
+       output_format not in ('rre_rim', 'cre_cim')):
+        return False
+
+    for start in range(0, data.shape[0], _inplace_block_size):
+        block = data[start: start + _inplace_block_size]
+        block[:] = SC.convert(input_format, output_format, block)
+    return True
+
+
+def preprocess_data(raw_data, frequency_mask, input_format, output_format,
+                    norm=None, copy=True):
+    """Apply frequency filtering, format conversion and normalization to the
+    raw data in one pass.
+
+    The result array is allocated at most once; if copy is False and no
+    frequencies are removed, the raw data is converted in place. NaN values
+    are propagated to the result.
+
+    Parameters
+    ----------
+    raw_data : NxM array, one spectrum per row (M = 2 x nr of frequencies)
+    frequency_mask : boolean mask of the frequencies to keep (None: keep all)
+    input_format : data format of raw_data
+    output_format : data format of the result (rre_rim or cre_cim for the
+                    in-place conversion, all other formats are converted using
+                    sip_formats.convert)
+    norm : if not None, normalize the real part of the lowest (not NaN)
+           frequency of each spectrum to this value
+    copy : if False, raw_data may be overwritten
+
+    Returns
+    -------
+    data : NxK array with the processed data
+    norm_factors : array with the normalization factors (None if norm is None)
+    """
+    raw_data = np.atleast_2d(raw_data)
+    nr_f = int(raw_data.shape[1] / 2)
+
+    if frequency_mask is not None:
+        nr_keep = int(np.sum(frequency_mask))
+        data = np.empty((raw_data.shape[0], 2 * nr_keep), dtype=float)
+        np.compress(frequency_mask, raw_data[:, 0:nr_f], axis=1,
+                    out=data[:, 0:nr_keep])
+        np.compress(frequency_mask, raw_data[:, nr_f:], axis=1,
+                    out=data[:, nr_keep:])
+    elif copy or raw_data.dtype != np.float64:
+        data = np.array(raw_data, dtype=float)
+    else:
+        data = raw_data
+
+    if input_format != output_format:
+        if not _convert_inplace(data, input_format, output_format):
+            data = SC.convert(input_format, output_format, data)
+
+    norm_factors = None
+    if norm is not None:
+        # use the first frequency without NaN values of each spectrum
+        nr_f = int(data.shape[1] / 2)
+        first_index = np.argmax(~np.isnan(data[:, 0:nr_f]), axis=1)
+        norm_factors = norm / data[np.arange(data.shape[0]), first_index]
+        data *= norm_factors[:, np.newaxis]
+
+    return data, norm_factors
+
+
 def load_frequencies_and_data(options):
     """
     Load frequencies and data from options.frequency_file and
@@ -151,13 +253,21 @@ def load_frequencies_and_data(options):
     """
     data = {}
 
-    frequencies, f_ignore_ids = _get_frequencies(options)
+    if isinstance(options['frequency_file'], np.ndarray):
+        frequencies = options['frequency_file']
+    else:
+        frequencies = np.loadtxt(options['frequency_file'])
+    frequency_mask = _get_frequency_mask(frequencies, options)
+    if frequency_mask is not None:
+        frequencies = frequencies[frequency_mask]
     data['frequencies'] = frequencies
+
     # # data ##
     # # load raw data
-
     if isinstance(options['data_file'], np.ndarray):
         raw_data = np.atleast_2d(options['data_file'])
+        # do not change the array of the caller
+        copy = True
     else:
         try:
             raw_data = np.atleast_2d(np.loadtxt(options['data_file']))
@@ -165,16 +275,7 @@ def load_frequencies_and_data(options):
             print('There was an error loading the data file')
             print(e)
             exit()
-
-    # # filter frequencies
-    if f_ignore_ids is not None:
-        # split data for easy access
-        part1 = raw_data[:, 0:int(raw_data.shape[1] / 2)]
-        part2 = raw_data[:, int(raw_data.shape[1] / 2):]
-        part1 = np.delete(part1, f_ignore_ids, axis=1)
-        part2 = np.delete(part2, f_ignore_ids, axis=1)
-        # rebuild raw_data
-        raw_data = np.hstack((part1, part2))
+        copy = False
 
     # we always work with the native model data format
     if int(os.environ.get('DD_COND', 0)) == 1:
@@ -182,19 +283,15 @@ def load_frequencies_and_data(options):
     else:
         target_format = "rre_rim"
 
-    raw_data = SC.convert(options['data_format'], target_format, raw_data)
+    # filter frequencies, convert to the model format and normalize (note:
+    # the normalisation is always applied in the model data format)
+    raw_data, norm_factors = preprocess_data(
+        raw_data, frequency_mask, options['data_format'], target_format,
+        options['norm'], copy=copy)
     options['data_format'] = target_format
 
-    # apply normalization if necessary
-    # note, because the previous format transformations, the normalisation can
-    # directly be applied (it is always given in the model data format)
-    if options['norm'] is not None:
-        norm_factors = options['norm'] / raw_data[:, 0]
-        norm_factors = norm_factors[:, np.newaxis]
-
-        # apply factors
-        raw_data *= norm_factors
-        data['norm_factors'] = np.atleast_1d(norm_factors[:, 0].squeeze())
+    if norm_factors is not None:
+        data['norm_factors'] = np.atleast_1d(norm_factors)
 
     data['raw_format'] = options['data_format']
     data['raw_data'] = raw_data
@@ -205,7 +302,7 @@ def load_frequencies_and_data(options):
 # ## save functions ###
 
 
-def save_stat_pars(stat_pars, norm_factors=None):
+def save_stat_pars(stat_pars, norm_factors=None, fmt='%.18e'):
     """
     Saves to current working directy.
     """
@@ -220,7 +317,7 @@ def save_stat_pars(stat_pars, norm_factors=None):
         values = prepare_stat_values(raw_values, key, norm_factors)
 
         filename = '{0}_results.dat'.format(key)
-        np.savetxt(filename, np.atleast_1d(values))
+        np.savetxt(filename, np.atleast_1d(values), fmt=fmt)
 
 
 def prepare_stat_values(raw_values, key, norm_factors):
@@ -7,9 +7,9 @@ import json
 
 import numpy as np
 
-import lib_dd.version as version
 import lib_dd.interface as lDDi
 import lib_dd.io.helper as helper
+import lib_dd.decomposition.triage as triage
 
 
 def save_base_results(final_iterations, data):
@@ -17,33 +17,32 @@ def save_base_results(final_iterations, data):
     Save data files that are shared between
     dd_single.py/dd_time.py/dd_space_time.py
     """
-    # convert all arrays to lists
-    for key in data['inv_opts'].keys():
-        if isinstance(data['inv_opts'][key], np.ndarray):
-            data['inv_opts'][key] = data['inv_opts'][key].tolist()
+    metadata = helper.get_run_metadata(data, final_iterations[0][0])
     with open('inversion_options.json', 'w') as fid:
-        json.dump(data['inv_opts'], fid)
+        json.dump(metadata['inv_opts'], fid)
 
     with open('version.dat', 'w') as fid:
-        fid.write(version._get_version_numbers() + '\n')
+        fid.write(metadata['version'] + '\n')
 
     # with open('data_format.dat', 'w') as fid:
     #     fid.write(final_iterations[0][0].Data.obj.data_format + '\n')
 
     # save call to debye_decomposition.py
     with open('command.dat', 'w') as fid:
-        cmd = lDDi.get_command()
-        fid.write(cmd)
+        fid.write(metadata['command'])
+
+    with open('run_id.dat', 'w') as fid:
+        fid.write(metadata['uuid'] + '\n')
 
     final_iterations[0][0].RMS.save_rms_definition('rms_definition.json')
 
     # save tau/s
-    np.savetxt('tau.dat', final_iterations[0][0].Data.obj.tau)
-    np.savetxt('s.dat', final_iterations[0][0].Data.obj.s)
+    np.savetxt('tau.dat', metadata['tau'])
+    np.savetxt('s.dat', metadata['s'])
 
     # save frequencies/omega
-    np.savetxt('frequencies.dat', final_iterations[0][0].Data.obj.frequencies)
-    np.savetxt('omega.dat', final_iterations[0][0].Data.obj.omega)
+    np.savetxt('frequencies.dat', metadata['frequencies'])
+    np.savetxt('omega.dat', metadata['omega'])
 
     # save weighting factors
     Wd_diag = final_iterations[0][0].Data.Wd.diagonal()
@@ -74,6 +73,10 @@ def save_data(data, NDlist):
     final_iterations = [(x.iterations[-1], nr) for nr, x in enumerate(NDlist)]
 
     save_base_results(final_iterations, data)
+    triage.save_triage('triage.dat', NDlist)
+    with open('stop_reasons.dat', 'w') as fid:
+        for ND in NDlist:
+            fid.write('{0}\n'.format(getattr(ND, 'stop_reason', None)))
     if not os.path.isdir('stats_and_rms'):
         os.makedirs('stats_and_rms')
     os.chdir('stats_and_rms')
@@ -82,7 +85,8 @@ def save_data(data, NDlist):
         norm_factors = data['norm_factors']
     else:
         norm_factors = None
-    lDDi.save_stat_pars(stats_for_all_its, norm_factors)
+    lDDi.save_stat_pars(
+        stats_for_all_its, norm_factors, helper.get_output_fmt(data))
 
     rms_for_all_its = lDDi.aggregate_dicts(final_iterations, 'rms_values')
     lDDi.save_rms_values(rms_for_all_its, final_iterations[0][0].RMS.rms_names)
@@ -101,7 +105,8 @@ def save_data(data, NDlist):
 
     # save model response
     with open('f.dat', 'wb') as fid:
-        helper.save_f(fid, final_iterations, norm_factors)
+        helper.save_f(
+            fid, final_iterations, norm_factors, helper.get_output_fmt(data))
 
     # save times
     if 'times' in data:
@@ -1,48 +1,57 @@
 import json
-import datetime
-import uuid
 
 import numpy as np
 
 import lib_dd.interface as lDDi
-import lib_dd.version as version
 import lib_dd.io.helper as helper
+import lib_dd.decomposition.triage as triage
 
 
-def _get_header():
+def _get_header(metadata):
     """Return a header string that can be added to each output file
-    """
-    uuidstr = str(uuid.uuid4())
-
-    datetimestr = datetime.datetime.strftime(
-        datetime.datetime.now(), '%Y%m%d_%Hh:%Mm')
 
-    command = lDDi.get_command().split("\n")
-    command = ';'.join(command)
+    Parameters
+    ----------
+    metadata : run metadata (see lib_dd.io.helper.get_run_metadata)
+    """
+    command = ';'.join(metadata['command'].split("\n"))
 
     # assemble header
-    header = '\n'.join(('# id:' + uuidstr,
-                        '# ' + datetimestr,
+    header = '\n'.join(('# id:' + metadata['uuid'],
+                        '# ' + metadata['date'],
                         '# ' + command))
     header += '\n'
     return header
 
 
-def save_results(data, NDlist):
+def save_results(data, NDlist, collector=None):
     """Save fit results to the current directory
+
+    Parameters
+    ----------
+    data : data dict
+    NDlist : list of ND objects
+    collector : result_collector already filled with the results of NDlist
+                (e.g. while the spectra were fitted). If None, or if the
+                collector is incomplete, the results are collected here.
     """
     norm_factors = data.get('norm_factors', None)
-    header = _get_header()
     final_iterations = [(x.iterations[-1], nr) for nr, x in enumerate(NDlist)]
+    metadata = helper.get_run_metadata(data, final_iterations[0][0])
+    header = _get_header(metadata)
+
+    if collector is None or not collector.is_complete():
+        collector = result_collector(len(NDlist), data['frequencies'])
+        collector.add_all(NDlist)
 
-    save_integrated_parameters(final_iterations, data, header)
+    save_integrated_parameters(collector, data, header)
     save_frequency_data(final_iterations, data, header)
-    save_data(data, norm_factors, final_iterations)
+    save_data(data, norm_factors, final_iterations, header, collector)
 
     with open('frequencies.dat', 'wb') as fid:
         fid.write(bytes(header, 'UTF-8'))
         fid.write(bytes('# frequencies [Hz]\n', 'UTF-8'))
-        np.savetxt(fid, final_iterations[0][0].Data.obj.frequencies)
+        np.savetxt(fid, metadata['frequencies'])
 
     with open('tau.dat', 'wb') as fid:
         fid.write(bytes(header, 'UTF-8'))
@@ -50,7 +59,7 @@ def save_results(data, NDlist):
             '# relaxation times used for the decomposition\n',
             'UTF-8')
         )
-        np.savetxt(fid, final_iterations[0][0].Data.obj.tau)
+        np.savetxt(fid, metadata['tau'])
 
     # final_iterations[0][0].RMS.save_rms_definition('rms_definition.json')
 
@@ -73,6 +82,14 @@ def save_results(data, NDlist):
         print(e)
         pass
 
+    # save the criterion which stopped each inversion
+    stop_reasons = [getattr(x, 'stop_reason', None) for x in NDlist]
+    with open('stop_reasons.dat', 'wb') as fid:
+        fid.write(bytes(header, 'UTF-8'))
+        fid.write(bytes('# stopping criterion of each fit\n', 'UTF-8'))
+        for stop_reason in stop_reasons:
+            fid.write(bytes('{0}\n'.format(stop_reason), 'UTF-8'))
+
     # save normalization factors
     if('norm_factors' in data):
         with open('normalization_factors.dat', 'wb') as fid:
@@ -94,28 +111,23 @@ def save_results(data, NDlist):
         )
         np.savetxt(fid, Wd_diag)
 
+    # indicators of the pre-screening (if used)
+    triage.save_triage('triage.dat', NDlist, header)
+
     with open('version.dat', 'wb') as fid:
         fid.write(bytes(header, 'UTF-8'))
-        fid.write(bytes(
-            version._get_version_numbers() + '\n', 'UTF-8')
-        )
-
-    iopts = data['inv_opts']
-    for key in iopts.keys():
-        if isinstance(iopts[key], np.ndarray):
-            iopts[key] = iopts[key].tolist()
+        fid.write(bytes(metadata['version'] + '\n', 'UTF-8'))
 
     with open('inversion_options.json', 'wb') as fid:
         fid.write(bytes(header, 'UTF-8'))
         fid.write(bytes('# inversion options dict\n', 'UTF-8'))
         fid.write(bytes(
-            json.dumps(iopts),
+            json.dumps(metadata['inv_opts']),
             'UTF-8'
         ))
 
 
-def save_data(data, norm_factors, final_iterations):
-    header = _get_header()
+def save_data(data, norm_factors, final_iterations, header, collector):
     # save original data
     with open('data.dat', 'wb') as fid:
         fid.write(bytes(header, 'UTF-8'))
@@ -135,7 +147,14 @@ def save_data(data, norm_factors, final_iterations):
             final_iterations[0][0].Data.obj.data_format + '\n',
             'UTF-8'
         ))
-        helper.save_f(fid, final_iterations, norm_factors)
+        f_data = collector.f
+        if norm_factors is not None:
+            f_data = f_data / np.atleast_1d(norm_factors)[:, np.newaxis]
+        fid.write(bytes(
+            helper.format_array(f_data, helper.get_output_fmt(data)),
+            'UTF-8'))
+    with open('f_format.dat', 'w') as fid:
+        fid.write(final_iterations[0][0].Data.obj.data_format)
 
     # save times
     if 'times' in data:
@@ -148,11 +167,122 @@ def save_data(data, norm_factors, final_iterations):
             np.savetxt(fid, data['times'])
 
 
-def save_integrated_parameters(final_iterations, data, header):
-    stat_pars = lDDi.aggregate_dicts(final_iterations, 'stat_pars')
-    # get keys of statistical parameters
-    keys = stat_pars.keys()
+class result_collector(object):
+    """Collect the per-spectrum results written by save_results in
+    preallocated arrays. Results can be added in any order while they arrive
+    from the fit workers (see ccd_single.fit_data). The stored forward
+    responses of the final iterations are used.
+
+    Array-valued integrated parameters of varying length (e.g. tau_peaks_all)
+    are padded with NaN values.
+
+    The forward responses of spectra with cropped frequencies (see the
+    nan_handling option) have fewer values than those of the other spectra.
+    If no frequencies are given, such results are refused with a ValueError.
+    Otherwise, the forward responses are stored at their frequencies, with
+    NaN values at the cropped frequencies.
 
+    Parameters
+    ----------
+    nr_spectra : number of spectra
+    frequencies : frequencies of the data (all spectra), or None
+    """
+    def __init__(self, nr_spectra, frequencies=None):
+        self.nr_spectra = nr_spectra
+        self.frequencies = frequencies
+        self.stat_pars = None
+        self.f = None
+        self.filled = np.zeros(nr_spectra, dtype=bool)
+
+    def _allocate(self, stat_pars, f_rows):
+        self.stat_pars = {}
+        for key, item in stat_pars.items():
+            if(type(item) is list):
+                item = item[0]
+            value = np.asarray(item)
+            if value.ndim == 0:
+                shape = (self.nr_spectra, )
+            else:
+                shape = (self.nr_spectra, value.size)
+            self.stat_pars[key] = np.nan * np.ones(shape)
+        if self.frequencies is not None:
+            nr_values = 2 * len(self.frequencies)
+        else:
+            nr_values = f_rows.shape[1]
+        self.f = np.nan * np.ones((self.nr_spectra, nr_values))
+
+    def _store(self, key, index, value):
+        values = self.stat_pars[key]
+        if values.ndim == 1:
+            values[index] = value
+            return
+        value = np.atleast_1d(value)
+        if value.size > values.shape[1]:
+            # widen the array and pad the remaining spectra with NaN
+            padding = np.nan * np.ones(
+                (values.shape[0], value.size - values.shape[1]))
+            values = np.hstack((values, padding))
+            self.stat_pars[key] = values
+        values[index, :value.size] = value
+        values[index, value.size:] = np.nan
+
+    def _get_forward_row(self, index, it, f_rows):
+        """Return the forward response of the spectrum with the width of
+        self.f. Raise a ValueError if the widths differ and the response can
+        not be assigned to the frequencies.
+        """
+        row = f_rows[0]
+        if row.size == self.f.shape[1]:
+            return row
+        if self.frequencies is not None:
+            mask = np.in1d(self.frequencies, it.Data.obj.frequencies)
+            if 2 * np.sum(mask) == row.size:
+                nr_values = int(row.size / 2)
+                full_row = np.nan * np.ones(self.f.shape[1])
+                full_row[0:len(mask)][mask] = row[0:nr_values]
+                full_row[len(mask):][mask] = row[nr_values:]
+                return full_row
+        raise ValueError(
+            'Spectrum {0}: the forward response has {1} values '.format(
+                index + 1, row.size) +
+            'instead of {0} (cropped frequencies)'.format(self.f.shape[1]))
+
+    def add(self, index, ND):
+        """Store the final iteration of the ND object as spectrum index
+        (starting at 0)
+        """
+        it = ND.iterations[-1]
+        stat_pars = it.stat_pars
+        f_rows = helper.get_forward_rows(it)
+        if self.stat_pars is None:
+            self._allocate(stat_pars, f_rows)
+        # check the forward response before anything is stored
+        f_row = self._get_forward_row(index, it, f_rows)
+        for key in self.stat_pars.keys():
+            value = stat_pars[key]
+            # see lib_dd.interface.aggregate_dicts
+            if(type(value) is list):
+                value = value[0]
+            self._store(key, index, value)
+        self.f[index] = f_row
+        self.filled[index] = True
+
+    def add_all(self, NDlist):
+        for index, ND in enumerate(NDlist):
+            self.add(index, ND)
+
+    def is_complete(self):
+        return bool(np.all(self.filled))
+
+    def get_stat_values(self, key, norm_factors):
+        """Return the NxM array of the integrated parameter, renormalized as
+        in lib_dd.interface.prepare_stat_values
+        """
+        return lDDi.prepare_stat_values(
+            self.stat_pars[key], key, norm_factors)
+
+
+def save_integrated_parameters(collector, data, header):
     norm_factors = data.get('norm_factors', None)
 
     # do not save these values here
@@ -161,34 +291,34 @@ def save_integrated_parameters(final_iterations, data, header):
     pars_labels = []
     pars_list = []
     # save keys (statistics)
-    for key in sorted(keys):
-        raw_values = stat_pars[key]
+    for key in sorted(collector.stat_pars.keys()):
+        if key == 'm_data':
+            continue
         # we need to treat some keys different than others before we can save
         # them
-        values = lDDi.prepare_stat_values(raw_values, key, norm_factors)
+        values = collector.get_stat_values(key, norm_factors)
 
         if key not in black_list:
-            for nr, value in enumerate(values.T):
+            for nr in range(0, values.shape[1]):
                 postfix = ''
                 if nr > 0:
                     postfix = '-{0}'.format(nr)
                 pars_labels.append(key + postfix)
-                pars_list.append(value)
+            pars_list.append(values)
         else:
-            if key not in ('m_data', ):
-                # save to its own file
-                with open(key + '.dat', 'wb') as fid:
-                    fid.write(bytes(header, 'UTF-8'))
-                    out_str = '#' + key + '\n'
-                    fid.write(bytes(out_str, 'UTF-8'))
-                    np.savetxt(fid, values)
-
-    all_data = np.vstack(pars_list).T
+            # save to its own file
+            with open(key + '.dat', 'wb') as fid:
+                fid.write(bytes(
+                    header + '#' + key + '\n' + helper.format_array(
+                        values, helper.get_output_fmt(data)),
+                    'UTF-8'))
+
+    all_data = np.hstack(pars_list)
     with open('integrated_parameters.dat', 'wb') as fid:
-        fid.write(bytes(header, 'UTF-8'))
-        out_str = '#' + ' '.join(pars_labels) + '\n'
-        fid.write(bytes(out_str, 'UTF-8'))
-        np.savetxt(fid, all_data, fmt='%.6f')
+        fid.write(bytes(
+            header + '#' + ' '.join(pars_labels) + '\n' +
+            helper.format_array(all_data, '%.6f'),
+            'UTF-8'))
 
 
 def save_frequency_data(final_iterations, data, header):
@@ -1,30 +1,120 @@
+import uuid
+import datetime
+
 import numpy as np
 
+import lib_dd.interface as lDDi
+import lib_dd.version as version
+
+
+def get_output_fmt(data):
+    """Return the number format of np.savetxt for large output arrays. In the
+    float32 precision mode only the significant digits of single precision
+    values are written.
+    """
+    if data.get('prep_opts', {}).get('precision', 'float64') == 'float32':
+        return '%.7e'
+    return '%.18e'
+
+
+def get_run_metadata(data, final_iteration):
+    """Return the metadata shared by all spectra of a run. The metadata are
+    built once and cached in data['run_metadata'], so all output files of a
+    run refer to the same run id.
+
+    Returns
+    -------
+    metadata : dict with the keys
+               uuid : id of the run
+               date : date of the run
+               command : command call (see lib_dd.interface.get_command)
+               version : version numbers of the involved packages
+               inv_opts : JSON-compatible copy of data['inv_opts']. The
+                          frequencies are not included, they are written to
+                          frequencies.dat
+               frequencies, omega, tau, s : arrays of the (first) spectrum
+    """
+    if 'run_metadata' not in data:
+        inv_opts = {}
+        for key, item in data['inv_opts'].items():
+            if key == 'frequencies':
+                continue
+            if isinstance(item, np.ndarray):
+                item = item.tolist()
+            inv_opts[key] = item
+
+        obj = final_iteration.Data.obj
+        data['run_metadata'] = {
+            'uuid': str(uuid.uuid4()),
+            'date': datetime.datetime.strftime(
+                datetime.datetime.now(), '%Y%m%d_%Hh:%Mm'),
+            'command': lDDi.get_command(),
+            'version': version._get_version_numbers(),
+            'inv_opts': inv_opts,
+            'frequencies': obj.frequencies,
+            'omega': obj.omega,
+            'tau': obj.tau,
+            's': obj.s,
+        }
+    return data['run_metadata']
+
+
+def get_forward_response(it, M=None):
+    """Return the forward response of the iteration in the shape of
+    it.Data.D. The forward response stored during the inversion (it.f, the
+    spectra flattened in Fortran order) is reused if possible.
+
+    Parameters
+    ----------
+    it : iteration
+    M : model parameters of the iteration (it.Model.convert_to_M(it.m)),
+        computed if required and not provided
+    """
+    D = it.Data.D
+    if(it.f is not None and it.f.size == D.size and
+       len(it.Data.extra_dims) <= 1):
+        return np.reshape(it.f, D.shape, order='F')
+    if M is None:
+        M = it.Model.convert_to_M(it.m)
+    return it.Model.F(M)
+
+
+def get_forward_rows(it):
+    """Return the forward response of the iteration with one row per spectrum
+    (the first half of each row contains the first part of the data format,
+    the second half the second part).
+    """
+    f_data = get_forward_response(it)
+    # we know that the first two dimensions belong to frequencies,
+    # re/im
+    base_dim = f_data.shape[0] * f_data.shape[1]
+    if len(f_data.shape) == 3:
+        extra_dim = f_data.shape[2]
+    else:
+        extra_dim = 1
+    return f_data.T.reshape(extra_dim, base_dim)
+
+
+def format_array(values, fmt):
+    """Return the 2D array values as text in the format of np.savetxt. The
+    whole array is formatted at once, so it can be written in one call.
+    """
+    values = np.atleast_2d(values)
+    if values.size == 0:
+        return ''
+    row_fmt = ' '.join([fmt] * values.shape[1]) + '\n'
+    return (row_fmt * values.shape[0]) % tuple(values.ravel())
+
 
-def save_f(fid, final_iterations, norm_factors):
+def save_f(fid, final_iterations, norm_factors, fmt='%.18e'):
     """write model response directly in a file handler
 
     Also save forward response format to f_format.dat
     """
     for index, itd in enumerate(final_iterations):
-        M = itd[0].Model.convert_to_M(itd[0].m)
-        f_data = itd[0].Model.F(M)
-        # we know that the first two dimensions belong to frequencies,
-        # re/im
-        base_dim = f_data.shape[0] * f_data.shape[1]
-
-        if len(f_data.shape) == 3:
-            extra_dim = f_data.shape[2]
-        else:
-            extra_dim = 1
-        f_data = f_data.T
-
-        # import pdb
-        # pdb.set_trace()
-        f_data = f_data.reshape(extra_dim, base_dim)
+        f_data = get_forward_rows(itd[0])
         if norm_factors is not None:
-            print('normalising')
-            f_data /= norm_factors[index]
-        np.savetxt(fid, f_data)
+            f_data = f_data / norm_factors[index]
+        np.savetxt(fid, f_data, fmt=fmt)
 
     open('f_format.dat', 'w').write(itd[0].Data.obj.data_format)
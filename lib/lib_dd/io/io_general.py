@@ -1,5 +1,6 @@
 import lib_dd.io.ascii as ascii
 import lib_dd.io.ascii_audit as ascii_audit
+import lib_dd.profiling as profiling
 
 
 def _make_list(obj):
@@ -11,7 +12,7 @@ def _make_list(obj):
         return obj
 
 
-def save_fit_results(data, NDobj):
+def save_fit_results(data, NDobj, profiler=None):
     """
     Save results of all DD fits to files
 
@@ -20,13 +21,19 @@ def save_fit_results(data, NDobj):
     data:
     NDobj: one or more ND objects. This is either a ND object, or list of ND
            objects
+    profiler: lib_dd.profiling.profiler object which records the duration of
+              the writer as the stage write_<output_format> (may be None)
     """
     NDlist = _make_list(NDobj)
     output_format = data['options']['output_format']
-    if output_format == 'ascii':
-        ascii.save_data(data, NDlist)
-    elif output_format == 'ascii_audit':
-        ascii_audit.save_results(data, NDlist)
-    else:
-        raise Exception('Output format "{0}" not recognized!'.format(
-            output_format))
+    if profiler is None:
+        profiler = profiling.profiler(enabled=False)
+    with profiler.stage('write_' + output_format):
+        if output_format == 'ascii':
+            ascii.save_data(data, NDlist)
+        elif output_format == 'ascii_audit':
+            ascii_audit.save_results(
+                data, NDlist, data.get('result_collector', None))
+        else:
+            raise Exception('Output format "{0}" not recognized!'.format(
+                output_format))
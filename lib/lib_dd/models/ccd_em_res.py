@@ -3,8 +3,6 @@ high-frequency EM Cole-Cole term
 """
 import numpy as np
 
-import NDimInv.plot_helper
-plt, mpl = NDimInv.plot_helper.setup()
 import NDimInv.model_template as mt
 import lib_dd.base_class as base_class
 import lib_dd.starting_parameters as starting_parameters
@@ -18,9 +18,9 @@ import os
 import numpy as np
 import logging
 
-import NDimInv.plot_helper
-plt, mpl = NDimInv.plot_helper.setup()
+import lib_dd.plot_helper
 import sip_formats.convert as sip_convert
+import lib_dd.io.helper as io_helper
 
 
 class plot_iteration():
@@ -30,6 +30,16 @@ class plot_iteration():
 
     In addition, it will renormalise data if necessary.
     """
+    # (key, color, linestyle, label) of the relaxation time markers
+    markers = (
+        ('peak1', 'k', 'dashed', r'$\tau_{peak}^1$'),
+        ('peak2', 'k', 'dashed', r'$\tau_{peak}^2$'),
+        ('50', 'g', 'solid', r'$\tau_{50}$'),
+        ('mean', 'c', 'solid', r'$\tau_{mean}$'),
+    )
+    # add hidden markers for NaN values (see _add_markers)
+    keep_nan_markers = False
+
     def plot(self, it, norm_factors=None):
         try:
             if norm_factors is None:
@@ -43,6 +53,7 @@ class plot_iteration():
         return self.fig
 
     def create_figure(self):
+        plt, mpl = lib_dd.plot_helper.setup()
         space_top = 1.2
         size_x = 14
         size_y = 2 * self.nr_spectra + space_top
@@ -60,7 +71,7 @@ class plot_iteration():
     def finalize_fig(self):
         ax = self.axes[0, 0]
         title = 'Cole-Cole decomposition, iteration {0}'.format(self.it.nr)
-        ax.annotate(
+        self.title_annotation = ax.annotate(
             title,
             xy=(0.0, 1.00),
             xytext=(15, -30),
@@ -92,27 +103,65 @@ class plot_iteration():
 
         D = it.Data.D / self.norm_factors
         M = it.Model.convert_to_M(it.m)
-        # renormalize here? why do we compuate the forward solution again?
-        F = it.Model.F(M) / self.norm_factors
+        F = io_helper.get_forward_response(it, M) / self.norm_factors
         extra_size = int(
             np.sum([x[1][1] for x in it.Data.extra_dims.items()]))
         self.nr_spectra = max(1, extra_size)
 
         fig, axes = self.create_figure()
 
+        # artists that are updated by plot_iteration_fast:
+        # list of (line, representation, column, sign, use_fit)
+        self.lines = []
+        self.marker_lines = []
+        self.tau_marker_lines = []
+        self.rtd_lines = []
+        self.rtd_titles = []
+
         # iterate over spectra
         for nr, (d, m) in enumerate(it.Model.DM_iterator()):
-            self._plot_rre_rim(nr, axes[nr, 0:2], D[d], F[d], it)
-            self._plot_rmag_rpha(nr, axes[nr, 2:4], D[d], F[d], it)
+            curves = self._get_curves(it, D[d], F[d])
+            self._plot_rre_rim(nr, axes[nr, 0:2], curves, it)
+            self._plot_rmag_rpha(nr, axes[nr, 2:4], curves, it)
             self._plot_rtd(nr, axes[nr, 4], M[m], it)
             ax1 = axes[nr, 0].twinx()
             ax2 = axes[nr, 1].twinx()
-            self._plot_cre_cim(nr, [ax1, ax2], D[d], F[d], it)
+            self._plot_cre_cim(nr, [ax1, ax2], curves, it)
 
         self.finalize_fig()
 
+    def _get_curves(self, it, orig_data, fit_data):
+        """Return the data and fit curves of the three plotted
+        representations of one spectrum
+        """
+        curves = {}
+        for key in ('rre_rim', 'rmag_rpha', 'cre_cim'):
+            curves[key] = (
+                sip_convert.convert(it.Data.obj.data_format, key, orig_data),
+                sip_convert.convert(it.Data.obj.data_format, key, fit_data),
+            )
+        return curves
+
+    def _plot_curves(self, ax, it, curves, key, column, sign, color,
+                     labels=(None, None)):
+        """Plot the data and fit curves of one column of the representation
+        key, and register the lines in self.lines
+        """
+        plt, mpl = lib_dd.plot_helper.setup()
+        frequencies = it.Data.obj.frequencies
+        orig, fit = curves[key]
+        line_d, = ax.semilogx(frequencies, sign * orig[:, column], '.',
+                              color=color, label=labels[0])
+        line_f, = ax.semilogx(frequencies, sign * fit[:, column], '-',
+                              color=color, label=labels[1])
+        self.lines.append((line_d, key, column, sign, False))
+        self.lines.append((line_f, key, column, sign, True))
+        ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=4))
+
     def _plot_rtd(self, nr, ax, m, it):
-        ax.semilogx(it.Data.obj.tau, m[1:], '.-', color='k')
+        plt, mpl = lib_dd.plot_helper.setup()
+        line, = ax.semilogx(it.Data.obj.tau, m[1:], '.-', color='k')
+        self.rtd_lines.append(line)
         ax.set_xlim(it.Data.obj.tau.min(), it.Data.obj.tau.max())
         ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=5))
         ax.yaxis.set_major_locator(mpl.ticker.MaxNLocator(5))
@@ -133,7 +182,9 @@ class plot_iteration():
 
         ax.set_xlabel(r'$\tau~[s]$')
         ax.set_ylabel(r'$log_{10}(m)$')
+        self.rtd_titles.append(ax.set_title(self._get_lambda_title(it)))
 
+    def _get_lambda_title(self, it):
         title_string = r'$\lambda:$ '
         for lam in it.lams:
             if(type(lam) == list):
@@ -145,89 +196,47 @@ class plot_iteration():
                 # individual lambdas
                 # title_string += '{0} '.format(
                 #     lam[m_indices[nr], m_indices[nr]])
-        ax.set_title(title_string)
-
-    def _plot_rmag_rpha(self, nr, axes, orig_data, fit_data, it):
-        rmag_rpha_orig = sip_convert.convert(
-            it.Data.obj.data_format,
-            'rmag_rpha',
-            orig_data
-        )
-
-        rmag_rpha_fit = sip_convert.convert(
-            it.Data.obj.data_format,
-            'rmag_rpha',
-            fit_data
-        )
-
-        frequencies = it.Data.obj.frequencies
+        return title_string
 
+    def _plot_rmag_rpha(self, nr, axes, curves, it):
+        plt, mpl = lib_dd.plot_helper.setup()
         ax = axes[0]
-        ax.semilogx(frequencies, rmag_rpha_orig[:, 0], '.', color='k')
-        ax.semilogx(frequencies, rmag_rpha_fit[:, 0], '-', color='k')
+        self._plot_curves(ax, it, curves, 'rmag_rpha', 0, 1, 'k')
         ax.set_xlabel('frequency [Hz]')
         ax.set_ylabel(r'$|\rho|~[\Omega m]$')
-        ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=4))
         ax.yaxis.set_major_locator(mpl.ticker.MaxNLocator(5))
 
         ax = axes[1]
-        ax.semilogx(frequencies, -rmag_rpha_orig[:, 1], '.', color='k')
-        ax.semilogx(frequencies, -rmag_rpha_fit[:, 1], '-', color='k')
+        self._plot_curves(ax, it, curves, 'rmag_rpha', 1, -1, 'k')
         ax.set_xlabel('frequency [Hz]')
         ax.set_ylabel(r'$-\phi~[mrad]$')
-        ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=4))
         ax.yaxis.set_major_locator(mpl.ticker.MaxNLocator(5))
         self._mark_tau_parameters_f(nr, ax, it)
 
-    def _plot_cre_cim(self, nr, axes, orig_data, fit_data, it):
-        cre_cim_orig = sip_convert.convert(it.Data.obj.data_format,
-                                           'cre_cim',
-                                           orig_data)
-
-        cre_cim_fit = sip_convert.convert(it.Data.obj.data_format,
-                                          'cre_cim',
-                                          fit_data)
-        frequencies = it.Data.obj.frequencies
+    def _plot_cre_cim(self, nr, axes, curves, it):
         ax = axes[0]
-        ax.semilogx(frequencies, cre_cim_orig[:, 0], '.', color='gray')
-        ax.semilogx(frequencies, cre_cim_fit[:, 0], '-', color='gray')
+        self._plot_curves(ax, it, curves, 'cre_cim', 0, 1, 'gray')
         # ax.set_xlabel('frequency [Hz]')
         ax.set_ylabel(r"$-\sigma'~[S/m]$", color='gray')
-        ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=4))
 
         ax = axes[1]
-        ax.semilogx(frequencies, cre_cim_orig[:, 1], '.', color='gray',
-                    label='data')
-        ax.semilogx(frequencies, cre_cim_fit[:, 1], '-', color='gray',
-                    label='fit')
+        self._plot_curves(ax, it, curves, 'cre_cim', 1, 1, 'gray',
+                          ('data', 'fit'))
         # ax.set_xlabel('frequency [Hz]')
         ax.set_ylabel(r"$-\sigma''~[S/m]$", color='gray')
-        ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=4))
 
-    def _plot_rre_rim(self, nr, axes, orig_data, fit_data, it):
-        rre_rim_orig = sip_convert.convert(it.Data.obj.data_format,
-                                           'rre_rim',
-                                           orig_data)
-
-        rre_rim_fit = sip_convert.convert(it.Data.obj.data_format,
-                                          'rre_rim',
-                                          fit_data)
-        frequencies = it.Data.obj.frequencies
+    def _plot_rre_rim(self, nr, axes, curves, it):
+        plt, mpl = lib_dd.plot_helper.setup()
         ax = axes[0]
-        ax.semilogx(frequencies, rre_rim_orig[:, 0], '.', color='k')
-        ax.semilogx(frequencies, rre_rim_fit[:, 0], '-', color='k')
+        self._plot_curves(ax, it, curves, 'rre_rim', 0, 1, 'k')
         ax.set_xlabel('frequency [Hz]')
         ax.set_ylabel(r"$-\rho'~[\Omega m]$")
-        ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=4))
 
         ax = axes[1]
-        ax.semilogx(frequencies, -rre_rim_orig[:, 1], '.', color='k',
-                    label='data')
-        ax.semilogx(frequencies, -rre_rim_fit[:, 1], '-', color='k',
-                    label='fit')
+        self._plot_curves(ax, it, curves, 'rre_rim', 1, -1, 'k',
+                          ('data', 'fit'))
         ax.set_xlabel('frequency [Hz]')
         ax.set_ylabel(r"$-\rho''~[\Omega m]$")
-        ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=4))
 
         self._mark_tau_parameters_f(nr, ax, it)
 
@@ -240,52 +249,166 @@ class plot_iteration():
             ltext = leg.get_texts()
             plt.setp(ltext, fontsize='6')
 
-    def _mark_tau_parameters_tau(self, nr, ax, it):
-        # mark relaxation time parameters
-        # mark tau_peak
-        for index in range(1, 3):
+    def _get_marker_positions(self, it, nr):
+        """Return the frequencies and relaxation times of the markers of the
+        relaxation time parameters (NaN if not available)
+        """
+        f_values = []
+        tau_values = []
+        for key, color, linestyle, label in self.markers:
             try:
-                tpeak = it.stat_pars['tau_peak{0}'.format(index)][nr]
-                if(not np.isnan(tpeak)):
-                    ax.axvline(x=10**tpeak, color='k', label=r'$\tau_{peak}^' +
-                               '{0}'.format(index) + '$',
-                               linestyle='dashed')
-            except:
-                pass
-
-        try:
-            ax.axvline(x=10**it.stat_pars['tau_50'][nr], color='g',
-                       label=r'$\tau_{50}$')
-        except:
-            pass
+                f_values.append(it.stat_pars['f_' + key][nr])
+                tau_values.append(10 ** it.stat_pars['tau_' + key][nr])
+            except Exception:
+                f_values.append(np.nan)
+                tau_values.append(np.nan)
+        return f_values, tau_values
+
+    def _add_markers(self, ax, positions):
+        """Mark the relaxation time parameters at the given positions.
+        Markers with NaN positions are skipped, or, if self.keep_nan_markers
+        is True, added as hidden lines
+
+        Returns
+        -------
+        lines : list of the added lines
+        """
+        lines = []
+        for x, (key, color, linestyle, label) in zip(positions, self.markers):
+            if np.isnan(x):
+                if not self.keep_nan_markers:
+                    continue
+                # hidden until _set_markers is called with a valid position
+                line = ax.axvline(x=1.0, color=color, linestyle=linestyle,
+                                  label=label)
+                line.set_visible(False)
+            else:
+                line = ax.axvline(x=x, color=color, linestyle=linestyle,
+                                  label=label)
+            lines.append(line)
+        return lines
+
+    def _set_markers(self, lines, positions):
+        for line, x in zip(lines, positions):
+            if np.isnan(x):
+                line.set_visible(False)
+            else:
+                line.set_xdata([x, x])
+                line.set_visible(True)
 
-        try:
-            ax.axvline(x=10**it.stat_pars['tau_mean'][nr], color='c',
-                       label=r'$\tau_{mean}$')
-        except:
-            pass
+    def _mark_tau_parameters_tau(self, nr, ax, it):
+        f_values, tau_values = self._get_marker_positions(it, nr)
+        self.tau_marker_lines += self._add_markers(ax, tau_values)
 
     def _mark_tau_parameters_f(self, nr, ax, it):
-        # mark relaxation time parameters
-        # mark tau_peak
-        for index in range(1, 3):
-            try:
-                fpeak = it.stat_pars['f_peak{0}'.format(index)][nr]
-                if(not np.isnan(fpeak)):
-                    ax.axvline(x=fpeak, color='k', label=r'$\tau_{peak}^' +
-                               '{0}'.format(index) + '$',
-                               linestyle='dashed')
-            except:
-                pass
+        f_values, tau_values = self._get_marker_positions(it, nr)
+        self.marker_lines += self._add_markers(ax, f_values)
 
-        try:
-            ax.axvline(x=it.stat_pars['f_50'][nr], color='g',
-                       label=r'$\tau_{50}$')
-        except:
-            pass
 
-        try:
-            ax.axvline(x=it.stat_pars['f_mean'][nr], color='c',
-                       label=r'$\tau_{mean}$')
-        except:
-            pass
+class plot_iteration_fast(plot_iteration):
+    """Fast plot path for the final iterations of many single spectra.
+
+    The figure is created by plot_iteration for the first spectrum and then
+    kept. For each further spectrum only the line data, the markers of the
+    relaxation time parameters and the titles are updated before the figure
+    is rendered again. The figure is recreated if the frequencies or
+    relaxation times change (e.g. if NaN values were cropped).
+
+    Marker lines of parameters that are NaN for a given spectrum are hidden,
+    but remain in the legend.
+
+    Parameters
+    ----------
+    dpi : resolution of the output files
+    fmt : format (and file ending) of the output files, e.g. 'jpg' or 'png'
+    """
+    keep_nan_markers = True
+
+    def __init__(self, dpi=300, fmt='jpg'):
+        self.dpi = dpi
+        self.fmt = fmt
+        self.fig = None
+        self.grid = None
+
+    def plot(self, it, norm_factors=None):
+        if norm_factors is None:
+            self.norm_factors = 1.0
+        else:
+            self.norm_factors = norm_factors
+
+        if not self._grid_matches(it):
+            self.close()
+            self._plot(it)
+            self.grid = (it.Data.obj.frequencies.copy(),
+                         it.Model.obj.tau.copy())
+        else:
+            self._update(it)
+        return self.fig
+
+    def plot_to_file(self, it, filename, norm_factors=None):
+        """Plot the iteration and save it using the same file name as
+        NDimInv.main.Iteration.plot, with the file ending self.fmt
+        """
+        fig = self.plot(it, norm_factors)
+        output_filename = 'plot_'
+        if('global_prefix' in it.Model.obj.settings):
+            output_filename += it.Model.obj.settings['global_prefix']
+        output_filename += filename + '{0:04}.{1}'.format(it.nr, self.fmt)
+        fig.savefig(output_filename, dpi=self.dpi)
+
+    def close(self):
+        if self.fig is not None:
+            plt, mpl = lib_dd.plot_helper.setup()
+            plt.close(self.fig)
+        self.fig = None
+        self.grid = None
+
+    def _grid_matches(self, it):
+        if self.fig is None or len(it.Data.extra_dims) > 0:
+            return False
+        frequencies, tau = self.grid
+        return (np.array_equal(frequencies, it.Data.obj.frequencies) and
+                np.array_equal(tau, it.Model.obj.tau))
+
+    def _update(self, it):
+        self.it = it
+        D = it.Data.D / self.norm_factors
+        M = it.Model.convert_to_M(it.m)
+        F = io_helper.get_forward_response(it, M) / self.norm_factors
+        # there is only one spectrum (see _grid_matches)
+        d, m = next(iter(it.Model.DM_iterator()))
+
+        curves = self._get_curves(it, D[d], F[d])
+        for line, key, column, sign, use_fit in self.lines:
+            line.set_ydata(sign * curves[key][int(use_fit)][:, column])
+        self.rtd_lines[0].set_ydata(M[m][1:])
+
+        f_markers, tau_markers = self._get_marker_positions(it, 0)
+        nr_markers = len(self.markers)
+        self._set_markers(self.marker_lines[:nr_markers], f_markers)
+        self._set_markers(self.marker_lines[nr_markers:], f_markers)
+        self._set_markers(self.tau_marker_lines, tau_markers)
+
+        self.rtd_titles[0].set_text(self._get_lambda_title(it))
+        self.title_annotation.set_text(
+            'Cole-Cole decomposition, iteration {0}'.format(it.nr))
+
+        for ax in self.fig.get_axes():
+            ax.relim(visible_only=True)
+            # the relaxation time axis keeps its fixed limits
+            ax.autoscale_view(scalex=(ax is not self.axes[0, 4]))
+
+
+# fast plot objects of this process, see get_fast_plotter
+_fast_plotters = {}
+
+
+def get_fast_plotter(dpi=300, fmt='jpg'):
+    """Return the plot_iteration_fast object of this process for the given
+    output settings. The object (and its figure) is reused for all spectra
+    plotted by this process.
+    """
+    key = (dpi, fmt)
+    if key not in _fast_plotters:
+        _fast_plotters[key] = plot_iteration_fast(dpi, fmt)
+    return _fast_plotters[key]
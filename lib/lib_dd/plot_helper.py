@@ -0,0 +1,35 @@
+""" Deferred import of matplotlib
+
+Importing matplotlib and setting up the backend is expensive and not required
+for fits without plots. Therefore the lib_dd modules do not import matplotlib
+on module load, but call setup() from within the plot functions:
+
+import lib_dd.plot_helper
+plt, mpl = lib_dd.plot_helper.setup()
+"""
+_modules = {}
+
+
+def setup():
+    """Import matplotlib using NDimInv.plot_helper.setup() on the first call,
+    and return the cached modules on all subsequent calls.
+
+    Returns
+    -------
+    plt: pylab
+        imported pylab module
+    mpl: matplotlib module
+        imported matplotlib module
+    """
+    if not _modules:
+        import NDimInv.plot_helper
+        plt, mpl = NDimInv.plot_helper.setup()
+        _modules['plt'] = plt
+        _modules['mpl'] = mpl
+    return _modules['plt'], _modules['mpl']
+
+
+def is_loaded():
+    """Return True if matplotlib was already set up by setup()
+    """
+    return bool(_modules)
@@ -1,7 +1,6 @@
 import numpy as np
 
-import NDimInv.plot_helper
-plt, mpl = NDimInv.plot_helper.setup()
+import lib_dd.plot_helper
 
 
 class _plot_stats(object):
@@ -13,6 +12,7 @@ class _plot_stats(object):
         self._plot_coverages(prefix)
 
     def _plot_coverages(self, prefix):
+        plt, mpl = lib_dd.plot_helper.setup()
         f = self.frequencies
         fig, axes = plt.subplots(2, 2, figsize=(5, 4))
         # plot data/fig
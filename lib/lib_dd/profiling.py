@@ -0,0 +1,167 @@
+"""
+Opt-in timing of the stages of the fit pipeline.
+
+Profiling is activated using the --profile option of ccd_single and
+ccd_time, or by setting the environment variable CCD_PROFILE=1. The durations
+of the following stages are recorded:
+
+    load : loading of frequencies and data
+    get_fit_datas : preparation of the fit dicts of the individual spectra
+    fit : fit of all spectra (wall time of the parent process)
+    plotting : post-fit plots of all spectra
+    write_<format> : output writer (e.g. write_ascii)
+
+and for each spectrum (in the fit workers):
+
+    model_construction : setup of the inversion object
+    starting_model : model object and starting model estimation
+    triage : screening of the spectrum (--triage)
+    coarse_grid : coarse grid fit (--multigrid_nd)
+    iteration : Gauss-Newton iterations
+    lambda_search : lambda search of each iteration
+    steplength : step length search of each iteration
+    compute_par_stats : integrated parameters of the final iteration
+
+Note that stages can be nested: the lambda search and the step length search
+are part of the iterations, and the lambda search itself computes step
+lengths. The batch solver fits all spectra of a batch at once; its iteration
+times are distributed equally among the spectra of the batch. ccd_time fits
+all time steps in one inversion, which is recorded as one spectrum.
+
+The spectrum stages are stored in the attribute profiler of the returned ND
+objects. profile.json (written to the output directory) contains the totals
+of all stages and, for the spectrum stages, histograms of the time per
+spectrum.
+"""
+import os
+import json
+import time
+import contextlib
+
+import numpy as np
+
+
+profile_filename = 'profile.json'
+
+
+def is_enabled(flag=False):
+    """Return True if profiling was requested using the flag (e.g. the
+    profile option) or the environment variable CCD_PROFILE
+    """
+    return bool(flag) or os.environ.get('CCD_PROFILE', '0') == '1'
+
+
+class profiler(object):
+    """Record the durations of named stages. A disabled profiler does not
+    record anything.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        # stage -> list of durations [s]
+        self.times = {}
+        self._instrumented = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Context manager that records the duration of its block as the
+        stage name
+        """
+        if not self.enabled:
+            yield
+            return
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - start_time)
+
+    def add(self, name, duration):
+        if self.enabled:
+            self.times.setdefault(name, []).append(duration)
+
+    def instrument(self, obj, method, name):
+        """Record all calls of obj.method as the stage name, until release()
+        is called
+        """
+        if not self.enabled:
+            return
+        func = getattr(obj, method)
+
+        def timed_func(*args, **kwargs):
+            with self.stage(name):
+                return func(*args, **kwargs)
+        setattr(obj, method, timed_func)
+        self._instrumented.append((obj, method))
+
+    def release(self):
+        """Remove all instrumentation. This is required before the
+        instrumented objects are pickled (e.g. returned by a worker process)
+        """
+        for obj, method in self._instrumented:
+            delattr(obj, method)
+        self._instrumented = []
+
+    def totals(self):
+        """Return the total duration of each stage
+        """
+        return {key: float(np.sum(item)) for key, item in self.times.items()}
+
+
+def _stage_summary(values):
+    values = np.atleast_1d(values)
+    return {
+        'total': float(np.sum(values)),
+        'count': int(values.size),
+        'mean': float(np.mean(values)),
+        'max': float(np.max(values)),
+    }
+
+
+def summarize(run_profiler, NDlist, nr_bins=10):
+    """Aggregate the run-level profiler and the per-spectrum profilers of the
+    ND objects
+
+    Returns
+    -------
+    summary : dict with the keys
+              stages : total, count, mean and max duration of each stage
+                       (count is the number of timed calls)
+              spectra : for each spectrum stage, the histogram (counts and
+                        bin edges) and the median of the per-spectrum times
+    """
+    times = {}
+    for key, item in run_profiler.times.items():
+        times[key] = list(item)
+    per_spectrum = {}
+    for ND in NDlist:
+        spectrum_profiler = getattr(ND, 'profiler', None)
+        if spectrum_profiler is None:
+            continue
+        for key, item in spectrum_profiler.times.items():
+            times.setdefault(key, []).extend(item)
+            per_spectrum.setdefault(key, []).append(np.sum(item))
+
+    summary = {
+        'nr_spectra': len(NDlist),
+        'stages': {key: _stage_summary(item) for key, item in times.items()},
+        'spectra': {},
+    }
+    for key, item in per_spectrum.items():
+        counts, edges = np.histogram(item, bins=nr_bins)
+        summary['spectra'][key] = {
+            'nr_spectra': len(item),
+            'median': float(np.median(item)),
+            'counts': counts.tolist(),
+            'bin_edges': edges.tolist(),
+        }
+    return summary
+
+
+def save_profile(directory, run_profiler, NDlist):
+    """Write the profile summary (see summarize) to profile.json in the
+    directory
+    """
+    summary = summarize(run_profiler, NDlist)
+    with open(directory + os.sep + profile_filename, 'w') as fid:
+        json.dump(summary, fid, indent=4, sort_keys=True)
+    return summary
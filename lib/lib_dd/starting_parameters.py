@@ -3,12 +3,23 @@ import os
 import numpy as np
 
 import lib_dd.base_class as base_class
+import lib_dd.plot_helper
 
 
 class starting_parameters(object):
 
+    def get_data_mask(self):
+        """Return the valid frequencies of the spectrum (see the nan_handling
+        option). Missing data points are not used for the starting model.
+        """
+        mask = self.settings.get('nan_mask', None)
+        if mask is None:
+            return slice(None)
+        return mask
+
     def estimate_starting_parameters_3(self, re, mim):
-        estimator = base_class.starting_pars_3(re, mim, self.frequencies, self.tau)
+        frequencies = self.frequencies[self.get_data_mask()]
+        estimator = base_class.starting_pars_3(re, mim, frequencies, self.tau)
         parameters = estimator.estimate(self)
         return parameters
 
@@ -24,7 +35,7 @@ class starting_parameters(object):
         # start playing with gaussians distributions
         pol_maximum = np.argmax(mim)
 
-        f_max = self.frequencies[pol_maximum]
+        f_max = self.frequencies[self.get_data_mask()][pol_maximum]
         tau_max = 1 / (2 * np.pi * f_max)
         s_max = np.log10(tau_max)
 
@@ -44,6 +55,8 @@ class starting_parameters(object):
         """
         parameters = np.zeros((self.s.shape[0] + 1))
         pars = np.zeros(parameters.shape)
+        mask = self.get_data_mask()
+        frequencies = self.frequencies[mask]
 
         # rho0
         parameters[0] = np.sqrt(re[0] ** 2 + mim[0] ** 2)
@@ -57,7 +70,7 @@ class starting_parameters(object):
             pars[0] = parameters[0]
             pars[1:] = i
             pars = self.convert_parameters(pars)
-            tre_tmim = self.forward(pars)
+            tre_tmim = self.forward(pars)[mask]
             tre = tre_tmim[:, 0]
             tmim = tre_tmim[:, 1]
 
@@ -68,17 +81,18 @@ class starting_parameters(object):
             if('DD_DEBUG_STARTING_PARS' in os.environ and
                os.environ['DD_DEBUG_STARTING_PARS'] == '1'):
                 # enable debug plots
+                plt, mpl = lib_dd.plot_helper.setup()
                 fig, axes = plt.subplots(2, 1, figsize=(5, 4))
                 fig.suptitle('test m: {0} - diff\_im: {1}'.format(
                     i, diff_im))
                 ax = axes[0]
-                ax.semilogx(self.frequencies, re, '.-', color='k')
-                ax.semilogx(self.frequencies, tre, '.-', color='gray')
+                ax.semilogx(frequencies, re, '.-', color='k')
+                ax.semilogx(frequencies, tre, '.-', color='gray')
                 ax.set_ylabel(r'part1')
                 ax.set_xlabel('f (Hz)')
                 ax = axes[1]
-                ax.semilogx(self.frequencies, mim, '.-', color='k')
-                ax.semilogx(self.frequencies, tmim, '.-', color='gray')
+                ax.semilogx(frequencies, mim, '.-', color='k')
+                ax.semilogx(frequencies, tmim, '.-', color='gray')
                 ax.set_ylabel(r'part2')
                 ax.set_xlabel('f (Hz)')
                 filename = 'starting_model_{0}.png'.format(nr)
@@ -90,8 +104,9 @@ class starting_parameters(object):
         return parameters
 
     def estimate_starting_parameters(self, spectrum):
-        re = spectrum[:, 0]
-        mim = spectrum[:, 1]
+        mask = self.get_data_mask()
+        re = spectrum[mask, 0]
+        mim = spectrum[mask, 1]
 
         # the starting model can be set via the environment variable
         starting_model = int(os.environ.get('DD_STARTING_MODEL', 3))
@@ -50,3 +50,32 @@ class test_int_pars_mtot():
 
         m_tot_n_log10 = int_pars.m_tot_n(self.pars, self.tau, self.s)
         assert_almost_equal(m_tot_n_log10, np.log10(self.m_tot_n_original))
+
+
+class test_int_pars_peaks():
+
+    def setup(self):
+        self.s = np.linspace(-4, 2, 50)
+        # two peaks per distribution
+        self.m_i = np.vstack((
+            np.exp(-(self.s + 3) ** 2) + 2 * np.exp(-(self.s - 1) ** 2),
+            np.exp(-(self.s + 1) ** 2 / 0.1) +
+            0.5 * np.exp(-self.s ** 2 / 0.1),
+        ))
+
+    def test_peaks_array(self):
+        s_peaks, f_peaks = int_pars._get_peaks_array(self.m_i, self.s, 3)
+        assert_equal(s_peaks.shape, (2, 3))
+        for nr in range(0, 2):
+            s_ref = int_pars._get_peaks(np.hstack((1, self.m_i[nr])),
+                                        self.s)[0]
+            assert_true(np.all(s_peaks[nr, 0:2] == s_ref))
+        assert_true(np.all(np.isnan(s_peaks[:, 2])))
+        assert_true(np.allclose(f_peaks[:, 0],
+                                1 / (2 * np.pi * 10 ** s_peaks[:, 0])))
+
+    def test_peaks_sorted_by_m(self):
+        s_peaks, _ = int_pars._get_peaks_array(
+            self.m_i, self.s, 1, sort_by_m=True)
+        assert_true(s_peaks[0, 0] > 0)
+        assert_true(s_peaks[1, 0] < -0.5)
@@ -0,0 +1,69 @@
+#!/usr/bin/python
+"""
+Test the ascii_audit output of fits with cropped spectra (NaN values)
+"""
+import os
+import shutil
+import tempfile
+import numpy as np
+from nose.tools import *
+import lib_dd.config.cfg_single as cfg_single
+import lib_dd.decomposition.ccd_single as ccd_single
+import lib_dd.io.io_general as iog
+import lib_dd.io.ascii_audit as ascii_audit
+
+
+class test_ascii_audit():
+
+    def setup(self):
+        self.frequencies = np.logspace(-2, 3, 20)
+        omega = 2 * np.pi * self.frequencies
+        spectra = []
+        for rho0, m, tau in ((100, 0.1, 0.01), (50, 0.05, 0.1),
+                             (80, 0.08, 1), (120, 0.02, 0.001)):
+            Z = rho0 * (1 - m * (1 - 1 / (1 + 1j * omega * tau)))
+            spectra.append(np.hstack((np.abs(Z), np.angle(Z) * 1000)))
+        self.data = np.array(spectra)
+        # the second spectrum is fitted without the fifth frequency
+        self.data[1, [4, 24]] = np.nan
+        self.outdir = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.outdir)
+
+    def _fit(self, nr_cores):
+        config = cfg_single.cfg_single()
+        config['frequency_file'] = self.frequencies
+        config['data_file'] = self.data.copy()
+        config['nr_terms_decade'] = 5
+        config['nr_cores'] = nr_cores
+        config['nan_handling'] = 'crop'
+        obj = ccd_single.ccd_single(config)
+        obj.fit_data()
+        return obj
+
+    def test_collector_refuses_cropped(self):
+        obj = self._fit(1)
+        collector = ascii_audit.result_collector(len(obj.results))
+        collector.add(0, obj.results[0])
+        assert_raises(ValueError, collector.add, 1, obj.results[1])
+
+    def test_cropped_spectra(self):
+        obj = self._fit(2)
+        # the streaming collector refused the cropped spectrum
+        assert_true(obj.data['result_collector'] is None)
+
+        pwd = os.getcwd()
+        os.chdir(self.outdir)
+        try:
+            iog.save_fit_results(obj.data, obj.results)
+        finally:
+            os.chdir(pwd)
+
+        f = np.loadtxt(self.outdir + os.sep + 'f.dat')
+        assert_equal(f.shape, self.data.shape)
+        # NaN values only at the cropped frequency
+        assert_equal(np.where(np.isnan(f))[0].tolist(), [1, 1])
+        assert_equal(np.where(np.isnan(f))[1].tolist(), [4, 24])
+        for filename in ('m_i.dat', 'integrated_parameters.dat'):
+            assert_true(os.path.isfile(self.outdir + os.sep + filename))
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+"""
+Compare the batch solver to the default NDimInv solver and the data-space
+update to the model-space update. Check the float32 precision mode.
+"""
+import numpy as np
+from nose.tools import *
+import lib_dd.config.cfg_single as cfg_single
+import lib_dd.decomposition.ccd_single as ccd_single
+import lib_dd.decomposition.ccd_batch as ccd_batch
+import lib_dd.decomposition.precision_check as precision_check
+
+
+class test_ccd_batch():
+
+    def setup(self):
+        self.frequencies = np.logspace(-2, 3, 20)
+        omega = 2 * np.pi * self.frequencies
+        spectra = []
+        for rho0, m, tau in ((100, 0.1, 0.01), (50, 0.05, 0.1), (10, 0.2, 1)):
+            Z = rho0 * (1 - m * (1 - 1 / (1 + 1j * omega * tau)))
+            spectra.append(np.hstack((np.abs(Z), np.angle(Z) * 1000)))
+        self.data = np.array(spectra)
+
+    def _fit(self, solver):
+        config = cfg_single.cfg_single()
+        config['frequency_file'] = self.frequencies
+        config['data_file'] = self.data
+        config['nr_terms_decade'] = 5
+        config['solver'] = solver
+        obj = ccd_single.ccd_single(config)
+        obj.fit_data()
+        return obj.results
+
+    def test_results(self):
+        results = self._fit('ndiminv')
+        results_batch = self._fit('batch')
+        assert_equal(len(results), len(results_batch))
+        for ND, ND_batch in zip(results, results_batch):
+            it = ND.iterations[-1]
+            it_batch = ND_batch.iterations[-1]
+            assert_equal(it.nr, it_batch.nr)
+            assert_equal(ND.stop_reason, ND_batch.stop_reason)
+            assert_true(np.allclose(it.m, it_batch.m, rtol=1e-6, atol=1e-8))
+
+    def test_dataspace_updates(self):
+        K, nr_data, P = 2, 10, 30
+        J = np.random.normal(size=(K, nr_data, P))
+        w2 = np.random.uniform(0.5, 2, size=(K, nr_data))
+        w2[0, 3] = 0
+        diff = np.random.normal(size=(K, nr_data))
+        m = np.random.normal(size=(K, P))
+        lams = np.array(((0.1, 10, 1000), (1, 5, 50)))
+        # first order smoothing, first parameter decoupled
+        Wm = np.zeros((P - 2, P))
+        Wm[:, 1:-1] -= np.eye(P - 2)
+        Wm[:, 2:] += np.eye(P - 2)
+        R = Wm.T.dot(Wm)
+
+        G, N = ccd_batch.get_dataspace_operator(R)
+        assert_equal(N.shape, (P, 2))
+        assert_true(ccd_batch.use_dataspace('auto', P, nr_data, N))
+        updates = ccd_batch.model_updates(J, w2, diff, R, m, lams)
+        updates_ds = ccd_batch.model_updates_dataspace(
+            J, w2, diff, R, G, N, m, lams)
+        assert_true(np.allclose(updates, updates_ds))
+
+    def test_float32(self):
+        results64 = precision_check.fit(
+            self.frequencies, self.data, 'float64', {'nr_terms_decade': 5})
+        results32 = precision_check.fit(
+            self.frequencies, self.data, 'float32', {'nr_terms_decade': 5})
+        deviations = precision_check.compare(results64, results32)
+        for key in precision_check.keys:
+            assert_equal(deviations[key]['nr_nan_mismatch'], 0)
+        assert_true(deviations['m_tot_n']['max_rel'] < 1e-2)
+        assert_true(deviations['tau_50']['max_abs'] < 1e-2)
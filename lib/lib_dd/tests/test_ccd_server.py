@@ -0,0 +1,40 @@
+#!/usr/bin/python
+"""
+Test the payload encoding and the configuration handling of the ccd_server
+"""
+import numpy as np
+from nose.tools import *
+import lib_dd.decomposition.ccd_server as ccd_server
+
+
+class test_ccd_server():
+
+    def setup(self):
+        self.frequencies = np.logspace(-2, 3, 20)
+        self.data = np.random.uniform(1, 100, size=(3, 40))
+
+    def test_job_roundtrip(self):
+        config = {'nr_terms_decade': 10, 'data_format': 'rmag_rpha'}
+        payload = ccd_server.encode_job(self.frequencies, self.data, config)
+        frequencies, data, config_dict = ccd_server.decode_job(payload)
+        assert_true(np.all(frequencies == self.frequencies))
+        assert_true(np.all(data == self.data))
+        assert_equal(config_dict, config)
+
+    def test_results_roundtrip(self):
+        results = {'tau_50': np.ones((3, 1)), 'm_i': np.zeros((3, 20))}
+        decoded = ccd_server.decode_results(
+            ccd_server.encode_results(results))
+        assert_equal(sorted(decoded.keys()), ['m_i', 'tau_50'])
+        assert_equal(decoded['m_i'].shape, (3, 20))
+
+    def test_config(self):
+        server = ccd_server.ccd_server(1)
+        config = server.get_config(
+            self.frequencies, self.data, {'nr_terms_decade': 5})
+        assert_equal(config['nr_terms_decade'], 5)
+        assert_false(config['plot_spectra'])
+        assert_raises(Exception, server.get_config, self.frequencies,
+                      self.data, {'unknown_option': 1})
+        assert_raises(Exception, server.get_config, self.frequencies,
+                      self.data, {'output_dir': 'results'})
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+"""
+Test the adaptive stopping criteria of lib_dd.decomposition.convergence
+"""
+import types
+import numpy as np
+from nose.tools import *
+import NDimInv.main
+import lib_dd.config.cfg_single as cfg_single
+import lib_dd.decomposition.ccd_single as ccd_single
+import lib_dd.decomposition.ccd_single_stateless as decomp_single_sl
+import lib_dd.decomposition.convergence as convergence
+
+
+class test_convergence():
+
+    def setup(self):
+        self.frequencies = np.logspace(-2, 3, 20)
+        omega = 2 * np.pi * self.frequencies
+        spectra = []
+        for rho0, m, tau in ((100, 0.1, 0.01), (50, 0.05, 0.1), (10, 0.2, 1)):
+            Z = rho0 * (1 - m * (1 - 1 / (1 + 1j * omega * tau)))
+            spectra.append(np.hstack((np.abs(Z), np.angle(Z) * 1000)))
+        self.data = np.array(spectra)
+
+    def _get_object(self, **settings):
+        config = cfg_single.cfg_single()
+        config['frequency_file'] = self.frequencies
+        config['data_file'] = self.data
+        config['nr_terms_decade'] = 5
+        for key, value in settings.items():
+            config[key] = value
+        return ccd_single.ccd_single(config)
+
+    def _fit(self, **settings):
+        obj = self._get_object(**settings)
+        obj.fit_data()
+        return obj.results
+
+    def _check_criterion(self, stop_reason, **settings):
+        results_default = self._fit()
+        results = self._fit(**settings)
+        assert_true(stop_reason in convergence.stop_reasons)
+        for ND, ND_default in zip(results, results_default):
+            assert_equal(ND.stop_reason, stop_reason)
+            assert_less(ND.iterations[-1].nr, ND_default.iterations[-1].nr)
+        return results
+
+    def test_rms_rel(self):
+        self._check_criterion('rms_rel', stop_rms_rel=0.1)
+
+    def test_model_rel(self):
+        self._check_criterion('model_rel', stop_model_rel=0.1)
+
+    def test_lambda_failures(self):
+        results = self._check_criterion(
+            'lambda_failures', max_lambda_failures=1)
+        for ND in results:
+            lam_obj = ND.Model.regularizations[0][0][1]
+            assert_true(isinstance(lam_obj, convergence.SearchLambdaCounted))
+            assert_equal(lam_obj.nr_failures, 1)
+
+    def test_default_iterations(self):
+        # without the adaptive criteria, the inversion stops after the same
+        # iteration as the NDimInv inversion
+        results = self._fit()
+        obj = self._get_object()
+        obj.get_data_dd_single()
+        fit_datas = decomp_single_sl._get_fit_datas(obj.data)
+        for ND_adaptive, fit_data in zip(results, fit_datas):
+            ND = decomp_single_sl._prepare_ND_object(fit_data)
+            ND.profiler.release()
+            ND.check_stopping_criteria_before_update = types.MethodType(
+                NDimInv.main.InversionControl
+                .check_stopping_criteria_before_update, ND)
+            NDimInv.main.InversionControl.run_inversion(ND)
+            assert_true(ND_adaptive.stop_reason in convergence.stop_reasons)
+            assert_equal(ND_adaptive.iterations[-1].nr, ND.iterations[-1].nr)
+            assert_true(np.array_equal(
+                ND_adaptive.iterations[-1].m, ND.iterations[-1].m))
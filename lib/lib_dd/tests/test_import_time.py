@@ -0,0 +1,66 @@
+#!/usr/bin/python
+"""
+Benchmark the import of lib_dd.decomposition.ccd_single. lib_dd must not set up
+matplotlib on import, and the import should stay fast.
+
+Some of the external dependencies (NDimInv, sip_models) import matplotlib on
+their own. Therefore the import time is compared to the import time of these
+dependencies, measured on the same machine. The maximum allowed ratio can be
+set using the environment variable DD_MAX_IMPORT_FACTOR (default: 2.5).
+"""
+import os
+import sys
+import time
+import subprocess
+from nose.tools import *
+
+# the external modules imported by lib_dd.decomposition.ccd_single
+_dependencies = (
+    'NDimInv',
+    'NDimInv.reg_pars',
+    'NDimInv.regs',
+    'NDimInv.model_template',
+    'NDimInv.data_weighting',
+    'sip_models.res.cc',
+    'sip_models.cond.cc',
+    'sip_formats.convert',
+)
+
+
+def _run_python(code, repeats=1):
+    """Run code in a fresh interpreter and return the wall time (best of
+    repeats runs)
+    """
+    env = os.environ.copy()
+    lib_dir = os.path.abspath(
+        os.path.dirname(__file__) + os.sep + '..' + os.sep + '..')
+    env['PYTHONPATH'] = os.pathsep.join(
+        [lib_dir, ] + [x for x in [env.get('PYTHONPATH')] if x])
+    times = []
+    for i in range(0, repeats):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', code], env=env)
+        times.append(time.time() - start)
+    return min(times)
+
+
+class test_import_time():
+
+    def test_no_matplotlib_setup(self):
+        code = ';'.join((
+            'import lib_dd.decomposition.ccd_single',
+            'import lib_dd.plot_helper',
+            'assert not lib_dd.plot_helper.is_loaded()',
+        ))
+        _run_python(code)
+
+    def test_import_time(self):
+        max_factor = float(os.environ.get('DD_MAX_IMPORT_FACTOR', 2.5))
+        # the interpreter start up time is not of interest here
+        startup = _run_python('pass', 5)
+        baseline = _run_python('import ' + ', '.join(_dependencies), 5)
+        duration = _run_python('import lib_dd.decomposition.ccd_single', 5)
+        factor = (duration - startup) / (baseline - startup)
+        print('import time: {0:.3f} s ({1:.1f} x dependencies)'.format(
+            duration - startup, factor))
+        assert_less(factor, max_factor)
@@ -0,0 +1,84 @@
+#!/usr/bin/python
+"""
+Test the coarse-to-fine tau grid mode (multigrid_nd) of ccd_single
+"""
+import numpy as np
+from nose.tools import *
+import lib_dd.config.cfg_single as cfg_single
+import lib_dd.decomposition.ccd_single as ccd_single
+import lib_dd.decomposition.ccd_single_stateless as decomp_single_sl
+
+
+class test_multigrid():
+
+    def setup(self):
+        self.frequencies = np.logspace(-2, 3, 20)
+        omega = 2 * np.pi * self.frequencies
+        spectra = []
+        for rho0, m, tau in ((100, 0.1, 0.01), (50, 0.05, 0.1), (10, 0.2, 1)):
+            Z = rho0 * (1 - m * (1 - 1 / (1 + 1j * omega * tau)))
+            spectra.append(np.hstack((np.abs(Z), np.angle(Z) * 1000)))
+        self.data = np.array(spectra)
+
+    def _get_object(self, **settings):
+        config = cfg_single.cfg_single()
+        config['frequency_file'] = self.frequencies
+        config['data_file'] = self.data
+        config['nr_terms_decade'] = 20
+        for key, value in settings.items():
+            config[key] = value
+        return ccd_single.ccd_single(config)
+
+    def _fit(self, **settings):
+        obj = self._get_object(**settings)
+        obj.fit_data()
+        return obj.results
+
+    def test_interpolate_rtd(self):
+        # the coarse grid points are part of the fine grid; the tau grids
+        # are sorted in descending order
+        s_coarse = np.linspace(1, -3, 9)
+        s_fine = np.linspace(1, -3, 41)
+        m_coarse = np.hstack((
+            2, np.log10(0.01 * np.exp(-(s_coarse + 1) ** 2))))
+        m_fine = decomp_single_sl._interpolate_rtd(m_coarse, s_coarse, s_fine)
+        assert_equal(m_fine.shape, (s_fine.size + 1, ))
+        assert_equal(m_fine[0], m_coarse[0])
+        # at the coarse tau values, the chargeabilities are scaled by the
+        # ratio of the grid spacings
+        assert_true(np.allclose(
+            m_fine[1:][::5], m_coarse[1:] + np.log10(0.1 / 0.5)))
+        # the total chargeability is approximately preserved
+        assert_true(np.allclose(
+            np.sum(10 ** m_fine[1:]), np.sum(10 ** m_coarse[1:]), rtol=0.05))
+
+    def test_coarse_grid_fit(self):
+        obj = self._get_object(multigrid_nd=4)
+        obj.get_data_dd_single()
+        fit_data = decomp_single_sl._get_fit_datas(obj.data)[0]
+        ND_fine = decomp_single_sl._prepare_ND_object(fit_data)
+        ND_fine.profiler.release()
+        m0, nr_iterations = decomp_single_sl._fit_coarse_grid(
+            fit_data, ND_fine)
+        # the starting model has the size of the fine grid model
+        assert_equal(m0.shape, ND_fine.Model.m0.shape)
+        assert_equal(m0.size, ND_fine.Model.obj.tau.size + 1)
+        assert_true(np.all(np.isfinite(m0)))
+        assert_greater(nr_iterations, 0)
+
+    def test_warm_start(self):
+        results = self._fit()
+        results_multigrid = self._fit(multigrid_nd=4, multigrid_fine_its=20)
+        for ND, ND_multigrid in zip(results, results_multigrid):
+            assert_greater(ND_multigrid.multigrid_iterations, 0)
+            stat_pars = ND.iterations[-1].stat_pars
+            stat_pars_multigrid = ND_multigrid.iterations[-1].stat_pars
+            for key in ('rho0', 'm_tot_n', 'tau_50'):
+                assert_true(np.allclose(
+                    stat_pars[key], stat_pars_multigrid[key], rtol=1e-2))
+
+    def test_fine_iterations(self):
+        for fine_its in (2, 5):
+            results = self._fit(multigrid_nd=4, multigrid_fine_its=fine_its)
+            for ND in results:
+                assert_less_equal(ND.iterations[-1].nr, fine_its)
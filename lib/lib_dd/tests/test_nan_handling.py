@@ -0,0 +1,92 @@
+#!/usr/bin/python
+"""
+Test the treatment of NaN values using zero data weights
+"""
+import numpy as np
+from nose.tools import *
+import NDimInv.data_weighting as data_weighting
+import lib_dd.config.cfg_single as cfg_single
+import lib_dd.decomposition.ccd_single as ccd_single
+import lib_dd.decomposition.ccd_single_stateless as decomp_single_sl
+
+
+class test_nan_handling():
+
+    def setup(self):
+        self.frequencies = np.logspace(-2, 3, 20)
+        self.spectrum = np.vstack((
+            np.linspace(100, 90, 20),
+            -np.linspace(1, 5, 20),
+        )).T
+        self.spectrum_nan = self.spectrum.copy()
+        self.spectrum_nan[[3, 10], 1] = np.nan
+
+    def test_no_nan_values(self):
+        filled, mask = decomp_single_sl._fill_nan_values(
+            self.frequencies, self.spectrum)
+        assert_true(filled is self.spectrum)
+        assert_true(mask is None)
+
+    def test_fill(self):
+        filled, mask = decomp_single_sl._fill_nan_values(
+            self.frequencies, self.spectrum_nan)
+        assert_equal(filled.shape, self.spectrum.shape)
+        assert_false(np.any(np.isnan(filled)))
+        assert_equal(np.where(~mask)[0].tolist(), [3, 10])
+        assert_true(np.all(filled[mask] == self.spectrum[mask]))
+
+    def test_weights(self):
+        filled, mask = decomp_single_sl._fill_nan_values(
+            self.frequencies, self.spectrum_nan)
+        func = data_weighting.functions['re_vs_im']
+        weighting = decomp_single_sl._masked_data_weighting(func, mask)
+        weights = weighting(filled, settings={})
+        # missing values get zero weights, all other weights correspond to
+        # the weights of the cropped spectrum
+        assert_true(np.all(weights[~mask] == 0))
+        weights_cropped = func(self.spectrum[mask], settings={})
+        assert_true(np.allclose(weights[mask], weights_cropped))
+
+    def _fit(self, data, nan_handling):
+        config = cfg_single.cfg_single()
+        config['frequency_file'] = self.frequencies
+        config['data_file'] = data.copy()
+        config['nr_terms_decade'] = 5
+        config['nan_handling'] = nan_handling
+        obj = ccd_single.ccd_single(config)
+        obj.fit_data()
+        return obj.results
+
+    def _assert_equivalent(self, results_crop, results_weights):
+        for ND_crop, ND_weights in zip(results_crop, results_weights):
+            it_crop = ND_crop.iterations[-1]
+            it_weights = ND_weights.iterations[-1]
+            assert_equal(it_crop.nr, it_weights.nr)
+            assert_equal(it_crop.lams, it_weights.lams)
+            assert_true(np.allclose(it_crop.m, it_weights.m, rtol=1e-6))
+            for key in ('m_tot_n', 'rho0', 'tau_50'):
+                assert_true(np.allclose(
+                    it_crop.stat_pars[key], it_weights.stat_pars[key],
+                    rtol=1e-6))
+
+    def test_compare_modes(self):
+        assert_equal(cfg_single.cfg_single()['nan_handling'], 'weights')
+        omega = 2 * np.pi * self.frequencies
+        spectra = []
+        for rho0, m, tau in ((100, 0.1, 0.01), (50, 0.05, 0.1)):
+            Z = rho0 * (1 - m * (1 - 1 / (1 + 1j * omega * tau)))
+            spectra.append(np.hstack((np.abs(Z), np.angle(Z) * 1000)))
+        data = np.array(spectra)
+
+        # without NaN values both modes are identical
+        self._assert_equivalent(
+            self._fit(data, 'crop'), self._fit(data, 'weights'))
+
+        # with NaN values the masked fit yields the results of the cropped
+        # fit (missing values at the lowest or highest frequency change the
+        # tau range of the cropped fit)
+        data[0, [5, 25]] = np.nan
+        data[1, 12] = np.nan
+        data[1, [16, 36]] = np.nan
+        self._assert_equivalent(
+            self._fit(data, 'crop'), self._fit(data, 'weights'))
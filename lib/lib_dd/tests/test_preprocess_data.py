@@ -0,0 +1,72 @@
+#!/usr/bin/python
+"""
+Test the fused preprocessing of the data (frequency filtering, format
+conversion and normalization) against sip_formats.convert
+"""
+import numpy as np
+from nose.tools import *
+import sip_formats.convert as SC
+import lib_dd.interface as lDDi
+
+
+class test_preprocess_data():
+
+    def setup(self):
+        random = np.random.RandomState(5)
+        nr_spectra = 300
+        nr_f = 20
+        rmag = random.uniform(50, 150, size=(nr_spectra, nr_f))
+        rpha = random.uniform(-30, -1, size=(nr_spectra, nr_f))
+        self.rmag_rpha = np.hstack((rmag, rpha))
+        self.mask = np.ones(nr_f, dtype=bool)
+        self.mask[[0, 7, 19]] = False
+
+    def _get_raw_data(self, input_format):
+        nr_f = int(self.rmag_rpha.shape[1] / 2)
+        rmag = self.rmag_rpha[:, 0:nr_f]
+        rpha = self.rmag_rpha[:, nr_f:]
+        # sip_formats.convert can not convert to these formats
+        if input_format == 'log10rmag_rpha':
+            return np.hstack((np.log10(rmag), rpha))
+        elif input_format == 'lnrmag_rpha':
+            return np.hstack((np.log(rmag), rpha))
+        return SC.convert('rmag_rpha', input_format, self.rmag_rpha)
+
+    def _get_reference(self, raw_data, input_format, output_format, mask,
+                       norm):
+        # processing as done before the data were preprocessed in one pass
+        data = raw_data
+        if mask is not None:
+            nr_f = int(data.shape[1] / 2)
+            data = np.hstack((data[:, 0:nr_f][:, mask],
+                              data[:, nr_f:][:, mask]))
+        data = SC.convert(input_format, output_format, data)
+        norm_factors = None
+        if norm is not None:
+            norm_factors = norm / data[:, 0]
+            data = data * norm_factors[:, np.newaxis]
+        return data, norm_factors
+
+    def _check(self, input_format, output_format, mask, norm, copy):
+        raw_data = self._get_raw_data(input_format)
+        reference, ref_factors = self._get_reference(
+            raw_data.copy(), input_format, output_format, mask, norm)
+        data, norm_factors = lDDi.preprocess_data(
+            raw_data, mask, input_format, output_format, norm=norm,
+            copy=copy)
+        # the results must be identical, not only close
+        assert_true(np.array_equal(data, reference), '{0} -> {1}'.format(
+            input_format, output_format))
+        if norm is None:
+            assert_true(norm_factors is None)
+        else:
+            assert_true(np.array_equal(norm_factors, ref_factors))
+
+    def test_inplace_formats(self):
+        for input_format in lDDi._inplace_formats:
+            for output_format in ('rre_rim', 'cre_cim'):
+                for mask in (None, self.mask):
+                    for norm in (None, 10):
+                        for copy in (True, False):
+                            self._check(input_format, output_format, mask,
+                                        norm, copy)
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+"""
+Test the triage of spectra before the inversion
+"""
+import os
+import shutil
+import tempfile
+import numpy as np
+from nose.tools import *
+import lib_dd.config.cfg_single as cfg_single
+import lib_dd.decomposition.ccd_single as ccd_single
+import lib_dd.io.io_general as iog
+
+
+class test_triage():
+
+    def setup(self):
+        self.frequencies = np.logspace(-2, 3, 20)
+        omega = 2 * np.pi * self.frequencies
+        spectra = []
+        for rho0, m, tau in ((100, 0.1, 0.01), (50, 0.05, 0.1)):
+            Z = rho0 * (1 - m * (1 - 1 / (1 + 1j * omega * tau)))
+            spectra.append(np.hstack((np.abs(Z), np.angle(Z) * 1000)))
+        # capacitive, but dominated by noise: the phase alternates between
+        # -1 and -6 mrad
+        noisy_phase = -3.5 + 2.5 * (-1) ** np.arange(0, 20)
+        spectra.append(np.hstack((np.ones(20) * 80, noisy_phase)))
+        self.data = np.array(spectra)
+        self.outdir = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.outdir)
+
+    def _fit(self, triage):
+        config = cfg_single.cfg_single()
+        config['frequency_file'] = self.frequencies
+        config['data_file'] = self.data.copy()
+        config['nr_terms_decade'] = 5
+        config['triage'] = triage
+        config['triage_min_snr'] = 2
+        obj = ccd_single.ccd_single(config)
+        obj.fit_data()
+        return obj
+
+    def test_skip_low_snr(self):
+        obj = self._fit(True)
+        skipped = obj.results[2]
+        assert_true(skipped.triage['skip'])
+        assert_true('snr' in skipped.triage['reason'])
+        assert_less(skipped.triage['snr'], 2)
+        assert_equal(skipped.stop_reason, 'triage')
+        # only the starting iteration is computed
+        assert_equal(len(skipped.iterations), 1)
+
+        # all statistical parameters are NaN, with the shapes of the
+        # parameters of a fitted spectrum
+        stat_pars = skipped.iterations[-1].stat_pars
+        fitted_pars = obj.results[0].iterations[-1].stat_pars
+        assert_equal(sorted(stat_pars.keys()), sorted(fitted_pars.keys()))
+        for key in fitted_pars.keys():
+            for value, fitted in zip(stat_pars[key], fitted_pars[key]):
+                assert_equal(np.shape(value), np.shape(fitted))
+                assert_true(np.all(np.isnan(value)))
+
+    def test_fit_passed(self):
+        obj = self._fit(True)
+        obj_ref = self._fit(False)
+        for ND, ND_ref in zip(obj.results[0:2], obj_ref.results[0:2]):
+            assert_false(ND.triage['skip'])
+            assert_equal(ND.stop_reason, ND_ref.stop_reason)
+            assert_true(np.array_equal(
+                ND.iterations[-1].m, ND_ref.iterations[-1].m))
+
+    def test_save_triage(self):
+        obj = self._fit(True)
+        pwd = os.getcwd()
+        os.chdir(self.outdir)
+        try:
+            iog.save_fit_results(obj.data, obj.results)
+        finally:
+            os.chdir(pwd)
+
+        triage = np.atleast_2d(
+            np.loadtxt(self.outdir + os.sep + 'triage.dat'))
+        # one row per spectrum: skip, capacitive_fraction, snr, rms0, time
+        assert_equal(triage.shape, (3, 5))
+        assert_equal(triage[:, 0].tolist(), [0, 0, 1])
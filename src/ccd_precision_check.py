@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Compare the integrated parameters (m_tot_n, tau_50, tau_mean) of a float32
+batch fit (ccd_single --solver batch --precision float32) to those of a float64
+fit of the same data, and report the deviations.
+
+Copyright 2014-2017 Maximilian Weigand
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import json
+import logging
+from optparse import OptionParser
+
+import lib_dd.decomposition.precision_check as precision_check
+
+
+def handle_cmd_options():
+    parser = OptionParser()
+    parser.add_option("-f", "--frequency_file", type='string', metavar='FILE',
+                      help="Frequency file (default: frequencies.dat)",
+                      default="frequencies.dat", dest="frequency_file")
+    parser.add_option("-d", "--data_file", type='string', metavar='FILE',
+                      help="Data file (default: data.dat)",
+                      default="data.dat", dest="data_file")
+    parser.add_option("--data_format", type='string', metavar='FORMAT',
+                      help="Data format (default: rmag_rpha)",
+                      default="rmag_rpha", dest="data_format")
+    parser.add_option("-n", "--nr_terms_decade", type='int', metavar='INT',
+                      help="Number of polarization terms per frequency " +
+                      "decade (default: 20)",
+                      default=20, dest="nr_terms_decade")
+    parser.add_option("-c", "--nr_cores", type='int', metavar='INT',
+                      help="Number of CPU cores to use (default: 1)",
+                      default=1, dest="nr_cores")
+    parser.add_option("--batch_size", type='int', metavar='INT',
+                      help="Spectra inverted at once (default: 64)",
+                      default=64, dest="batch_size")
+    parser.add_option("-o", "--output", type='string', metavar='FILE',
+                      help="Also write the deviations to this JSON file " +
+                      "(default: None)",
+                      default=None, dest="output")
+    (options, args) = parser.parse_args()
+    return options, args
+
+
+def main():
+    options, _ = handle_cmd_options()
+    config_dict = {
+        'data_format': options.data_format,
+        'nr_terms_decade': options.nr_terms_decade,
+        'nr_cores': options.nr_cores,
+        'batch_size': options.batch_size,
+    }
+    deviations, times = precision_check.check_precision(
+        options.frequency_file, options.data_file, config_dict)
+    print(precision_check.format_report(deviations, times))
+
+    if options.output is not None:
+        with open(options.output, 'w') as fid:
+            json.dump({'deviations': deviations, 'times': times}, fid,
+                      indent=4)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+""" Run the Cole-Cole decomposition (ccd_single) as a long-running local
+service. Fit jobs are submitted via HTTP POST requests, either to a local TCP
+port or to a Unix socket. See lib_dd.decomposition.ccd_server for the format of
+the requests and responses.
+
+Copyright 2014-2017 Maximilian Weigand
+
+This program is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the Free Software
+Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+This program is distributed in the hope that it will be useful, but WITHOUT
+ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+from optparse import OptionParser
+
+import lib_dd.decomposition.ccd_server as ccd_server
+
+logging.basicConfig(level=logging.INFO)
+
+
+def handle_cmd_options():
+    parser = OptionParser()
+    parser.add_option("--host", type='string', metavar='HOST',
+                      help="Host to listen on (default: localhost)",
+                      default="localhost", dest="host")
+    parser.add_option("-p", "--port", type='int', metavar='PORT',
+                      help="Port to listen on (default: 8765)",
+                      default=8765, dest="port")
+    parser.add_option("--socket", type='string', metavar='FILE',
+                      help="Listen on this Unix socket instead of a TCP " +
+                      "port (default: None)",
+                      default=None, dest="socket_file")
+    parser.add_option("-c", "--nr_cores", type='int', metavar='INT',
+                      help="Number of worker processes (default: 1)",
+                      default=1, dest="nr_cores")
+    (options, args) = parser.parse_args()
+    return options, args
+
+
+def main():
+    options, _ = handle_cmd_options()
+    server_obj = ccd_server.ccd_server(options.nr_cores)
+    http_server = ccd_server.create_http_server(
+        server_obj,
+        host=options.host,
+        port=options.port,
+        socket_file=options.socket_file,
+    )
+    if options.socket_file is not None:
+        logging.info('Listening on {0}'.format(options.socket_file))
+    else:
+        logging.info('Listening on http://{0}:{1}'.format(
+            options.host, options.port))
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.server_close()
+        server_obj.close()
+
+
+if __name__ == '__main__':
+    main()
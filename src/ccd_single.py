@@ -18,7 +18,6 @@ FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
 You should have received a copy of the GNU General Public License along
 with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-# from memory_profiler import *
 import logging
 import os
 import shutil
@@ -30,7 +29,7 @@ from lib_dd.decomposition.ccd_single import ccd_single
 
 logging.basicConfig(level=logging.INFO)
 
-# @profile
+
 def main():
     logging.info('Cole-Cole decomposition, no time regularization')
 
@@ -55,11 +54,13 @@ def main():
 
     iog.save_fit_results(
         ccds_object.data,
-        ccds_object.results
+        ccds_object.results,
+        ccds_object.profiler,
     )
 
     # go back to initial working directory
     os.chdir(pwd)
+    ccds_object.save_profile(options['output_dir'])
 
     # move temp directory to output directory
     if options['use_tmp']:
@@ -17,8 +17,8 @@ FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
 You should have received a copy of the GNU General Public License along
 with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-# from memory_profiler import *
 import os
+import time
 import logging
 logging.basicConfig(level=logging.INFO)
 import numpy as np
@@ -30,8 +30,10 @@ import lib_dd.interface as lDDi
 import lib_dd.plot as lDDp
 import lib_dd.conductivity.model as cond_model
 from lib_dd.models import ccd_res
+import lib_dd.decomposition.convergence as convergence
 import lib_dd.config.cfg_time as cfg_time
 import lib_dd.io.io_general as iog
+import lib_dd.profiling as profiling
 
 
 def _get_times(options):
@@ -113,21 +115,43 @@ def _get_fit_datas(data):
     return fit_data
 
 
-# @profile
-def fit_data(data):
+def fit_data(data, profiler=None):
     """
     Call the fit routine for each pixel
+
+    Parameters
+    ----------
+    data: data dict (see get_data_dd_time)
+    profiler: lib_dd.profiling.profiler object which records the run-level
+              stages get_fit_datas, fit, plotting and the output writer (may
+              be None)
+
+    Returns
+    -------
+    ND: the ND object of the time-lapse inversion
     """
-    data_struct = _get_fit_datas(data)
+    if profiler is None:
+        profiler = profiling.profiler(enabled=False)
+    with profiler.stage('get_fit_datas'):
+        data_struct = _get_fit_datas(data)
 
     # fit the time-lapse data
+    fit_start = time.time()
     ND = fit_one_time_series(data_struct)
+    profiler.add('fit', time.time() - fit_start)
+
+    with profiler.stage('plotting'):
+        call_fit_functions(data_struct, ND)
 
     # results now contains one or more ND objects
-    iog.save_fit_results(data, ND)
+    iog.save_fit_results(data, ND, profiler)
+    return ND
 
 
 def _prepare_ND_object(data):
+    profiler = profiling.profiler(
+        profiling.is_enabled(data['prep_opts'].get('profile', False)))
+    construction_start = time.time()
     # use conductivity or resistivity model?
     if 'DD_COND' in os.environ and os.environ['DD_COND'] == '1':
         # there is only one parameterisation: log10(sigma_i), log10(m)
@@ -139,7 +163,8 @@ def _prepare_ND_object(data):
         else:
             data['inv_opts']['c'] = 1.0
         model = ccd_res.decomposition_resistivity(data['inv_opts'])
-    ND = NDimInv.NDimInv(model, data['inv_opts'])
+    ND = convergence.NDimInv_adaptive(model, data['inv_opts'])
+    ND.profiler = profiler
 
     # add extra dimensions
     nr_timesteps = data['data'].shape[0]
@@ -154,8 +179,12 @@ def _prepare_ND_object(data):
         ND.Data.add_data(
             subdata, data['prep_opts']['data_format'],
             extra=(index, ))
+    profiler.add('model_construction', time.time() - construction_start)
 
-    ND.update_model()
+    # this also estimates the starting model
+    with profiler.stage('starting_model'):
+        ND.update_model()
+    construction_start = time.time()
 
     # add rms types
     ND.RMS.add_rms('rms_re_im',
@@ -189,7 +218,7 @@ def _prepare_ND_object(data):
         if(data['prep_opts']['individual_lambdas']):
             lam_obj = LamFuncs.SearchLambdaIndividual(lam0_obj)
         else:
-            lam_obj = LamFuncs.SearchLambda(lam0_obj)
+            lam_obj = convergence.SearchLambdaCounted(lam0_obj)
         # rms value to optimize
         optimize_rms_key = 'rms_re_im_noerr'
         optimize_rms_index = 1  # imaginary part
@@ -249,6 +278,11 @@ def _prepare_ND_object(data):
             data['prep_opts']['t_m_i_lambda']
         )
     )
+    profiler.add('model_construction', time.time() - construction_start)
+
+    profiler.instrument(lam_obj, 'get_lambda', 'lambda_search')
+    profiler.instrument(
+        ND.Model.steplength_selector, 'get_steplength', 'steplength')
     return ND
 
 
@@ -272,7 +306,7 @@ def fit_one_time_series(data):
             final_iteration.Data.D[:, :, spectrum_nr] /= norm_fac
             spectrum_nr += 1
 
-    call_fit_functions(data, ND)
+    ND.profiler.release()
     return ND
 
 
@@ -297,14 +331,19 @@ def main():
     options.check_input_files(['times', ])
     outdir_real, options = lDDi.create_output_dir(options)
 
-    data = get_data_dd_time(options)
+    # run-level stages (see lib_dd.profiling)
+    profiler = profiling.profiler(profiling.is_enabled(options['profile']))
+    with profiler.stage('load'):
+        data = get_data_dd_time(options)
 
     # for the fitting process, change to the output_directory
     pwd = os.getcwd()
     os.chdir(options['output_dir'])
-    fit_data(data)
+    ND = fit_data(data, profiler)
     # go back to initial working directory
     os.chdir(pwd)
+    if profiler.enabled:
+        profiling.save_profile(options['output_dir'], profiler, [ND, ])
 
 
 if __name__ == '__main__':
@@ -18,9 +18,12 @@ You should have received a copy of the GNU General Public License along
 with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import os
+import shlex
 from optparse import OptionParser
 import subprocess
 import lib_ccd_test.run_test as ccd_test
+import lib_ccd_test.runner as runner
+import lib_ccd_test.performance as performance
 
 
 # dict with the available binaries, and the corresponding data files
@@ -63,6 +66,25 @@ def handle_cmd_options():
     parser.add_option("--test", action="store_true",
                       help="Test the current dd implementation vs recorded " +
                       "results (default: False)", dest="test")
+    parser.add_option("--tolerance", type="float", metavar="FLOAT",
+                      help="Relative tolerance of the normalized run time " +
+                      "before --test and --all report a performance " +
+                      "regression (default: {0})".format(
+                          performance.default_tolerance),
+                      default=performance.default_tolerance,
+                      dest="tolerance")
+    parser.add_option("--all", action="store_true",
+                      help="Run all tests found below the current " +
+                      "directory (or the directory given as argument) and " +
+                      "write a report (default: False)", default=False,
+                      dest="all")
+    parser.add_option("-c", "--nr_cores", type="int", metavar="INT",
+                      help="Number of tests run in parallel by --all " +
+                      "(default: 1)", default=1, dest="nr_cores")
+    parser.add_option("--report", type="string", metavar="FILE",
+                      help="Report file written by --all (default: " +
+                      "test_report.json)", default="test_report.json",
+                      dest="report")
 
     (options, args) = parser.parse_args()
 
@@ -88,21 +110,19 @@ def handle_cmd_options():
 
 
 def write_pc_infos(fid):
-    # get git commit and branch
-    git_commit = subprocess.check_output(
-        'git log -1 | grep commit',
-        shell=True
-    )
-    git_branch = subprocess.check_output('git branch | grep "\*"', shell=True)
-    uname = subprocess.check_output('uname -a', shell=True)
-    cpu = subprocess.check_output(
-        'cat /proc/cpuinfo  | grep "model name" | head -1', shell=True)
-    hostname = subprocess.check_output('hostname', shell=True)
-    fid.write(git_commit.decode('utf-8'))
-    fid.write(git_branch.decode('utf-8'))
-    fid.write(uname.decode('utf-8'))
-    fid.write(cpu.decode('utf-8'))
-    fid.write(hostname.decode('utf-8'))
+    # get git commit and branch, and information on the machine. Commands that
+    # fail (e.g. outside of a git repository) are skipped
+    for cmd in ('git log -1 | grep commit',
+                'git branch | grep "\\*"',
+                'uname -a',
+                'cat /proc/cpuinfo  | grep "model name" | head -1',
+                'hostname'):
+        try:
+            output = subprocess.check_output(
+                cmd, shell=True, stderr=subprocess.DEVNULL)
+        except subprocess.CalledProcessError:
+            continue
+        fid.write(output.decode('utf-8'))
 
 
 def _get_data_files_for_binary(options):
@@ -148,7 +168,7 @@ def initialize_new_test_dir(options):
 
 def record_test(test_dir):
     """
-    Run a test
+    Run a test and record the results and the performance baseline
     """
     print('Recording test {0}'.format(test_dir))
     if not os.path.isdir(test_dir):
@@ -162,7 +182,17 @@ def record_test(test_dir):
     cmd = ' '.join(cmd)
     pwd = os.getcwd()
     os.chdir(test_dir)
-    subprocess.call(cmd, shell=True)
+    env, cmd_list = performance.split_command(shlex.split(cmd))
+    returncode, wall_time, max_rss = performance.run_command(
+        cmd_list, env, 'record.log')
+    if returncode == 0:
+        perf = performance.get_performance(
+            wall_time, max_rss, '../../data.dat', 'results')
+        performance.save_baseline('.', perf)
+        print('Recorded baseline: {0:.2f} s, {1:.2f} spectra/s'.format(
+            perf['wall_time'], perf['spectra_per_second']))
+    else:
+        print('The decomposition failed, see record.log')
     with open('test_infos.dat', 'w') as fid:
         write_pc_infos(fid)
     os.chdir(pwd)
@@ -187,4 +217,20 @@ if __name__ == '__main__':
     if options.test is True:
         test_dir = ccd_test.get_test_dir(args, last=True)
         print('Testing ', test_dir)
-        ccd_test.run_test(test_dir)
+        result = ccd_test.run_test(test_dir, options.tolerance)
+        if result is not None and result['regression']:
+            exit(1)
+
+    if options.all is True:
+        if(len(args) == 1):
+            directory = args[0]
+        else:
+            directory = '.'
+        test_cases = runner.discover_tests(directory)
+        print('Found {0} tests'.format(len(test_cases)))
+        records = runner.run_tests(
+            test_cases, options.nr_cores, options.tolerance)
+        print(runner.format_summary(records))
+        runner.save_report(options.report, records)
+        if any(x['status'] != 'ok' for x in records):
+            exit(1)
@@ -27,9 +27,9 @@ from optparse import OptionParser
 import os
 import glob
 import numpy as np
-from NDimInv.plot_helper import *
+import NDimInv.plot_helper
+plt, mpl = NDimInv.plot_helper.setup()
 import NDimInv.elem as elem
-import dd_single
 import NDimInv
 import lib_dd.plot as lDDp
 import sip_formats.convert as SC
@@ -47,9 +47,10 @@ def handle_cmd_options():
                       "Also allowed are ranges: \"2-10\", and open ranges: " +
                       "\"5-\" (default: -1 (all))",
                       default=None)
-    # parser.add_option("--nr_cpus", type='int', metavar='NR',
-    #                   help="Output directory", default=1,
-    #                   dest="nr_cpus")
+    parser.add_option("--nr_cpus", type='int', metavar='NR',
+                      help="Number of processes used for plotting " +
+                      "(default: 1)", default=1,
+                      dest="nr_cpus")
     parser.add_option('-o', "--output", type='str', metavar='DIR',
                       help="Output directory (default: filtered_results)",
                       default='filtered_results',
@@ -224,228 +225,167 @@ def extract_indices_from_range_str(filter_string, max_index=None):
     return filter_ids
 
 
-def plot_data(data, options):
-    nr_specs = data['d_rmag'].shape[0]
-    indices = extract_indices_from_range_str(options.spec_ranges,
-                                             nr_specs)
-    if indices is None:
-        indices = list(range(0, nr_specs))
-
+def _create_spectrum_figure(data):
+    """
+    Create the figure template used to plot one spectrum. All line artists are
+    created here and only their data is replaced for each spectrum.
+
+    Returns
+    -------
+    template : dict with keys 'fig', 'axes' and 'lines'. 'lines' holds tuples
+               (line, axes, x-key, y-key, sign) which describe how to update
+               the line for a given spectrum.
+    """
+    fig, axes = plt.subplots(1, 5, figsize=(14, 3))
     frequencies = data['frequencies']
+    dummy_f = np.ones_like(frequencies)
+    dummy_tau = np.ones_like(data['tau'])
 
-    for index in indices:
-        fig, axes = plt.subplots(1, 5, figsize=(14, 3))
-
-        # Magnitude and phase values
-        ax = axes[0]
-        ax.semilogx(frequencies, data['d_rmag'][index, :], '.', color='k')
-        ax.semilogx(frequencies, data['f_rmag'][index, :], '-', color='k')
-        ax.set_xlabel('frequency [Hz]')
-        ax.set_ylabel(r'$|\rho|~[\Omega m]$')
-        ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=4))
-        ax.yaxis.set_major_locator(mpl.ticker.MaxNLocator(5))
-
-        ax = axes[1]
-        ax.semilogx(frequencies, -data['d_rpha'][index, :], '.', color='k')
-        ax.semilogx(frequencies, -data['f_rpha'][index, :], '-', color='k')
-        ax.set_xlabel('frequency [Hz]')
-        ax.set_ylabel(r'$-\phi~[mrad]$')
-        ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=4))
-        ax.yaxis.set_major_locator(mpl.ticker.MaxNLocator(5))
-        # self._mark_tau_parameters_f(nr, ax, it)
-
-        ## real and imaginary parts
-        ax = axes[2]
-        ax.semilogx(frequencies, data['d_rre'][index, :], '.', color='k')
-        ax.semilogx(frequencies, data['f_rre'][index, :], '-', color='k')
-        ax.set_xlabel('frequency [Hz]')
-        ax.set_ylabel(r"$-\rho'~[\Omega m]$", color='k')
-        ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=4))
-
-        ax = axes[2].twinx()
-        ax.semilogx(frequencies, data['d_cre'][index, :], '.', color='gray')
-        ax.semilogx(frequencies, data['f_cre'][index, :], '-', color='gray')
-        ax.set_ylabel(r"$-\sigma'~[S/m]$", color='gray')
-        ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=4))
-
-        ax = axes[3]
-        ax.semilogx(frequencies, -data['d_rim'][index, :], '.', color='k',
-                    label='data')
-        ax.semilogx(frequencies, -data['f_rim'][index, :], '-', color='k',
-                    label='fit')
-        ax.set_xlabel('frequency [Hz]')
-        ax.set_ylabel(r"$-\rho''~[\Omega m]$", color='k')
-        ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=4))
-
-        ax = axes[3].twinx()
-        ax.semilogx(frequencies, data['d_cim'][index, :], '.', color='gray',
-                    label='data')
-        ax.semilogx(frequencies, data['f_cim'][index, :], '-', color='gray',
-                    label='fit')
-        # ax.set_xlabel('frequency [Hz]')
-        ax.set_ylabel(r"$-\sigma''~[S/m]$", color='gray')
-        ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=4))
-
-        # self._plot_rtd(nr, axes[nr, 4], M[m], it)
-
-        ax = axes[4]
-        ax.semilogx(data['tau'], data['rtd'][index, :], '.-', color='k')
-        ax.set_xlabel(r'$\tau~[s]$')
-        ax.set_ylabel(r'$log_{10}(m)$')
-        ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=4))
+    lines = []
 
-        fig.tight_layout()
-        fig.savefig('spec_{0:03}.png'.format(index), dpi=300)
+    def add_line(ax, key, fmt, sign=1, use_tau=False, **kwargs):
+        if use_tau:
+            line, = ax.semilogx(data['tau'], dummy_tau, fmt, **kwargs)
+            lines.append((line, ax, 'tau', key, sign))
+        else:
+            line, = ax.semilogx(frequencies, dummy_f, fmt, **kwargs)
+            lines.append((line, ax, 'frequencies', key, sign))
 
+    # Magnitude and phase values
+    ax = axes[0]
+    add_line(ax, 'd_rmag', '.', color='k')
+    add_line(ax, 'f_rmag', '-', color='k')
+    ax.set_xlabel('frequency [Hz]')
+    ax.set_ylabel(r'$|\rho|~[\Omega m]$')
+    ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=4))
+    ax.yaxis.set_major_locator(mpl.ticker.MaxNLocator(5))
 
-def _plot_rtd(self, nr, ax, m, it):
-    ax.semilogx(it.Data.obj.tau, m[1:], '.-', color='k')
-    ax.set_xlim(it.Data.obj.tau.min(), it.Data.obj.tau.max())
-    ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=5))
+    ax = axes[1]
+    add_line(ax, 'd_rpha', '.', sign=-1, color='k')
+    add_line(ax, 'f_rpha', '-', sign=-1, color='k')
+    ax.set_xlabel('frequency [Hz]')
+    ax.set_ylabel(r'$-\phi~[mrad]$')
+    ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=4))
     ax.yaxis.set_major_locator(mpl.ticker.MaxNLocator(5))
-    self._mark_tau_parameters_tau(nr, ax, it)
-    ax.invert_xaxis()
-    # mark limits of data frequencies, converted into the tau space
-    tau_min = np.min(it.Model.obj.tau)
-    tau_max = np.max(it.Model.obj.tau)
-    d_fmin = np.min(it.Data.obj.frequencies)
-    d_fmax = np.max(it.Data.obj.frequencies)
-    t_fmin = 1 / (2 * np.pi * d_fmin)
-    t_fmax = 1 / (2 * np.pi * d_fmax)
-    ax.axvline(t_fmin, c='y', alpha=0.7)
-    ax.axvline(t_fmax, c='y', alpha=0.7)
-    ax.axvspan(tau_min, t_fmax, hatch='/', color='gray', alpha=0.5)
-    ax.axvspan(t_fmin, tau_max, hatch='/', color='gray', alpha=0.5,
-               label='area outside data range')
 
+    # real and imaginary parts
+    ax = axes[2]
+    add_line(ax, 'd_rre', '.', color='k')
+    add_line(ax, 'f_rre', '-', color='k')
+    ax.set_xlabel('frequency [Hz]')
+    ax.set_ylabel(r"$-\rho'~[\Omega m]$", color='k')
+    ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=4))
+
+    ax = axes[2].twinx()
+    add_line(ax, 'd_cre', '.', color='gray')
+    add_line(ax, 'f_cre', '-', color='gray')
+    ax.set_ylabel(r"$-\sigma'~[S/m]$", color='gray')
+    ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=4))
+
+    ax = axes[3]
+    add_line(ax, 'd_rim', '.', sign=-1, color='k', label='data')
+    add_line(ax, 'f_rim', '-', sign=-1, color='k', label='fit')
+    ax.set_xlabel('frequency [Hz]')
+    ax.set_ylabel(r"$-\rho''~[\Omega m]$", color='k')
+    ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=4))
+
+    ax = axes[3].twinx()
+    add_line(ax, 'd_cim', '.', color='gray', label='data')
+    add_line(ax, 'f_cim', '-', color='gray', label='fit')
+    ax.set_ylabel(r"$-\sigma''~[S/m]$", color='gray')
+    ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=4))
+
+    ax = axes[4]
+    add_line(ax, 'rtd', '.-', use_tau=True, color='k')
     ax.set_xlabel(r'$\tau~[s]$')
     ax.set_ylabel(r'$log_{10}(m)$')
+    ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=4))
 
-    # print lambda value in title
-    title_string = r'$\lambda:$ '
-    for lam in it.lams:
-        if(type(lam) == list):
-            lam = lam[0]
-        if(isinstance(lam, float) or isinstance(lam, int)):
-            title_string += '{0} '.format(lam)
-        else:
-            # individual lambdas
-            title_string += '{0} '.format(
-                lam[m_indices[nr],  m_indices[nr]])
-    ax.set_title(title_string)
+    template = {
+        'fig': fig,
+        'axes': axes,
+        'lines': lines,
+        'layout_done': False,
+    }
+    return template
 
 
+# the data and the figure template of each (worker) process. The data is set
+# by _init_plot_state, which plot_data passes as initializer to the worker
+# processes.
+_plot_state = {
+    'data': None,
+    'template': None,
+}
 
-def _plot_cre_cim(self, nr, axes, orig_data, fit_data, it):
-    cre_cim_orig = sip_convert.convert(it.Data.obj.data_format,
-                                       'cre_cim',
-                                       orig_data)
 
-    cre_cim_fit = sip_convert.convert(it.Data.obj.data_format,
-                                      'cre_cim',
-                                      fit_data)
-    frequencies = it.Data.obj.frequencies
-    ax = axes[0]
-    ax.semilogx(frequencies, cre_cim_orig[:, 0], '.', color='gray')
-    ax.semilogx(frequencies, cre_cim_fit[:, 0], '-', color='gray')
-    # ax.set_xlabel('frequency [Hz]')
-    ax.set_ylabel(r"$-\sigma'~[S/m]$", color='gray')
-    ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=4))
+def _init_plot_state(data):
+    """
+    Set the data to plot in this process. The figure template is created on
+    the first call to _plot_spectrum.
+    """
+    _plot_state['data'] = data
+    _plot_state['template'] = None
 
-    ax = axes[1]
-    ax.semilogx(frequencies, cre_cim_orig[:, 1], '.', color='gray',
-                label='data')
-    ax.semilogx(frequencies, cre_cim_fit[:, 1], '-', color='gray',
-                label='fit')
-    # ax.set_xlabel('frequency [Hz]')
-    ax.set_ylabel(r"$-\sigma''~[S/m]$", color='gray')
-    ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=4))
 
-def _plot_rre_rim(self, nr, axes, orig_data, fit_data, it):
-    rre_rim_orig = sip_convert.convert(it.Data.obj.data_format,
-                                       'rre_rim',
-                                       orig_data)
+def _plot_spectrum(index):
+    """
+    Plot one spectrum using the figure template of this process and save it to
+    spec_[index].png
+    """
+    data = _plot_state['data']
+    if _plot_state['template'] is None:
+        _plot_state['template'] = _create_spectrum_figure(data)
+    template = _plot_state['template']
+
+    axes = set()
+    for line, ax, x_key, y_key, sign in template['lines']:
+        line.set_data(data[x_key], sign * data[y_key][index, :])
+        axes.add(ax)
+
+    for ax in axes:
+        ax.relim()
+        ax.autoscale_view()
+
+    fig = template['fig']
+    # repeated calls to tight_layout shrink the twinx axes, therefore the
+    # layout is only determined for the first spectrum
+    if not template['layout_done']:
+        fig.tight_layout()
+        template['layout_done'] = True
+    fig.savefig('spec_{0:03}.png'.format(index), dpi=300)
+    return index
 
-    rre_rim_fit = sip_convert.convert(it.Data.obj.data_format,
-                                      'rre_rim',
-                                      fit_data)
-    frequencies = it.Data.obj.frequencies
-    ax = axes[0]
-    ax.semilogx(frequencies, rre_rim_orig[:, 0], '.', color='k')
-    ax.semilogx(frequencies, rre_rim_fit[:, 0], '-', color='k')
-    ax.set_xlabel('frequency [Hz]')
-    ax.set_ylabel(r"$-\rho'~[\Omega m]$")
-    ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=4))
 
-    ax = axes[1]
-    ax.semilogx(frequencies, -rre_rim_orig[:, 1], '.', color='k',
-                label='data')
-    ax.semilogx(frequencies, -rre_rim_fit[:, 1], '-', color='k',
-                label='fit')
-    ax.set_xlabel('frequency [Hz]')
-    ax.set_ylabel(r"$-\rho''~[\Omega m]$")
-    ax.xaxis.set_major_locator(mpl.ticker.LogLocator(numticks=4))
+def plot_data(data, options):
+    """
+    Plot the selected spectra. The data is only loaded once. The spectra are
+    distributed among options.nr_cpus processes, each of which reuses one
+    figure for all its spectra.
+    """
+    nr_specs = data['d_rmag'].shape[0]
+    indices = extract_indices_from_range_str(options.spec_ranges,
+                                             nr_specs)
+    if indices is None:
+        indices = list(range(0, nr_specs))
 
-    self._mark_tau_parameters_f(nr, ax, it)
-
-    # legend is created from first plot
-    if nr == 0:
-        ax.legend(loc="upper center", ncol=5,
-                  bbox_to_anchor=(0, 0, 1, 1),
-                  bbox_transform=ax.get_figure().transFigure)
-        leg = ax.get_legend()
-        ltext = leg.get_texts()
-        plt.setp(ltext, fontsize='6')
-
-def _mark_tau_parameters_tau(self, nr, ax, it):
-    # mark relaxation time parameters
-    # mark tau_peak
-    for index in range(1, 3):
-        try:
-            tpeak = it.stat_pars['tau_peak{0}'.format(index)][nr]
-            if(not np.isnan(tpeak)):
-                ax.axvline(x=10**tpeak, color='k', label=r'$\tau_{peak}^' +
-                           '{0}'.format(index) + '$',
-                           linestyle='dashed')
-        except:
-            pass
-
-    try:
-        ax.axvline(x=10**it.stat_pars['tau_50'][nr], color='g',
-                   label=r'$\tau_{50}$')
-    except:
-        pass
-
-    try:
-        ax.axvline(x=10**it.stat_pars['tau_mean'][nr], color='c',
-                   label=r'$\tau_{mean}$')
-    except:
-        pass
-
-def _mark_tau_parameters_f(self, nr, ax, it):
-    # mark relaxation time parameters
-    # mark tau_peak
-    for index in range(1, 3):
-        try:
-            fpeak = it.stat_pars['f_peak{0}'.format(index)][nr]
-            if(not np.isnan(fpeak)):
-                ax.axvline(x=fpeak, color='k', label=r'$\tau_{peak}^' +
-                           '{0}'.format(index) + '$',
-                           linestyle='dashed')
-        except:
-            pass
-
-    try:
-        ax.axvline(x=it.stat_pars['f_50'][nr], color='g',
-                   label=r'$\tau_{50}$')
-    except:
-        pass
-
-    try:
-        ax.axvline(x=it.stat_pars['f_mean'][nr], color='c',
-                   label=r'$\tau_{mean}$')
-    except:
-        pass
+    if options.nr_cpus == 1:
+        _init_plot_state(data)
+        list(map(_plot_spectrum, indices))
+    else:
+        chunksize = max(1, int(np.ceil(
+            len(indices) / float(options.nr_cpus * 4))))
+        # the data is passed to each worker process once (the workers do not
+        # inherit it with the spawn start method)
+        p = Pool(options.nr_cpus, initializer=_init_plot_state,
+                 initargs=(data, ))
+        p.map(_plot_spectrum, indices, chunksize)
+        p.close()
+        p.join()
+
+    if _plot_state['template'] is not None:
+        plt.close(_plot_state['template']['fig'])
+        _plot_state['template'] = None
 
 
 def load_data(options):
@@ -34,7 +34,8 @@ from optparse import OptionParser
 import os
 import glob
 import numpy as np
-from NDimInv.plot_helper import *
+import NDimInv.plot_helper
+plt, mpl = NDimInv.plot_helper.setup()
 import NDimInv.elem as elem
 import NDimInv
 import lib_dd.plot as lDDp
@@ -247,27 +248,144 @@ def filter_subdata(data, key, options):
     return data
 
 
+def _get_grid_plot_settings(key, options):
+    """
+    Return the elem.plt_opt settings used to plot the parameter 'key' to the
+    grid
+    """
+    settings = {
+        'xlabel': 'x',
+        'ylabel': 'z',
+        'cb_nr_tiks': 5,
+    }
+    if(key in dd_stats.keys()):
+        settings['cbmin'] = getattr(options, key + '_min')
+        settings['cbmax'] = getattr(options, key + '_max')
+        settings['scale'] = dd_stats[key]['scale']
+        settings['reverse'] = dd_stats[key]['reverse']
+        settings['title'] = dd_stats[key]['label']
+    else:
+        # defaults
+        settings['cbmin'] = None
+        settings['cbmax'] = None
+        settings['scale'] = 'linear'
+        settings['reverse'] = False
+        settings['title'] = ''
+    return settings
+
+
+def _apply_grid_plot_settings(settings):
+    """
+    Transfer the settings returned by _get_grid_plot_settings to elem.plt_opt
+    """
+    for name, value in settings.items():
+        if name == 'scale':
+            continue
+        setattr(elem.plt_opt, name, value)
+
+
+def _set_element_data(subdata, fill_or_cut=False):
+    """
+    Replace the global element data of the elem module with subdata and return
+    the corresponding cid.
+
+    elem.add_to_element_data appends each data set to a growing array. For
+    plotting large numbers of frames we only need the current one.
+    """
+    elem.element_data = None
+    return elem.add_to_element_data(subdata, fill_or_cut)
+
+
+def _update_element_data_plot(ax, pm, cb, cid, scale='linear'):
+    """
+    Update a mesh previously plotted using elem.plot_element_data_to_ax with
+    new element data. The mesh geometry (the PolyCollection or QuadMesh) is
+    reused, and only the colour array, colour limits, and labels are replaced.
+
+    Parameters
+    ----------
+    ax : axes object that holds the mesh
+    pm : collection returned by elem.plot_element_data_to_ax
+    cb : colorbar returned by elem.plot_element_data_to_ax (can be None)
+    cid : id of the element data set to plot
+    scale : [linear|log10] (see elem._get_colors for more options)
+    """
+    colors, cbmin, cbmax = elem._get_colors(cid, scale)
+    pm.set_array(colors.ravel())
+    pm.set_cmap(elem.get_colormap())
+    pm.set_clim(float(cbmin), float(cbmax))
+
+    if cb is not None:
+        cb.update_normal(pm)
+        if(elem.plt_opt.cb_nr_tiks is not None):
+            cb.locator = mpl.ticker.MaxNLocator(
+                nbins=elem.plt_opt.cb_nr_tiks)
+            cb.update_ticks()
+        cb.set_label(elem.plt_opt.cblabel)
+    ax.set_xlabel(elem.plt_opt.xlabel)
+    ax.set_ylabel(elem.plt_opt.ylabel)
+    ax.set_title(elem.plt_opt.title)
+
+
+# each (worker) process keeps one figure for the grid plots. The mesh is
+# plotted once, all subsequent plots only swap the colour array.
+_grid_figure = {}
+
+
+def _plot_grid_frame(job):
+    """
+    Plot one parameter to the grid and save the figure to a file. This function
+    is called by plot_to_grid, possibly in a multiprocessing pool.
+
+    Parameters
+    ----------
+    job : tuple (data, settings, filename)
+    """
+    data, settings, filename = job
+    _apply_grid_plot_settings(settings)
+    cid = _set_element_data(data)
+
+    if not _grid_figure:
+        fig, ax = plt.subplots(1, 1, figsize=(6, 4))
+        ax, pm, cb = elem.plot_element_data_to_ax(
+            cid, ax, scale=settings['scale'])
+        _grid_figure.update({'fig': fig, 'ax': ax, 'pm': pm, 'cb': cb})
+    else:
+        _update_element_data_plot(
+            _grid_figure['ax'],
+            _grid_figure['pm'],
+            _grid_figure['cb'],
+            cid,
+            scale=settings['scale'],
+        )
+
+    _grid_figure['fig'].savefig(filename, bbox_inches='tight', dpi=300)
+    return filename
+
+
 def plot_to_grid(options):
     """
     Plot statistics to grid
+
+    The figures for the individual parameters are plotted in parallel if
+    options.nr_cpus > 1.
     """
     data = load_data(options)
-    pwd = os.getcwd()
 
     # plot files
     elem.load_elem_file(options.elem_file)
     elem.load_elec_file(options.elec_file)
-    outdir = options.result_dir + '/plots_stats_grid'
+    outdir = os.path.abspath(options.result_dir + '/plots_stats_grid')
     if(not os.path.isdir(outdir)):
         os.makedirs(outdir)
-    os.chdir(outdir)
     nr_elements = len(elem.element_type_list[0])
+
+    jobs = []
     for key in sorted(data.keys()):
-        print('Plotting {0}'.format(key))
         # set limits
         if(data[key].size != nr_elements):
             # check if this result dir was previously filtered
-            remaining_indices_file = '../remaining_indices.dat'
+            remaining_indices_file = outdir + '/../remaining_indices.dat'
 
             if(os.path.isfile(remaining_indices_file)):
                 print('Filtered data set')
@@ -281,37 +399,19 @@ def plot_to_grid(options):
         else:
             data_new = data[key]
 
-        if(key in dd_stats.keys()):
-            elem.plt_opt.cbmin = getattr(options, key + '_min')
-            elem.plt_opt.cbmax = getattr(options, key + '_max')
-            scale = dd_stats[key]['scale']
-            elem.plt_opt.reverse = dd_stats[key]['reverse']
-        else:
-            # defaults
-            elem.plt_opt.cbmin = None
-            elem.plt_opt.cbmax = None
-            elem.plt_opt.reverse = False
-            scale = 'linear'
-        print('min/max', elem.plt_opt.cbmin, elem.plt_opt.cbmax)
-        print('scale', scale)
-
-        elem.plt_opt.xlabel = 'x'
-        elem.plt_opt.ylabel = 'z'
-        elem.plt_opt.cb_nr_tiks = 5
-
-        if key in dd_stats:
-            elem.plt_opt.title = dd_stats[key]['label']
-        else:
-            elem.plt_opt.title = ''
-
-        cid = elem.add_to_element_data(data_new)
-        fig, ax = plt.subplots(1, 1, figsize=(6, 4))
-        elem.plot_element_data_to_ax(cid, ax, scale=scale)
+        settings = _get_grid_plot_settings(key, options)
+        print('Plotting {0}'.format(key))
+        print('min/max', settings['cbmin'], settings['cbmax'])
+        print('scale', settings['scale'])
+        jobs.append((data_new, settings, outdir + os.sep + key + '.png'))
 
-        fig.savefig(key + '.png', bbox_inches='tight', dpi=300)
-        plt.close(fig)
-        del(fig)
-    os.chdir(pwd)
+    if(options.nr_cpus == 1):
+        list(map(_plot_grid_frame, jobs))
+    else:
+        p = Pool(options.nr_cpus)
+        p.map(_plot_grid_frame, jobs)
+        p.close()
+        p.join()
 
 
 def _get_ND(subdata):
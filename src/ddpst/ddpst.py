@@ -25,7 +25,9 @@ Planned features:
     - filter spectra based on statistical values
 """
 from optparse import OptionParser
-from NDimInv.plot_helper import *
+from multiprocessing import Pool
+import NDimInv.plot_helper
+plt, mpl = NDimInv.plot_helper.setup()
 import numpy as np
 import os
 import glob
@@ -45,6 +47,12 @@ def handle_cmd_options():
                       help="Aggregate plot results (default: False)",
                       default=False)
 
+    parser.add_option("--aggregate_text", action="store_true",
+                      dest="aggregate_text",
+                      help="Also save the aggregated results as text " +
+                      "files (default: False)",
+                      default=False)
+
     parser.add_option("--xmin", type='float', metavar='Depth',
                       help="xmin", default=None, dest="xmin")
     parser.add_option("--xmax", type='float', metavar='Depth',
@@ -57,13 +65,61 @@ def handle_cmd_options():
     parser.add_option("--mtotn_tau_filter", type='int', metavar='INT',
                       help="Element depth for mtotn filter",
                       default=None, dest="mtotn_filter_depth")
+    parser.add_option("--nr_cpus", type='int', metavar='NR',
+                      help="Number of processes used to plot the grids " +
+                      "(default: 1)", default=1,
+                      dest="nr_cpus")
     parser = ddps._add_dd_grid_plot_opts(parser)
     (options, args) = parser.parse_args()
     return options, args
 
 
+def _get_aggregate_filename(outdir, filename):
+    """
+    Return the filename of the binary aggregate corresponding to a result file
+    (e.g. rho0_results.dat -> rho0_results.npy)
+    """
+    return outdir + os.sep + os.path.splitext(filename)[0] + '.npy'
+
+
+def _aggregate_chunk(job):
+    """
+    Read the result files of a range of time series directories and write them
+    into the preallocated (memory mapped) aggregate arrays.
+
+    Parameters
+    ----------
+    job : tuple (outdir, result_files, ts_dirs, start_index)
+
+    Returns
+    -------
+    ignore : list of result files that could not be aggregated (empty files or
+             inconsistent sizes)
+    """
+    outdir, result_files, ts_dirs, start_index = job
+    ignore = []
+    for filename in result_files:
+        agg = np.load(
+            _get_aggregate_filename(outdir, filename), mmap_mode='r+')
+        for nr, ts in enumerate(ts_dirs):
+            data = np.loadtxt(ts + '/stats_and_rms/' + filename)
+            if data.size == 0 or data.shape != agg.shape[1:]:
+                ignore.append(filename)
+                break
+            agg[start_index + nr] = data
+        agg.flush()
+        del(agg)
+    return ignore
+
+
 def aggregate_results(options):
     """Assemble the fit results for all pixels of each time series
+
+    The results are streamed into preallocated, memory mapped arrays (one .npy
+    file per result file) so that only the data of one time series resides in
+    memory at a time. With options.nr_cpus > 1 the time series directories are
+    read in parallel. If requested, the aggregated results are also saved as
+    text files.
     """
     outdir = os.path.abspath(options.result_dir) + '/stats_and_rms_agg'
     indir = os.path.abspath(options.result_dir) + '/fits'
@@ -73,35 +129,91 @@ def aggregate_results(options):
     os.makedirs(outdir)
 
     ts_dirs = sorted(glob.glob(indir + '/tmp_ts_*'))
-    result_files = [os.path.basename(x) for x in
-                    glob.glob(ts_dirs[0] + '/stats_and_rms/*.dat')]
+    result_files = sorted([os.path.basename(x) for x in
+                           glob.glob(ts_dirs[0] + '/stats_and_rms/*.dat')])
 
+    # use the first time series to determine the sizes of the aggregates
+    agg_files = []
     for filename in result_files:
-        ignore = False
-        data_list = []
-        for ts in ts_dirs:
-            # open data file
-            data = np.loadtxt(ts + '/stats_and_rms/' + filename)
-            if data.size == 0:
-                ignore = True
-            data_list.append(data)
-        data_all = np.array(data_list)
+        data = np.loadtxt(ts_dirs[0] + '/stats_and_rms/' + filename)
         # for now, save only 1D or 2D results
-        if len(data_all.shape) <= 2 and not ignore:
-            np.savetxt(outdir + os.sep + filename, data_all)
+        if data.size == 0 or len(data.shape) > 1:
+            continue
+        agg = np.lib.format.open_memmap(
+            _get_aggregate_filename(outdir, filename),
+            mode='w+',
+            dtype=np.float64,
+            shape=(len(ts_dirs), ) + data.shape,
+        )
+        agg[:] = np.nan
+        agg.flush()
+        del(agg)
+        agg_files.append(filename)
+
+    # split the time series into chunks
+    nr_chunks = max(1, min(len(ts_dirs), options.nr_cpus * 4))
+    chunk_size = int(np.ceil(len(ts_dirs) / nr_chunks))
+    jobs = []
+    for start in range(0, len(ts_dirs), chunk_size):
+        jobs.append(
+            (outdir, agg_files, ts_dirs[start: start + chunk_size], start)
+        )
+
+    if options.nr_cpus == 1:
+        results = list(map(_aggregate_chunk, jobs))
+    else:
+        p = Pool(options.nr_cpus)
+        results = p.map(_aggregate_chunk, jobs)
+        p.close()
+        p.join()
+
+    ignore = set([x for sublist in results for x in sublist])
+    for filename in agg_files:
+        agg_file = _get_aggregate_filename(outdir, filename)
+        if filename in ignore:
+            os.unlink(agg_file)
+            continue
+        if options.aggregate_text:
+            np.savetxt(outdir + os.sep + filename,
+                       np.load(agg_file, mmap_mode='r'))
+
+
+def load_aggregated_results(result_dir, filename):
+    """
+    Load the aggregated results for a given result file name. The binary
+    aggregate is memory mapped if present, otherwise the text file is read.
+
+    Returns None if no aggregate is present.
+    """
+    agg_dir = os.path.abspath(result_dir) + '/stats_and_rms_agg'
+    agg_file = _get_aggregate_filename(agg_dir, filename)
+    if os.path.isfile(agg_file):
+        return np.load(agg_file, mmap_mode='r')
+    data_file = agg_dir + os.sep + filename
+    if os.path.isfile(data_file):
+        return np.loadtxt(data_file)
+    return None
+
+
+# each (worker) process keeps the grid figures, indexed by their layout. The
+# meshes are plotted once, subsequent parameters only swap the colour arrays.
+_grid_figures = {}
 
 
 def plot_to_grids(data_list, key, options):
+    """
+    Plot all timesteps of the parameter 'key' into one figure. This function
+    is called by plot_to_grid, possibly in a multiprocessing pool.
+    """
     data = data_list[key]
     nr_total = data.shape[1]
     nr_x = min(5, nr_total)
     nr_y = int(np.ceil(nr_total / nr_x))
-    fig, axes = plt.subplots(nr_y, nr_x, figsize=(nr_x * 2, nr_y * 2))
 
     # filter thresholds?
     if options.mtotn_filter_depth is not None:
         # apply thresholds
-        for timestep in xrange(0, data.shape[1]):
+        for timestep in range(0, data.shape[1]):
             data[data_list['mtotn_filter'][timestep], timestep] = np.nan
 
     data[np.isinf(data)] = np.nan
@@ -121,24 +233,44 @@ def plot_to_grids(data_list, key, options):
     if options.xmax is not None:
         elem.plt_opt.xmax = options.xmax
 
-    for ax, time in zip(axes.flatten(), xrange(0, nr_total)):
-        scale = ddps.dd_stats[key]['scale']
-        elem.plt_opt.reverse = ddps.dd_stats[key]['reverse']
-        # print 'min/max', elem.plt_opt.cbmin, elem.plt_opt.cbmax
-        # print 'scale', scale
-        cid = elem.add_to_element_data(data[:, time], True)
-        elem.plot_element_data_to_ax(cid, ax, scale=scale, no_electrodes=True)
-
-        ax.set_xlabel('')
-        ax.set_ylabel('')
-        ax.set_title(ddps.dd_stats[key]['label'])
-        ax.xaxis.set_major_locator(mpl.ticker.MaxNLocator(3))
-        ax.yaxis.set_major_locator(mpl.ticker.MaxNLocator(3))
-
-    fig.tight_layout()
+    scale = ddps.dd_stats[key]['scale']
+    elem.plt_opt.reverse = ddps.dd_stats[key]['reverse']
+    elem.plt_opt.title = ddps.dd_stats[key]['label']
+    elem.plt_opt.xlabel = ''
+    elem.plt_opt.ylabel = ''
+
+    layout = (nr_y, nr_x, nr_total)
+    if layout not in _grid_figures:
+        fig, axes = plt.subplots(nr_y, nr_x, figsize=(nr_x * 2, nr_y * 2))
+        meshes = []
+        for ax, time in zip(np.atleast_1d(axes).flatten(),
+                            range(0, nr_total)):
+            cid = ddps._set_element_data(data[:, time], True)
+            ax, pm, cb = elem.plot_element_data_to_ax(
+                cid, ax, scale=scale, no_electrodes=True)
+            ax.xaxis.set_major_locator(mpl.ticker.MaxNLocator(3))
+            ax.yaxis.set_major_locator(mpl.ticker.MaxNLocator(3))
+            meshes.append((ax, pm, cb))
+        fig.tight_layout()
+        _grid_figures[layout] = (fig, meshes)
+    else:
+        fig, meshes = _grid_figures[layout]
+        for (ax, pm, cb), time in zip(meshes, range(0, nr_total)):
+            cid = ddps._set_element_data(data[:, time], True)
+            ddps._update_element_data_plot(ax, pm, cb, cid, scale=scale)
+
     fig.savefig(key + '.png', dpi=200)
 
 
+def _plot_to_grids_job(job):
+    """
+    Wrapper for plot_to_grids suitable for multiprocessing.Pool.map
+    """
+    data_list, key, options = job
+    plot_to_grids(data_list, key, options)
+    return key
+
+
 def plot_to_grid(options):
     if options.pixel_mask is not None:
         pixel_mask = np.loadtxt(options.pixel_mask, dtype=int)
@@ -153,13 +285,13 @@ def plot_to_grid(options):
 
     data_list = {}
     # we use the result definitions from ddps
-    for key in reversed(ddps.dd_stats.keys()):
-        print('Plotting {0}'.format(key))
-        data_file = result_dir_abs + '/stats_and_rms_agg/' + \
-            ddps.dd_stats[key]['filename']
-        if not os.path.isfile(data_file):
+    for key in reversed(list(ddps.dd_stats.keys())):
+        data = load_aggregated_results(
+            result_dir_abs, ddps.dd_stats[key]['filename'])
+        if data is None:
             continue
-        data = np.loadtxt(data_file)
+        # work on an in-memory copy, the plot functions modify the data
+        data = np.array(data)
         if pixel_mask is not None:
             tmp = np.ones_like(data) * np.nan
             tmp[pixel_mask] = data[pixel_mask]
@@ -167,6 +299,7 @@ def plot_to_grid(options):
 
         data_list[key] = data
 
+    mtotn_filter = None
     if options.mtotn_filter_depth is not None:
         # determine depth thresholds
         threshold_elements = options.mtotn_filter_depth
@@ -176,14 +309,28 @@ def plot_to_grid(options):
 
         # apply thresholds
         mtotn_filter = []
-        for timestep in xrange(0, data.shape[1]):
+        for timestep in range(0, data.shape[1]):
             indices = np.where(data_list['m_tot_n'][:, timestep] <
                                thresholds[timestep])
             mtotn_filter.append(indices)
-        data_list['mtotn_filter'] = mtotn_filter
 
-    for key in reversed(ddps.dd_stats.keys()):
-        plot_to_grids(data_list, key, options)
+    # only send the data required for one parameter to each job
+    jobs = []
+    for key in reversed(list(ddps.dd_stats.keys())):
+        if key not in data_list:
+            continue
+        print('Plotting {0}'.format(key))
+        job_data = {key: data_list[key], 'mtotn_filter': mtotn_filter}
+        jobs.append((job_data, key, options))
+
+    if options.nr_cpus == 1:
+        list(map(_plot_to_grids_job, jobs))
+    else:
+        p = Pool(options.nr_cpus)
+        p.map(_plot_to_grids_job, jobs)
+        p.close()
+        p.join()
+
 
 if __name__ == '__main__':
     options, args = handle_cmd_options()
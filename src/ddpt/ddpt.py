@@ -26,11 +26,13 @@ Planned features:
     - filter spectra based on statistical values
 """
 from optparse import OptionParser
+from multiprocessing import Pool
 import os
 import numpy as np
-from NDimInv.plot_helper import *
-import glob
+import NDimInv.plot_helper
+plt, mpl = NDimInv.plot_helper.setup()
 import ddps
+import lib_dd.int_pars as int_pars
 
 
 def handle_cmd_options():
@@ -47,9 +49,21 @@ def handle_cmd_options():
                       help="Compare multiple result directory. work with " +
                       "--plot_stats (default: False)", default=False)
 
+    parser.add_option("-c", "--nr_cores", dest="nr_cores", type="int",
+                      help="Number of processes used to load results and " +
+                      "to create plots (default: 1)", default=1)
+
     parser.add_option("--peak", dest="pick_peak", type="string",
                       help="Pick a first relaxation time peak in a certain " +
                       "frequency range", default=None)
+    parser.add_option("--nr_peaks", dest="nr_peaks", type="int",
+                      help="Number of peaks to pick for each time step " +
+                      "(default: 1)", default=1)
+    parser.add_option("--sort_peaks", action="store_true", dest="sort_peaks",
+                      help="only in combination with --peak. Return the " +
+                      "peaks with the largest chargeabilities first instead " +
+                      "of the low-frequency peaks (default: False)",
+                      default=False)
     parser.add_option("--plot_peaks", action="store_true", dest="plot_peaks",
                       help="only in combination with --peak. Create plots " +
                       "for the selected times (default: False)", default=False)
@@ -63,88 +77,151 @@ def handle_cmd_options():
     return options, args
 
 
-def _load_data(result_dir):
-    if(not os.path.isdir(result_dir)):
-        raise IOError('Directory not found!')
+# name of the cache file stored in the result directories
+cache_filename = 'ddpt_cache.npz'
 
-    # load data files
-    pwd = os.getcwd()
-    os.chdir(result_dir + '/stats_and_rms')
-    times = np.loadtxt('../times.dat')
-    result_files_raw = glob.glob('*.dat')
 
-    result_files_filtered = []
-    for filename in result_files_raw:
+def _get_result_files(stats_dir):
+    """Return the sorted list of statistics files in the stats_and_rms
+    directory
+    """
+    result_files = []
+    for filename in sorted(os.listdir(stats_dir)):
+        if(not filename.endswith('.dat')):
+            continue
         if(filename == 'cums_gtau_results.dat'):
             continue
         if(filename == 'm_i_results.dat'):
             continue
         if(filename.startswith('rms_')):
             continue
-        result_files_filtered.append(filename)
+        result_files.append(filename)
+    return result_files
+
+
+def _get_file_stamps(filenames):
+    """Return an array with modification time and size of each file. Used to
+    validate the load cache.
+    """
+    stamps = []
+    for filename in filenames:
+        stat = os.stat(filename)
+        stamps.append((stat.st_mtime, stat.st_size))
+    return np.array(stamps, dtype=float).reshape(-1, 2)
 
+
+def _load_data(result_dir):
+    """Load the statistics of one dd_time result directory. The data is cached
+    in the file ddpt_cache.npz in the result directory, which is reused as long
+    as the statistics files do not change.
+
+    Returns
+    -------
+    data : dict with one array (time steps x columns) for each statistic
+    times : times of the spectra
+    """
+    if(not os.path.isdir(result_dir)):
+        raise IOError('Directory not found!')
+
+    stats_dir = result_dir + os.sep + 'stats_and_rms'
+    times_file = result_dir + os.sep + 'times.dat'
+    cache_file = result_dir + os.sep + cache_filename
+
+    result_files = _get_result_files(stats_dir)
+    paths = [times_file] + [stats_dir + os.sep + x for x in result_files]
+    stamps = _get_file_stamps(paths)
+
+    if(os.path.isfile(cache_file)):
+        with np.load(cache_file) as cache:
+            if(np.array_equal(cache['_files'], paths) and
+               np.array_equal(cache['_stamps'], stamps)):
+                data = {key: cache[key] for key in cache.files
+                        if not key.startswith('_')}
+                return data, cache['_times']
+
+    times = np.atleast_1d(np.loadtxt(times_file))
     data = {}
-    for filename in result_files_filtered:
+    for filename in result_files:
         key = filename[:-4]
-        subdata = np.loadtxt(filename)
+        subdata = np.loadtxt(stats_dir + os.sep + filename)
         if(subdata.size > 0):
-            data[key] = subdata
-    os.chdir(pwd)
+            data[key] = subdata.reshape(times.size, -1)
+
+    try:
+        np.savez(cache_file, _files=np.array(paths), _stamps=stamps,
+                 _times=times, **data)
+    except IOError:
+        # read-only result directories can not be cached
+        pass
     return data, times
 
 
-def plot_stats(options):
+def load_runs(result_dirs, nr_cores=1):
+    """Load the statistics of multiple result directories (in parallel) into
+    one table
+
+    Returns
+    -------
+    table : dict with the entries
+            runs : list of result directories
+            parameters : list of parameter names (columns of multi-column
+                         statistics get the postfix -NR)
+            times : runs x time steps array, padded with NaN values
+            values : runs x time steps x parameters array, padded with NaN
+                     values
     """
-    Plot statistics vs. time
+    if(nr_cores == 1):
+        loaded = list(map(_load_data, result_dirs))
+    else:
+        p = Pool(nr_cores)
+        loaded = p.map(_load_data, result_dirs)
+        p.close()
+        p.join()
+
+    # parameters of the first run, with one entry per column
+    parameters = []
+    for key in sorted(loaded[0][0].keys()):
+        nr_columns = loaded[0][0][key].shape[1]
+        for nr in range(0, nr_columns):
+            postfix = ''
+            if(nr > 0):
+                postfix = '-{0}'.format(nr)
+            parameters.append((key + postfix, key, nr))
+
+    nr_times = max([times.size for data, times in loaded])
+    times_all = np.nan * np.ones((len(result_dirs), nr_times))
+    values = np.nan * np.ones((len(result_dirs), nr_times, len(parameters)))
+    for run, (data, times) in enumerate(loaded):
+        times_all[run, 0:times.size] = times
+        for index, (name, key, nr) in enumerate(parameters):
+            if(key in data and nr < data[key].shape[1]):
+                values[run, 0:times.size, index] = data[key][:, nr]
+
+    table = {
+        'runs': list(result_dirs),
+        'parameters': [x[0] for x in parameters],
+        'times': times_all,
+        'values': values,
+    }
+    return table
+
+
+def _plot_parameter(settings):
+    """Plot one parameter of all runs vs. time and save the figure. This
+    function is called from the process pool of plot_table.
     """
-    data, times = _load_data(options.result_dir)
-
-    # plot files
-    outdir = options.result_dir + '/plots_stats'
-    if(not os.path.isdir(outdir)):
-        os.makedirs(outdir)
-    pwd = os.getcwd()
-    os.chdir(outdir)
-    for key in data.keys():
-        print('Plotting {0}'.format(key))
-        fig, ax = plt.subplots(1, 1, figsize=(6, 4))
-        ax.set_title(key.replace('_', '\_'))
-        ax.plot(times, data[key], '.-')
-        fig.savefig(key + '.png')
-        plt.close(fig)
-        del(fig)
-    os.chdir(pwd)
-
-
-def plot_multiple_stats(options, args):
-    # load times
-    data_list = []
-    time_list = []
-    result_dirs = []
-    for result_dir in args:
-        print('Loading results from {0}'.format(result_dir))
-        data, time = _load_data(result_dir)
-        data_list.append(data)
-        time_list.append(time)
-        result_dirs.append(result_dir)
-
-    # plot files
-    outdir = 'comparison_stats'
-    if(not os.path.isdir(outdir)):
-        os.makedirs(outdir)
-    pwd = os.getcwd()
-    os.chdir(outdir)
-    for key in data_list[0].keys():
-        print('Plotting {0}'.format(key))
-        fig, ax = plt.subplots(1, 1, figsize=(6, 4))
+    fig, ax = plt.subplots(1, 1, figsize=(6, 4))
+    ax.set_title(settings['parameter'].replace('_', '\\_'))
+    if(len(settings['labels']) == 1):
+        ax.plot(settings['times'][0], settings['values'][0], '.-')
+    else:
         fig.subplots_adjust(bottom=0.2)
-        ax.set_title(key.replace('_', '\_'))
-        index = 0
-        for times, data in zip(time_list, data_list):
-            ax.plot(times, data[key], '.-',
-                    label=result_dirs[index].replace('_', '\_'))
-            index += 1
-        ax.set_xlim([min(times) - 1, max(times) + 1])
+        for times, values, label in zip(settings['times'],
+                                        settings['values'],
+                                        settings['labels']):
+            ax.plot(times, values, '.-', label=label.replace('_', '\\_'))
+        ax.set_xlim([np.nanmin(settings['times']) - 1,
+                     np.nanmax(settings['times']) + 1])
         ax.set_xlabel('time')
         # legend
         ax.legend(loc="upper center", ncol=3,
@@ -154,30 +231,63 @@ def plot_multiple_stats(options, args):
         ltext = leg.get_texts()
         plt.setp(ltext, fontsize='6')
 
-        fig.savefig(key + '.png')
-        plt.close(fig)
-        del(fig)
-    os.chdir(pwd)
+    fig.savefig(settings['filename'])
+    plt.close(fig)
+    del(fig)
 
 
-def pick_peak(options):
-    # size pars: times x parameters
-    pars = np.loadtxt(options.result_dir + '/stats_and_rms/m_i_results.dat')
-    frequencies = np.loadtxt(options.result_dir + '/frequencies.dat')
-    s = np.loadtxt(options.result_dir + '/s.dat')
-    import lib_dd.main as DD
-    settings = {'Nd': 10, 'frequencies': frequencies, 'tausel': 'data'}
-    obj = DD.get('log10rho0log10m', settings)
+def plot_table(table, outdir, nr_cores=1):
+    """Plot each parameter of the table vs. time (one figure per parameter,
+    all runs in one figure). The figures are created in a process pool.
+    """
+    if(not os.path.isdir(outdir)):
+        os.makedirs(outdir)
 
-    # select times
-    time_indices = ddps.extract_indices_from_range_str(options.times,
-                                                       pars.shape[0])
-    # select frequencies
+    plot_settings = []
+    for index, parameter in enumerate(table['parameters']):
+        plot_settings.append({
+            'parameter': parameter,
+            'times': table['times'],
+            'values': table['values'][:, :, index],
+            'labels': table['runs'],
+            'filename': outdir + os.sep + parameter + '.png',
+        })
+
+    if(nr_cores == 1):
+        list(map(_plot_parameter, plot_settings))
+    else:
+        p = Pool(nr_cores)
+        p.map(_plot_parameter, plot_settings)
+        p.close()
+        p.join()
+
+
+def plot_stats(options):
+    """
+    Plot statistics vs. time
+    """
+    table = load_runs([options.result_dir], options.nr_cores)
+    plot_table(table, options.result_dir + '/plots_stats', options.nr_cores)
 
+
+def plot_multiple_stats(options, args):
+    """
+    Plot the statistics of multiple result directories vs. time
+    """
+    for result_dir in args:
+        print('Loading results from {0}'.format(result_dir))
+    table = load_runs(args, options.nr_cores)
+    plot_table(table, 'comparison_stats', options.nr_cores)
+
+
+def _get_frequency_slice(pick_peak, frequencies, s):
+    """Return the slice of relaxation times corresponding to the frequency
+    range given by the --peak option
+    """
     # we allow :
     # a) open ranges -100 or 100-
     # b) closed range 50-100
-    items = options.pick_peak.split('-')
+    items = pick_peak.split('-')
 
     # # determine min/max frequency as specified by --peak
 
@@ -203,27 +313,33 @@ def pick_peak(options):
     start_s_index = np.argmin(np.abs(s - start_s))
     end_s_index = np.argmin(np.abs(s - end_s))
 
-    freq_slice = slice(start_s_index, end_s_index)
+    return slice(start_s_index, end_s_index)
+
+
+def pick_peak(options):
+    """Pick the first --nr_peaks peaks of the relaxation time distributions of
+    all selected time steps within the frequency range given by --peak
+    """
+    # size m_i: times x relaxation times (log10)
+    m_i = np.atleast_2d(
+        np.loadtxt(options.result_dir + '/stats_and_rms/m_i_results.dat'))
+    frequencies = np.loadtxt(options.result_dir + '/frequencies.dat')
+    s = np.loadtxt(options.result_dir + '/s.dat')
+
+    # select times
+    time_indices = ddps.extract_indices_from_range_str(options.times,
+                                                       m_i.shape[0])
+    if time_indices is None:
+        time_indices = list(range(0, m_i.shape[0]))
+
+    # select frequencies
+    freq_slice = _get_frequency_slice(options.pick_peak, frequencies, s)
     s_filtered = s[freq_slice]
+    m_filtered = m_i[time_indices, freq_slice]
 
-    f_peak_list = []
-    s_peak_list = []
-    for time_index in time_indices:
-        print ('Time', time_index)
-        # apply frequency filter
-        pars_filtered = pars[time_index, freq_slice]
-
-        par_time = np.hstack((1, pars_filtered))
-        pars_lin = obj.convert_pars_back(par_time)
-        # get peak
-        s_peaks, tau_peaks, f_peaks = obj.get_peaks(pars_lin[1:], s_filtered)
-        f_peak_list.append(f_peaks)
-        s_peak_list.append(s_peaks)
-
-    for nr, x in enumerate(f_peak_list):
-        if(x.size == 0):
-            f_peak_list[nr] = np.nan
-            s_peak_list[nr] = np.nan
+    s_peaks, f_peaks = int_pars._get_peaks_array(
+        m_filtered, s_filtered, options.nr_peaks,
+        sort_by_m=options.sort_peaks)
 
     pwd = os.getcwd()
     if(not os.path.isdir(options.output)):
@@ -235,11 +351,12 @@ def pick_peak(options):
         nr_plots = len(time_indices)
         size_x = 5
         size_y = 2 * nr_plots
-        fig, axes = plt.subplots(nr_plots, 1, figsize=(size_x, size_y))
-        for nr, ax in enumerate(axes):
-            # ax.plot(s_filtered, pars[time_indices[nr], freq_slice], '.-')
-            ax.plot(s, pars[time_indices[nr], :], '.-')
-            ax.axvline(x=s_peak_list[nr], color='k')
+        fig, axes = plt.subplots(nr_plots, 1, figsize=(size_x, size_y),
+                                 squeeze=False)
+        for nr, ax in enumerate(axes[:, 0]):
+            ax.plot(s, m_i[time_indices[nr], :], '.-')
+            for s_peak in s_peaks[nr][~np.isnan(s_peaks[nr])]:
+                ax.axvline(x=s_peak, color='k')
             ax.set_title('Time: {0}'.format(time_indices[nr]))
             ax.invert_xaxis()
         fig.tight_layout()
@@ -247,8 +364,13 @@ def pick_peak(options):
         plt.close(fig)
         del(fig)
 
-    np.savetxt('peaks.dat', f_peak_list)
-    np.savetxt('times.dat', time_indices)
+    # one row per time step, one column per peak (padded with NaN)
+    header = 'peaks 1-{0} of each time step, '.format(options.nr_peaks)
+    np.savetxt('peaks.dat', f_peaks,
+               header=header + 'frequencies [Hz]')
+    np.savetxt('peaks_tau.dat', s_peaks,
+               header=header + 'log10(tau [s])')
+    np.savetxt('times.dat', time_indices, fmt='%i')
     os.chdir(pwd)
 
 